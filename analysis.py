@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+'''
+@time    :   2022/03/22 15:41:08
+@author  :   rosagross
+@contact :   grossmann.rc@gmail.com
+'''
+
+import numpy as np
+import pandas as pd
+
+
+def calc_switch_times(global_log, exclude_first=False, exclude_last=False):
+    """
+    Returns the times between perception switches (button presses) in all rivalry blocks, block after block.
+    The first switch time of a block is the time between the stimulus onset and the first button press.
+
+    Parameters
+    ----------
+    global_log : pandas.DataFrame
+        Log with the phase onsets and responses (onset, trial_nr, block_type)
+    exclude_first : bool
+        Leave out the first switch time of every block (it includes the time until the first percept)
+    exclude_last : bool
+        Leave out the last switch time of every block (the last percept before the block ends)
+    """
+    data_rivalry = global_log.loc[global_log['block_type'] == 'rivalry']
+    # every rivalry block is one trial, the onsets are grouped by block in the order the blocks appear
+    block_codes = pd.factorize(data_rivalry['trial_nr'])[0]
+    order = np.argsort(block_codes, kind='stable')
+    block_codes = block_codes[order]
+    onsets = data_rivalry['onset'].to_numpy(dtype=float)[order]
+
+    # take the previous onset and compare it to the current to get the time between perception switch,
+    # switch time i is the time between onset i and i+1, which have to be in the same block
+    new_block = np.r_[True, block_codes[1:] != block_codes[:-1]]
+    keep = ~new_block[1:]
+    if exclude_first:
+        keep &= ~new_block[:-1]
+    if exclude_last:
+        keep &= ~np.r_[new_block[2:], True]
+    return np.diff(onsets)[keep]
+
+
+def percept_duration_stats(switch_times):
+    """
+    Mean, standard deviation, median and a gamma fit (method of moments) of the switch times.
+    Percept durations in binocular rivalry are roughly gamma distributed.
+    """
+    switch_times = np.asarray(switch_times, dtype=float)
+    mean = switch_times.mean() if len(switch_times) else np.nan
+    var = switch_times.var() if len(switch_times) else np.nan
+    return {'n': len(switch_times),
+            'mean': mean,
+            'std': np.sqrt(var),
+            'median': np.median(switch_times) if len(switch_times) else np.nan,
+            'gamma_shape': mean**2 / var if var > 0 else np.nan,
+            'gamma_scale': var / mean if var > 0 else np.nan}
+
+
+class RunningStats:
+    """
+    Mean and variance of the switch times that are updated with every button press (Welford's algorithm),
+    so the current percept duration statistics can be shown while the session runs.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def update(self, value):
+        """ Adds one switch time. """
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self._m2 += delta * (value - self.mean)
+
+    @property
+    def var(self):
+        """ Variance of the switch times (like numpy, not corrected for the sample size). """
+        return self._m2 / self.n if self.n else np.nan
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+
+def response_summary(response_hand, response_button, expected_responses, unambiguous_responses, rivalry_responses,
+                     correct_responses, response_interval, switch_times_mean, switch_times_std):
+    """ Summary of the participant's responses, saved as *_summary_response_data.npy at the end of the session. """
+    return {"Reponse hand" : response_hand,
+            "Response button" : response_button,
+            "Expected number of responses (unambiguous)": expected_responses,
+            "Subject responses (unambiguous)": unambiguous_responses,
+            "Subject responses (rivalry)" : rivalry_responses,
+            f"Correct responses (within {response_interval}s of physical stimulus change)": correct_responses,
+            "Average percept duration across all rivalry blocks" : switch_times_mean,
+            "Standard deviation percept duration across all rivalry blocks" : switch_times_std}
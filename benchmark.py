@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+'''
+@time    :   2022/04/07 09:51:12
+@author  :   rosagross
+@contact :   grossmann.rc@gmail.com
+
+
+Benchmarks of the session startup, the frame loop and the analysis, run on the headless session of simulation.py.
+The results are written to a JSON file and can be compared to a baseline (a results file of an earlier run),
+the script exits with an error if a benchmark got slower than the baseline allows. benchmark_baseline.json holds
+a reference run, timings of another machine are only comparable to a baseline made on that machine.
+
+    python benchmark.py --output benchmark_results.json                  # measure
+    python benchmark.py --baseline benchmark_baseline.json               # compare against an earlier run
+'''
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import numpy as np
+import os
+import pandas as pd
+import platform
+import sys
+import tempfile
+import time
+from PIL import Image
+from simulation import HeadlessSession, HeadlessStim, SimulatedKey
+from stim_cache import find_image
+from timeline import TRANSITIONS
+
+opj = os.path.join
+
+# the fading images are not needed with the procedural fading, the breaks are shortened
+# and only warnings are logged (the log records are written from a thread, redirecting stdout doesn't stop them)
+BENCHMARK_SETTINGS = {'Fading mode': 'procedural', 'Break duration': 2, 'Profile frames': False, 'Screenshot': False,
+                      'Stimulus cache': None, 'Log level': 'WARNING'}
+
+
+class LoadingSession(HeadlessSession):
+    """ Headless session that decodes its images when the stimuli are created, like ImageStim does (or loads them from the stimulus cache). """
+
+    def create_image(self, image, **kwargs):
+        image = self.load_image(image, **kwargs)
+        if isinstance(image, str):
+            image = Image.open(find_image(image))
+        if isinstance(image, Image.Image):
+            image = np.asarray(image, dtype=np.float32) / 127.5 - 1
+        # the texture is made from all pixels, so a memory-mapped image is read here as well
+        return HeadlessStim(self.win, image=np.array(image, dtype=np.float32), **kwargs)
+
+
+class ResponseKeyboard:
+    """ Keyboard stand-in that returns one released key in every frame (a very high response rate). """
+
+    def __init__(self, session, name='1'):
+        self.session = session
+        self.name = name
+        self.clock = session.kb.clock
+
+    def getKeys(self, waitRelease=True, **kwargs):
+        t = self.clock.getTime()
+        return [SimulatedKey(self.name, t, t, 0.1)]
+
+
+def measure(function, repeat=5, number=1, setup=None, teardown=None):
+    """
+    Times a function (in s per call), returns the median, min, mean and the interquartile mean (the mean of the middle half,
+    which the comparison with a baseline uses, it is less affected by single slow or fast repeats) of the repeats.
+    setup is called before every repeat and its result is passed to the function (and to teardown afterwards),
+    without setup teardown gets what the function returned.
+    """
+    times = []
+    for _ in range(repeat):
+        arg = setup() if setup is not None else None
+        # like timeit, the garbage collector doesn't run while the function is timed (its pauses are the main noise)
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            for _ in range(number):
+                result = function(arg) if setup is not None else function()
+            times.append((time.perf_counter() - start) / number)
+        finally:
+            gc.enable()
+        if teardown is not None:
+            teardown(arg if setup is not None else result)
+    middle = np.sort(times)[repeat//4:repeat - repeat//4]
+    return {'median': float(np.median(times)), 'min': float(np.min(times)), 'mean': float(np.mean(times)),
+            'trimmed': float(np.mean(middle)), 'repeat': repeat, 'number': number}
+
+
+def create_session(output_dir, settings_file, seed=0, session_class=HeadlessSession, settings=None):
+    """ Creates a headless session (its output is not printed). """
+    with contextlib.redirect_stdout(io.StringIO()):
+        return session_class('sub-001_ses-bench', output_dir, settings_file, 1, seed=seed, settings={**BENCHMARK_SETTINGS, **(settings or {})})
+
+
+def close_journal(session):
+    session.journal.close()
+
+
+def first_trial(session, block_type, transition=False):
+    """ Creates the first trial of a block type (for unambiguous blocks a percept or a transition). """
+    for trial in session.create_trials():
+        if (trial.block_type == block_type) and ((trial.color_comb in TRANSITIONS) == transition):
+            return trial
+    raise ValueError(f"the timeline has no {block_type} trial")
+
+
+def large_log(nr_blocks, responses_per_block, seed=0):
+    """ Global log with nr_blocks rivalry blocks and responses_per_block responses in each of them. """
+    rng = np.random.default_rng(seed)
+    blocks = []
+    onset = 0
+    for block in range(nr_blocks):
+        onsets = onset + np.concatenate([[0], np.cumsum(rng.gamma(3.5, 0.7, responses_per_block))])
+        blocks.append(pd.DataFrame({'trial_nr': block + 1, 'onset': onsets,
+                                    'event_type': ['stim'] + ['house_face']*responses_per_block,
+                                    'phase': 0, 'response': [np.nan] + ['1']*responses_per_block,
+                                    'nr_frames': 0, 'block_type': 'rivalry'}))
+        onset = onsets[-1] + 10
+    return pd.concat(blocks, ignore_index=True)
+
+
+def run_benchmarks(settings_file='./settings.yml', repeat=20, frames=20000, responses=2000, log_size=(20, 1000)):
+    """
+    Runs all benchmarks and returns their results (s per call).
+
+    Parameters
+    ----------
+    settings_file : str
+        Settings of the benchmarked sessions (the settings in BENCHMARK_SETTINGS are replaced)
+    repeat : int
+        Number of repeats of every benchmark
+    frames : int
+        Number of frames that are timed for the per frame benchmarks
+    responses : int
+        Number of responses that are logged in the response benchmark
+    log_size : tuple
+        Number of rivalry blocks and responses per block of the large log
+    """
+    results = {}
+    # the session prints a lot while it runs, that is not part of the results
+    with tempfile.TemporaryDirectory() as output_dir, contextlib.redirect_stdout(io.StringIO()):
+        # startup: settings, timeline and stimuli (with decoding the images),
+        # the sessions are closed after every repeat, so their images don't fill the memory
+        results['session_init'] = measure(lambda: create_session(output_dir, settings_file, session_class=LoadingSession), repeat,
+                                          teardown=close_journal)
+        # startup with a warm stimulus cache (the first session fills it)
+        cache_settings = {'Stimulus cache': opj(output_dir, 'stimulus_cache')}
+        close_journal(create_session(output_dir, settings_file, session_class=LoadingSession, settings=cache_settings))
+        results['session_init_cached'] = measure(lambda: create_session(output_dir, settings_file, session_class=LoadingSession, settings=cache_settings),
+                                                 repeat, teardown=close_journal)
+        results['create_blocks'] = measure(lambda session: session.create_blocks(), repeat, setup=lambda: create_session(output_dir, settings_file),
+                                           teardown=close_journal)
+        results['create_stimulus'] = measure(lambda session: session.create_stimulus(), repeat,
+                                             setup=lambda: create_session(output_dir, settings_file, session_class=LoadingSession),
+                                             teardown=close_journal)
+
+        # per frame cost of drawing every kind of stimulus and of get_events without responses
+        session = create_session(output_dir, settings_file)
+        for name, block_type, transition in [('rivalry', 'rivalry', False), ('unambiguous', 'unambiguous', False),
+                                             ('transition', 'unambiguous', True), ('break', 'break', False)]:
+            trial = first_trial(session, block_type, transition)
+            session.current_trial = trial
+            nr_phases = len(trial.phase_durations)
+            results[f'draw_stimulus_{name}'] = measure(
+                lambda: [session.draw_stimulus(frame % nr_phases) for frame in range(frames)], repeat)
+            results[f'draw_stimulus_{name}']['per_frame'] = results[f'draw_stimulus_{name}']['median'] / frames
+
+        session.current_trial = first_trial(session, 'rivalry')
+        results['get_events_idle'] = measure(lambda: [session.current_trial.get_events() for _ in range(frames)], repeat)
+        results['get_events_idle']['per_frame'] = results['get_events_idle']['median'] / frames
+
+        # one response in every frame: the response log grows while the frame loop runs
+        def log_responses(session):
+            for _ in range(responses):
+                session.current_trial.get_events()
+                session.win.flip()
+
+        def response_session():
+            session = create_session(output_dir, settings_file)
+            session.start_experiment()
+            session.current_trial = first_trial(session, 'unambiguous')
+            session.current_trial.log_phase_info()
+            session.kb = ResponseKeyboard(session)
+            return session
+
+        results['get_events_responses'] = measure(log_responses, repeat, setup=response_session, teardown=close_journal)
+        results['get_events_responses']['per_response'] = results['get_events_responses']['median'] / responses
+
+        # analysis at the end of the session on a large log
+        def analysis_session():
+            session = create_session(output_dir, settings_file)
+            session.global_log = large_log(*log_size)
+            return session
+
+        results['calc_percept_durations'] = measure(lambda session: session.calc_percept_durations(), repeat,
+                                                   setup=analysis_session, teardown=close_journal)
+
+        results['save_output'] = measure(lambda session: session.save_output(), repeat, setup=analysis_session, teardown=close_journal)
+        session.journal.close()
+
+    return results
+
+
+def compare(results, baseline, tolerance, min_slowdown=0.001):
+    """
+    Returns the benchmarks whose interquartile mean is more than tolerance (fraction) and more than min_slowdown (s)
+    slower than in the baseline (the absolute floor keeps the timer noise of very short benchmarks from failing the comparison).
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        # baselines written before the interquartile mean was recorded are compared by their median
+        before = baseline[name].get('trimmed', baseline[name]['median'])
+        ratio = result['trimmed'] / before
+        slower = (ratio > 1 + tolerance) and (result['trimmed'] - before > min_slowdown)
+        print(f"    {name:<32} {before*1000:10.3f}ms -> {result['trimmed']*1000:10.3f}ms  ({ratio:.2f}x) {'SLOWER' if slower else 'ok'}")
+        if slower:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the session startup, frame loop and analysis.')
+    parser.add_argument('--settings', default='./settings.yml', help='settings file')
+    parser.add_argument('--output', default='benchmark_results.json', help='file the results are written to')
+    parser.add_argument('--baseline', help='results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed slowdown against the baseline (0.5 = 50%%)')
+    parser.add_argument('--min-slowdown', type=float, default=1.0, help='slowdowns below this many ms are never a regression (default: 1)')
+    parser.add_argument('--repeat', type=int, default=20, help='repeats of every benchmark')
+    parser.add_argument('--frames', type=int, default=20000, help='frames per repeat of the frame benchmarks')
+    parser.add_argument('--responses', type=int, default=2000, help='responses per repeat of the response benchmark')
+    args = parser.parse_args()
+    if (args.baseline is not None) and (os.path.abspath(args.output) == os.path.abspath(args.baseline)):
+        parser.error('--output would overwrite the --baseline it is compared against')
+
+    # the baseline is read before anything is written, so a failed run can't replace it
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+    results = run_benchmarks(args.settings, args.repeat, args.frames, args.responses)
+    for name, result in results.items():
+        print(f"{name:<32} median {result['median']*1000:10.3f}ms  min {result['min']*1000:10.3f}ms  interquartile mean {result['trimmed']*1000:10.3f}ms")
+
+    with open(args.output, 'w') as f:
+        json.dump({'python': platform.python_version(), 'platform': platform.platform(), 'numpy': np.__version__,
+                   'pandas': pd.__version__, 'results': results}, f, indent=4)
+    print(f"results written to {args.output}")
+
+    if baseline is not None:
+        print(f"compared to {args.baseline} (tolerance {args.tolerance:.0%}, at least {args.min_slowdown}ms):")
+        regressions = compare(results, baseline, args.tolerance, args.min_slowdown / 1000)
+        if regressions:
+            print(f"REGRESSION: {', '.join(regressions)} got slower than the baseline allows")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+'''
+@time    :   2022/05/02 10:26:47
+@author  :   rosagross
+@contact :   grossmann.rc@gmail.com
+
+
+Balances the colours of the stimuli (replaces the pixel loops in Playground_binocular_rivalry.ipynb).
+The red stimuli only differ from the grey background in the red channel, the blue ones in the green and
+blue channel, and a rivalry image is the red channel of one stimulus with the green and blue channel of the other.
+The contrast (gain around the background) and brightness (offset) of the red and blue channels are changed
+on the stimulus pixels of all base images at once, the rivalry images are made from the balanced base images
+and the channel statistics are printed, so a red/blue pair can be matched in a few runs:
+
+    python colour_balance.py --blue-offset 2 --output-dir ./stimuli/balanced/
+    python colour_balance.py --match-contrast --output-dir ./stimuli/balanced/ --fading
+
+Without --output-dir only the statistics are printed. The other stimuli are copied to the output directory,
+so 'Stimulus path' can be pointed to it (the stimulus cache decodes the changed images again,
+--fading generates their fading images as well).
+'''
+
+import argparse
+import numpy as np
+import os
+import pandas as pd
+import shutil
+import yaml
+from PIL import Image
+from generate_fading_stimuli import generate_fading_stimuli
+from stim_cache import find_image
+
+opj = os.path.join
+
+# the channels a stimulus of each colour is drawn in (the other channels are the background)
+COLOUR_CHANNELS = {'red': [0], 'blue': [1, 2]}
+BASE_IMAGES = {'house_red': 'red', 'house_blue': 'blue', 'face_red': 'red', 'face_blue': 'blue'}
+# red and blue image every rivalry image is made of
+RIVALRY_IMAGES = {'rivalry_redface': ('face_red', 'house_blue'),
+                  'rivalry_redhouse': ('house_red', 'face_blue')}
+CHANNELS = ['red', 'green', 'blue']
+# relative luminance of the channels (Rec. 709, the monitor is not calibrated, so only a rough guide)
+LUMINANCE_WEIGHTS = np.array([0.2126, 0.7152, 0.0722])
+BACKGROUND = 127
+
+
+def load_images(stim_path, names):
+    """ Loads the images as one (n, height, width, 3) int16 stack (int16, so the balancing can't overflow). """
+    return np.stack([np.asarray(Image.open(find_image(opj(stim_path, name+'.bmp'))).convert('RGB'), dtype=np.int16)
+                     for name in names])
+
+
+def drawn_channels(stats):
+    """ Rows of the statistics of the channels a stimulus is drawn in (all channels of the rivalry images). """
+    channels = {name: [CHANNELS[c] for c in COLOUR_CHANNELS[colour]] for name, colour in BASE_IMAGES.items()}
+    return [channel in channels.get(image, CHANNELS) for image, channel in zip(stats['image'], stats['channel'])]
+
+
+def stimulus_mask(images):
+    """ The stimulus pixels of every image: the pixels whose channels are not all the same (the background is grey). """
+    return (images[..., 0] != images[..., 1]) | (images[..., 1] != images[..., 2])
+
+
+def channel_params(colours, red_gain=1.0, blue_gain=1.0, red_offset=0, blue_offset=0):
+    """ Gain and offset of every channel of every image (n, 3), the channels that are not drawn keep gain 1 and offset 0. """
+    gains = np.ones((len(colours), 3))
+    offsets = np.zeros((len(colours), 3))
+    for i, colour in enumerate(colours):
+        channels = COLOUR_CHANNELS[colour]
+        gains[i, channels] = red_gain if colour == 'red' else blue_gain
+        offsets[i, channels] = red_offset if colour == 'red' else blue_offset
+    return gains, offsets
+
+
+def balance(images, mask, gains, offsets, background=BACKGROUND):
+    """
+    Changes the contrast and brightness of the stimulus pixels of all images at once:
+    value = background + gain*(value - background) + offset, clipped to 0-255.
+
+    Parameters
+    ----------
+    images : numpy.ndarray
+        (n, height, width, 3) images
+    mask : numpy.ndarray
+        (n, height, width) stimulus pixels (see stimulus_mask), the other pixels are not changed
+    gains, offsets : numpy.ndarray
+        (n, 3) gain and offset of every channel of every image
+
+    Returns
+    -------
+    numpy.ndarray
+        (n, height, width, 3) uint8 images
+    """
+    balanced = background + gains[:, None, None, :]*(images - background) + offsets[:, None, None, :]
+    balanced = np.where(mask[..., None], np.clip(np.rint(balanced), 0, 255), images)
+    return balanced.astype(np.uint8)
+
+
+def rivalry_image(red, blue):
+    """ Rivalry image of a red and a blue stimulus: the red channel of red, the green and blue channel of blue. """
+    return np.concatenate([red[..., :1], blue[..., 1:]], axis=-1)
+
+
+def channel_stats(names, images, mask, background=BACKGROUND):
+    """
+    Statistics of every channel on the stimulus pixels of every image: mean, standard deviation, min and max,
+    the mean deviation from the background and the RMS contrast (RMS deviation / background),
+    and the mean luminance of the stimulus pixels.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per image and channel
+    """
+    images = images.astype(np.float64)
+    nr_pixels = np.maximum(mask.sum(axis=(1, 2)), 1)[:, None]
+    weights = mask[..., None]
+    mean = (images*weights).sum(axis=(1, 2)) / nr_pixels
+    std = np.sqrt((((images - mean[:, None, None, :])**2)*weights).sum(axis=(1, 2)) / nr_pixels)
+    deviation = (images - background)*weights
+    rms_contrast = np.sqrt((deviation**2).sum(axis=(1, 2)) / nr_pixels) / background
+    minimum = np.where(weights, images, np.inf).min(axis=(1, 2))
+    maximum = np.where(weights, images, -np.inf).max(axis=(1, 2))
+    luminance = mean @ LUMINANCE_WEIGHTS
+
+    return pd.DataFrame({'image': np.repeat(names, 3), 'channel': CHANNELS*len(names),
+                         'nr_pixels': np.repeat(nr_pixels[:, 0], 3), 'mean': mean.ravel(), 'std': std.ravel(),
+                         'min': minimum.ravel(), 'max': maximum.ravel(),
+                         'mean_deviation': (deviation.sum(axis=(1, 2)) / nr_pixels).ravel(),
+                         'rms_contrast': rms_contrast.ravel(), 'luminance': np.repeat(luminance, 3)})
+
+
+def match_contrast_gain(images, mask, colours, background=BACKGROUND):
+    """ Gain of the blue channels that gives the blue stimuli the same mean RMS contrast as the red ones. """
+    stats = channel_stats(list(map(str, range(len(images)))), images, mask, background)
+    contrast = stats['rms_contrast'].to_numpy().reshape(len(images), 3)
+    red = [contrast[i, COLOUR_CHANNELS['red']].mean() for i, colour in enumerate(colours) if colour == 'red']
+    blue = [contrast[i, COLOUR_CHANNELS['blue']].mean() for i, colour in enumerate(colours) if colour == 'blue']
+    return np.mean(red) / np.mean(blue)
+
+
+def balance_stimuli(stim_path, output_dir=None, red_gain=1.0, blue_gain=1.0, red_offset=0, blue_offset=0, match_contrast=False):
+    """
+    Balances the base images, makes the rivalry images from them and writes all of them to output_dir.
+
+    Parameters
+    ----------
+    stim_path : str
+        Directory of the base images (house_red.bmp, ...)
+    output_dir : str
+        Directory the balanced images are written to (None only computes the statistics)
+    red_gain, blue_gain, red_offset, blue_offset : float
+        Contrast and brightness of the red and blue stimuli (see balance)
+    match_contrast : bool
+        Sets blue_gain so the blue stimuli have the same RMS contrast as the red ones (after red_gain)
+
+    Returns
+    -------
+    tuple
+        Channel statistics (see channel_stats) before and after balancing, and the blue gain that was used
+    """
+    names = list(BASE_IMAGES)
+    colours = list(BASE_IMAGES.values())
+    images = load_images(stim_path, names)
+    mask = stimulus_mask(images)
+
+    if match_contrast:
+        gains, _ = channel_params(colours, red_gain=red_gain)
+        red_balanced = balance(images, mask, gains, np.zeros_like(gains))
+        blue_gain = match_contrast_gain(red_balanced, mask, colours)
+    gains, offsets = channel_params(colours, red_gain, blue_gain, red_offset, blue_offset)
+    balanced = balance(images, mask, gains, offsets)
+
+    base = dict(zip(names, balanced))
+    rivalry = {name: rivalry_image(base[red], base[blue]) for name, (red, blue) in RIVALRY_IMAGES.items()}
+    all_names = names + list(rivalry)
+    original = np.concatenate([images, np.stack([rivalry_image(images[names.index(red)], images[names.index(blue)])
+                                                 for red, blue in RIVALRY_IMAGES.values()])])
+    result = np.concatenate([balanced, np.stack(list(rivalry.values()))])
+    stimulus = stimulus_mask(original)
+
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+        written = set()
+        for name, image in zip(all_names, result):
+            # keeps the name of the original file (the stimuli are saved with upper case extensions)
+            path = opj(output_dir, os.path.basename(find_image(opj(stim_path, name+'.bmp'))))
+            Image.fromarray(image, 'RGB').save(path, format='BMP')
+            written.add(os.path.basename(path))
+        if os.path.abspath(output_dir) != os.path.abspath(stim_path):
+            for file in sorted(os.listdir(stim_path)):
+                if (file not in written) and file.lower().endswith('.bmp'):
+                    shutil.copy2(opj(stim_path, file), output_dir)
+    return channel_stats(all_names, original, stimulus), channel_stats(all_names, result, stimulus), blue_gain
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Balance the colours of the red and blue stimuli.')
+    parser.add_argument('--settings', default='./settings.yml', help='settings file with the stimulus path')
+    parser.add_argument('--stim-path', help='overrides "Stimulus path" from the settings')
+    parser.add_argument('--output-dir', help='directory the balanced images are written to (default: only print the statistics)')
+    parser.add_argument('--red-gain', type=float, default=1.0, help='contrast of the red stimuli')
+    parser.add_argument('--blue-gain', type=float, default=1.0, help='contrast of the blue stimuli')
+    parser.add_argument('--red-offset', type=float, default=0, help='added to the red channel of the red stimuli')
+    parser.add_argument('--blue-offset', type=float, default=0, help='added to the green and blue channel of the blue stimuli')
+    parser.add_argument('--match-contrast', action='store_true', help='set the blue gain so blue and red have the same RMS contrast')
+    parser.add_argument('--fading', action='store_true', help='generate the fading images of the balanced images as well')
+    parser.add_argument('--stats', help='write the channel statistics to this .tsv file')
+    args = parser.parse_args()
+
+    with open(args.settings) as f:
+        task_settings = yaml.safe_load(f)['Task settings']
+    stim_path = task_settings['Stimulus path'] if args.stim_path is None else args.stim_path
+    before, after, blue_gain = balance_stimuli(stim_path, args.output_dir, args.red_gain, args.blue_gain,
+                                               args.red_offset, args.blue_offset, args.match_contrast)
+
+    columns = ['image', 'channel', 'mean', 'std', 'min', 'max', 'mean_deviation', 'rms_contrast', 'luminance']
+    drawn = drawn_channels(after)
+    print("stimulus pixels before balancing:")
+    print(before.loc[drawn, columns].to_string(index=False, float_format='{:.3f}'.format))
+    print(f"after balancing (red gain {args.red_gain:.3f}, blue gain {blue_gain:.3f}, red offset {args.red_offset}, blue offset {args.blue_offset}):")
+    print(after.loc[drawn, columns].to_string(index=False, float_format='{:.3f}'.format))
+    if args.stats is not None:
+        pd.concat([before.assign(balanced=False), after.assign(balanced=True)]).to_csv(args.stats, sep='\t', index=False)
+
+    if args.output_dir is not None:
+        print(f"wrote {len(BASE_IMAGES) + len(RIVALRY_IMAGES)} balanced images to {args.output_dir}")
+        if args.fading and (task_settings['Nr fading stimuli'] != 0):
+            generate_fading_stimuli(args.output_dir, task_settings['Nr fading stimuli'], transition=task_settings['Transition type'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+'''
+@time    :   2022/04/12 10:03:41
+@author  :   rosagross
+@contact :   grossmann.rc@gmail.com
+
+
+Typed binary output of a session, written next to the events.tsv if 'Columnar output' is set:
+- <output_str>_events/: one .npy file per column of the events.tsv and a schema.json with the dtypes,
+  every column can be memory-mapped and read without the others
+- <output_str>_summary.npy: the response summary as one record with a fixed dtype (SUMMARY_DTYPE), no pickle
+
+Sessions that were saved before can be converted with: python columnar.py output_data/*
+'''
+
+import argparse
+import glob
+import json
+import numpy as np
+import os
+import pandas as pd
+import re
+
+opj = os.path.join
+
+SUMMARY_DTYPE = np.dtype([('response_hand', 'U16'),
+                          ('response_button', 'U16'),
+                          ('expected_responses', np.float64),
+                          ('unambiguous_responses', np.int64),
+                          ('rivalry_responses', np.int64),
+                          ('correct_responses', np.int64),
+                          ('response_interval_min', np.float64),
+                          ('response_interval_max', np.float64),
+                          ('switch_times_mean', np.float64),
+                          ('switch_times_std', np.float64)])
+
+# field of SUMMARY_DTYPE of every key in the response summary dict (analysis.response_summary)
+SUMMARY_COLUMNS = {'Reponse hand': 'response_hand',
+                   'Response button': 'response_button',
+                   'Expected number of responses (unambiguous)': 'expected_responses',
+                   'Subject responses (unambiguous)': 'unambiguous_responses',
+                   'Subject responses (rivalry)': 'rivalry_responses',
+                   'Average percept duration across all rivalry blocks': 'switch_times_mean',
+                   'Standard deviation percept duration across all rivalry blocks': 'switch_times_std',
+                   # older sessions have a typo in it
+                   'Stadard deviation percept duration across all rivalry blocks': 'switch_times_std'}
+# the key of the correct responses holds the response interval
+CORRECT_RESPONSES_KEY = re.compile(r'Correct responses \(within \[([\d.]+),\s*([\d.]+)\]s of physical stimulus change\)')
+
+# columns of the events.tsv that always hold text (the response keys would be read as numbers otherwise)
+TEXT_COLUMNS = ['event_type', 'response', 'block_type', 'trial_type', 'color_comb', 'response_hand', 'response_button']
+
+
+def summary_path(output_dir, output_str):
+    return opj(output_dir, output_str+'_summary.npy')
+
+
+def write_events_columns(global_log, path):
+    """
+    Writes every column of the log as a typed .npy file into the directory path.
+    Text columns are saved as fixed width strings (missing values as ''), numbers as float or int.
+    """
+    os.makedirs(path, exist_ok=True)
+    schema = {'nr_rows': len(global_log), 'columns': {}}
+    for column in global_log.columns:
+        values = global_log[column]
+        if pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+            values = values.to_numpy()
+        else:
+            values = values.astype(object).fillna('').to_numpy().astype(str)
+        np.save(opj(path, f'{column}.npy'), values)
+        schema['columns'][column] = values.dtype.str
+    with open(opj(path, 'schema.json'), 'w') as f:
+        json.dump(schema, f, indent=4)
+
+
+def read_events_tsv(path):
+    """ Reads an events.tsv with the text columns as text. """
+    global_log = pd.read_csv(path, sep='\t', dtype={column: str for column in TEXT_COLUMNS})
+    return global_log
+
+
+def events_tsv_to_columns(path):
+    """ Converts an <output_str>_events.tsv into the columnar <output_str>_events/ directory, returns its path. """
+    columns_path = path[:-len('.tsv')]
+    write_events_columns(read_events_tsv(path), columns_path)
+    return columns_path
+
+
+def load_events(path, columns=None, mmap_mode='r', as_frame=True):
+    """
+    Loads columns of a session's events.
+
+    Parameters
+    ----------
+    path : str
+        Path of the <output_str>_events/ directory
+    columns : list
+        Columns that are loaded (default: all), the others are not read
+    mmap_mode : str
+        Memory-maps the columns (see numpy.load), None reads them into memory
+    as_frame : bool
+        Returns a DataFrame (empty text is NaN again) instead of a dict of arrays
+
+    Returns
+    -------
+    pandas.DataFrame or dict
+    """
+    with open(opj(path, 'schema.json')) as f:
+        schema = json.load(f)
+    columns = list(schema['columns']) if columns is None else columns
+    arrays = {column: np.load(opj(path, f'{column}.npy'), mmap_mode=mmap_mode) for column in columns}
+    if not as_frame:
+        return arrays
+    frame = pd.DataFrame(arrays)
+    for column in columns:
+        if arrays[column].dtype.kind == 'U':
+            frame[column] = frame[column].astype(object).where(frame[column] != '')
+    return frame
+
+
+def summary_to_array(summary):
+    """ Converts a response summary dict (see analysis.response_summary) into a record with SUMMARY_DTYPE. """
+    record = np.zeros(1, dtype=SUMMARY_DTYPE)
+    # fields that are not in the summary are missing values
+    for field in SUMMARY_DTYPE.names:
+        kind = SUMMARY_DTYPE[field].kind
+        record[field] = '' if kind == 'U' else -1 if kind == 'i' else np.nan
+
+    for key, value in summary.items():
+        correct = CORRECT_RESPONSES_KEY.fullmatch(key)
+        if correct is not None:
+            record['correct_responses'] = value
+            record['response_interval_min'], record['response_interval_max'] = (float(t) for t in correct.groups())
+        elif (key in SUMMARY_COLUMNS) and (value is not None):
+            record[SUMMARY_COLUMNS[key]] = value
+    return record
+
+
+def write_summary(summary, path):
+    """ Saves a response summary dict as record with SUMMARY_DTYPE (can be loaded without allow_pickle). """
+    np.save(path, summary_to_array(summary))
+
+
+def load_summary(path):
+    """ Loads a summary that was saved with write_summary, returns it as dict of field and value. """
+    record = np.load(path)[0]
+    return {field: record[field].item() for field in SUMMARY_DTYPE.names}
+
+
+def convert_session(session_dir):
+    """ Writes the columnar files of a session that was saved with the events.tsv and pickled summary only. """
+    for path in glob.glob(opj(session_dir, '*_events.tsv')):
+        output_str = os.path.basename(path)[:-len('_events.tsv')]
+        events_tsv_to_columns(path)
+        pickled_path = opj(session_dir, output_str+'_summary_response_data.npy')
+        if os.path.exists(pickled_path):
+            write_summary(np.load(pickled_path, allow_pickle=True).item(), summary_path(session_dir, output_str))
+        print(f"converted {output_str}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write the columnar events and summary of saved sessions.')
+    parser.add_argument('session_dirs', nargs='+', help='session directories (e.g. output_data/*)')
+    args = parser.parse_args()
+    for session_dir in args.session_dirs:
+        convert_session(session_dir)
+
+
+if __name__ == '__main__':
+    main()
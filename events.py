@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+'''
+@time    :   2022/03/21 10:14:52
+@author  :   rosagross
+@contact :   grossmann.rc@gmail.com
+'''
+
+import argparse
+import json
+import numpy as np
+import os
+import pandas as pd
+import queue
+import threading
+import time
+from analysis import calc_switch_times, response_summary
+
+opj = os.path.join
+
+
+class EventBuffer:
+    """
+    Column-wise buffer for the responses that are logged during the frame loop.
+    Every column is a preallocated numpy array that doubles its size when it is full,
+    so appending a response does not reallocate a DataFrame. The buffer is only converted
+    into a DataFrame when the output is saved.
+    """
+
+    def __init__(self, dtypes, capacity=256):
+        """
+        Parameters
+        ----------
+        dtypes : dict
+            Numpy dtype of every column that is known beforehand (e.g. {'onset': float}).
+            Columns that are not listed are added as object columns when they are first appended.
+        capacity : int
+            Number of rows that are allocated in the beginning
+        """
+        self.capacity = capacity
+        self.nr_rows = 0
+        self.columns = {}
+        for column, dtype in dtypes.items():
+            self._add_column(column, dtype)
+
+    def __len__(self):
+        return self.nr_rows
+
+    def _add_column(self, column, dtype=object):
+        # rows that were appended before this column existed are empty (NaN)
+        values = np.empty(self.capacity, dtype=dtype)
+        if values.dtype.kind in 'fO':
+            values[:self.nr_rows] = np.nan
+        self.columns[column] = values
+
+    def _grow(self):
+        self.capacity *= 2
+        for column, values in self.columns.items():
+            grown = np.empty(self.capacity, dtype=values.dtype)
+            grown[:self.nr_rows] = values[:self.nr_rows]
+            self.columns[column] = grown
+
+    def append(self, row):
+        """ Appends one row (dict with column name and value), returns its index. """
+        if self.nr_rows == self.capacity:
+            self._grow()
+        idx = self.nr_rows
+        for column, val in row.items():
+            if column not in self.columns:
+                self._add_column(column)
+            self.columns[column][idx] = val
+        self.nr_rows += 1
+        return idx
+
+    def set(self, idx, column, value):
+        """ Replaces the value of a column in a row that was appended before. """
+        self.columns[column][idx] = value
+
+    def clear(self):
+        """ Removes all rows (the allocated columns are kept). """
+        self.nr_rows = 0
+
+    def last(self, column):
+        """ Value of the column in the last row (None if the buffer is empty). """
+        if self.nr_rows == 0:
+            return None
+        return self.columns[column][self.nr_rows-1]
+
+    def to_frame(self):
+        """ Returns the buffered rows as DataFrame. """
+        return pd.DataFrame({column: values[:self.nr_rows] for column, values in self.columns.items()})
+
+
+def merge_logs(global_log, buffer):
+    """
+    Merges the buffered responses into the global log, the result is the same log that would be built by
+    appending every response to the global log directly. Every response holds the length of the global log
+    when it was logged ('log_position'), it is inserted after these rows (responses with the same position
+    keep the order they were logged in).
+    """
+    if len(buffer) == 0:
+        return global_log
+    responses = buffer.to_frame()
+    positions = responses.pop('log_position').to_numpy()
+    # rows are ordered by their position in the log, a response comes after the row before its position
+    order = np.argsort(np.concatenate([np.arange(len(global_log)), positions - 0.5]), kind='stable')
+    return pd.concat([global_log, responses], ignore_index=True).iloc[order].reset_index(drop=True)
+
+
+def _to_json(value):
+    # numpy scalars (e.g. trial numbers) are converted to python values
+    return value.item() if hasattr(value, 'item') else str(value)
+
+
+class EventJournal:
+    """
+    Append-only journal (one JSON record per line) of every phase onset and response of a session.
+    Records are put into a queue on the render thread and written by a background thread,
+    which flushes and syncs the file after every batch, so a crash only loses the last few records.
+    The events.tsv and the response summary can be rebuilt from the journal with recover_journal.
+    """
+
+    def __init__(self, path, sync_interval=0.5):
+        """
+        Parameters
+        ----------
+        path : str
+            Path of the journal file (*_journal.jsonl)
+        sync_interval : float
+            Maximum time in s between two syncs of the file to disk
+        """
+        self.path = path
+        self.sync_interval = sync_interval
+        self._queue = queue.SimpleQueue()
+        self._file = open(path, 'a', buffering=1)
+        self._thread = threading.Thread(target=self._write_records, name='EventJournal', daemon=True)
+        self._thread.start()
+
+    def write(self, record_type, **record):
+        """ Queues one record, this never blocks. """
+        record['type'] = record_type
+        record['time'] = time.time()
+        self._queue.put(record)
+
+    def _write_records(self):
+        last_sync = time.monotonic()
+        while True:
+            records = [self._queue.get()]
+            # write everything that is queued in one batch
+            while True:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            for record in records:
+                if record is None:
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+                    self._file.close()
+                    return
+                self._file.write(json.dumps(record, default=_to_json) + '\n')
+            self._file.flush()
+            if time.monotonic() - last_sync > self.sync_interval:
+                os.fsync(self._file.fileno())
+                last_sync = time.monotonic()
+
+    def close(self):
+        """ Writes all queued records and closes the file. """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+
+def read_journal(path):
+    """ Reads all complete records of a journal (a line cut off by a crash is skipped). """
+    records = []
+    with open(path) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+    return records
+
+
+def write_events_tsv(global_log, path, exp_start, exp_stop, nr_frames):
+    """
+    Writes the global log to the events.tsv the same way exptools2 does when the session is closed
+    (onset_abs, duration and nr_frames of every phase).
+    """
+    global_log = global_log.set_index('trial_nr')
+    global_log['onset_abs'] = global_log['onset'] + exp_start
+
+    # Only non-responses have a duration
+    nonresp_idx = ~global_log.event_type.isin(['response', 'trigger', 'pulse'])
+    last_phase_onset = global_log.loc[nonresp_idx, 'onset'].iloc[-1]
+    dur_last_phase = exp_stop - last_phase_onset
+    durations = np.append(global_log.loc[nonresp_idx, 'onset'].diff().values[1:], dur_last_phase)
+    global_log.loc[nonresp_idx, 'duration'] = durations
+
+    # Same for nr frames
+    phase_nr_frames = np.append(global_log.loc[nonresp_idx, 'nr_frames'].values[1:], nr_frames)
+    global_log.loc[nonresp_idx, 'nr_frames'] = phase_nr_frames.astype(int)
+
+    global_log = global_log.round({'onset': 5, 'onset_abs': 5, 'duration': 5})
+    global_log.to_csv(path, sep='\t', index=True)
+
+
+def recover_journal(path, output_dir=None):
+    """
+    Rebuilds the events.tsv and the response summary of a session from its (possibly incomplete) journal.
+
+    Parameters
+    ----------
+    path : str
+        Path of the journal (<output_str>_journal.jsonl)
+    output_dir : str
+        Directory for the recovered files (default: directory of the journal)
+
+    Returns
+    -------
+    tuple
+        Paths of the events.tsv and the summary file
+    """
+    records = read_journal(path)
+    session = next(record for record in records if record['type'] == 'session')
+    starts = [record for record in records if record['type'] == 'start']
+    output_dir = os.path.dirname(path) if output_dir is None else output_dir
+    os.makedirs(output_dir, exist_ok=True)
+    output_str = session['output_str']
+
+    columns = ['trial_nr', 'onset', 'event_type', 'phase', 'response', 'nr_frames']
+    rows = [{k: v for k, v in record.items() if k not in ('type', 'time', 'correct')}
+            for record in records if record['type'] in ('phase', 'response')]
+    # responses that were logged at key-down get their key duration from the release record
+    releases = {(record['onset'], record['response']): record['key_duration'] for record in records if record['type'] == 'release'}
+    for row in rows:
+        if (row.get('onset'), row.get('response')) in releases:
+            row['key_duration'] = releases[(row['onset'], row['response'])]
+    # the records are in the order they were logged, like the rows of the global log
+    global_log = pd.concat([pd.DataFrame(columns=columns), pd.DataFrame(rows)], ignore_index=True).infer_objects()
+
+    # without a stop record, the session ends with the last event that made it into the journal
+    exp_start = starts[0]['exp_start'] if starts else 0
+    stops = [record for record in records if record['type'] == 'stop']
+    exp_stop = stops[-1]['exp_stop'] if stops else global_log['onset'].max()
+    nr_frames = stops[-1]['nr_frames'] if stops else 0
+    events_path = opj(output_dir, output_str+'_events.tsv')
+    write_events_tsv(global_log, events_path, exp_start, exp_stop, nr_frames)
+
+    responses = [record for record in records if record['type'] == 'response']
+    # replay responses are journaled with 'correct' as well, but the summary only counts the unambiguous ones
+    unambiguous = [record for record in responses if record['block_type'] == 'unambiguous']
+    # like save_output, older journals don't have the setting
+    exclude = session.get('exclude_first_last', False)
+    switch_times = calc_switch_times(global_log, exclude_first=exclude, exclude_last=exclude)
+    summary = response_summary(session['response_hand'], session['response_button'],
+                               session['nr_unambiguous_trials'] - (session['n_blocks']/2), len(unambiguous),
+                               sum(record['block_type'] == 'rivalry' for record in responses),
+                               sum(bool(record.get('correct')) for record in unambiguous),
+                               session['response_interval'], switch_times.mean(), switch_times.std())
+    summary_path = opj(output_dir, output_str+'_summary_response_data.npy')
+    np.save(summary_path, summary)
+    print(f"recovered {len(rows)} events from {path}")
+    return events_path, summary_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild the events.tsv and response summary of a session from its journal.')
+    parser.add_argument('journal', help='path of the <output_str>_journal.jsonl file')
+    parser.add_argument('--output-dir', help='directory for the recovered files (default: directory of the journal)')
+    args = parser.parse_args()
+    recover_journal(args.journal, args.output_dir)
+
+
+if __name__ == '__main__':
+    main()
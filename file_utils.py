@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+'''
+@time    :   2022/04/27 16:05:48
+@author  :   rosagross
+@contact :   grossmann.rc@gmail.com
+
+
+Content hashes and modification times of files, used by the caches (group_analysis.py, stim_cache.py)
+to find out if the files they were made from changed.
+'''
+
+import hashlib
+import os
+
+
+def files_hash(paths):
+    """ Content hash of the files. """
+    sha = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+def files_mtime(paths):
+    """ Modification times and sizes of the files, these are compared before the files are hashed. """
+    return [[os.stat(path).st_mtime_ns, os.stat(path).st_size] for path in paths]
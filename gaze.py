@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+'''
+@time    :   2022/04/19 10:31:56
+@author  :   rosagross
+@contact :   grossmann.rc@gmail.com
+
+
+Aligns the gaze samples of an eyetracking session (the EyeLink .edf converted with edf2asc) to the events
+of the session and summarizes the gaze during every percept of the rivalry blocks:
+
+    python gaze.py sub-xxx_ses-x.asc output_data/sub-xxx_ses-x_Logs_binocular_rivalry/sub-xxx_ses-x_events.tsv
+
+The session clock is mapped to the tracker clock with the messages the session sends (phase onsets and key presses),
+the samples are read in chunks and assigned to the percepts with a search over the sorted percept onsets,
+so the recording never has to fit into memory.
+'''
+
+import argparse
+import io
+import numpy as np
+import os
+import pandas as pd
+import re
+from columnar import read_events_tsv
+from group_analysis import label_blocks
+
+opj = os.path.join
+
+# messages sent by exptools2 at every phase onset and by BRTrial.get_events for every key press
+PHASE_MESSAGE = re.compile(r'start_type-(?P<event_type>.+?)_trial-(?P<trial_nr>\d+)_phase-(?P<phase>\d+)$')
+KEY_MESSAGE = re.compile(r'start_type-(?P<event_type>.+?)_trial-(?P<trial_nr>\d+)_phase-(?P<phase>\d+)'
+                         r'_key-(?P<key>.+?)_time-(?P<time>[-\d.e]+)_duration-')
+
+# per percept sums that are accumulated over the chunks of samples
+SUMS = ['nr_samples', 'nr_missing', 'x', 'y', 'x2', 'y2', 'pupil', 'velocity_x', 'abs_velocity_x', 'nr_velocity']
+
+
+def read_messages(path):
+    """
+    Reads the messages of an .asc file (only the MSG lines are parsed).
+    A number in front of the message text is the offset (ms) it was sent with (see tracker.TrackerQueue),
+    it is subtracted from the time.
+
+    Returns
+    -------
+    pandas.DataFrame
+        time (tracker ms) and text of every message
+    """
+    times, texts = [], []
+    with open(path) as f:
+        for line in f:
+            if not line.startswith('MSG'):
+                continue
+            _, rest = line.rstrip('\n').split('\t', 1)
+            t, _, text = rest.partition(' ')
+            offset, _, offset_text = text.partition(' ')
+            if offset.isdigit() and offset_text:
+                t, text = int(t) - int(offset), offset_text
+            times.append(int(t))
+            texts.append(text)
+    return pd.DataFrame({'time': np.array(times, dtype=np.int64), 'text': texts})
+
+
+def read_samples(path, chunk_size=500000):
+    """
+    Reads the gaze samples of an .asc file in chunks of chunk_size lines.
+    Missing values (e.g. in blinks, '.' in the file) are NaN.
+
+    Yields
+    ------
+    pandas.DataFrame
+        time (tracker ms), x, y (pixels) and pupil of the samples in the chunk
+    """
+    with open(path) as f:
+        while True:
+            lines = [line for _, line in zip(range(chunk_size), f)]
+            if not lines:
+                return
+            # sample lines start with their time, all other lines (messages, events) start with a word
+            samples = ''.join(line for line in lines if line[:1].isdigit())
+            if samples:
+                yield pd.read_csv(io.StringIO(samples), sep=r'\s+', header=None, usecols=[0, 1, 2, 3],
+                                  names=['time', 'x', 'y', 'pupil'], na_values='.', engine='c')
+
+
+def clock_sync(messages, events):
+    """
+    Fits the tracker time (s) as linear function of the session time (offset and drift of the clocks).
+    Key press messages hold their session time, phase onset messages are matched to the phase onsets
+    in the events (by trial and phase).
+
+    Returns
+    -------
+    numpy.ndarray
+        slope and intercept, tracker_time = slope*session_time + intercept
+    """
+    session_times, tracker_times = [], []
+    keys = messages['text'].str.extract(KEY_MESSAGE)
+    is_key = keys['time'].notna()
+    session_times.extend(keys.loc[is_key, 'time'].astype(float))
+    tracker_times.extend(messages.loc[is_key, 'time'] / 1000)
+
+    phases = messages['text'].str.extract(PHASE_MESSAGE).dropna()
+    if len(phases):
+        phases = phases.astype({'trial_nr': int, 'phase': int})
+        # a trial number is used by several trials (e.g. the breaks), the phase messages and onsets are paired in order
+        phases['nr'] = phases.groupby(['trial_nr', 'phase']).cumcount()
+        onsets = events[events['response'].isna()].assign(nr=lambda e: e.groupby(['trial_nr', 'phase']).cumcount())
+        matched = phases.reset_index().merge(onsets[['trial_nr', 'phase', 'nr', 'onset']], on=['trial_nr', 'phase', 'nr'])
+        session_times.extend(matched['onset'])
+        tracker_times.extend(messages.loc[matched['index'], 'time'].to_numpy() / 1000)
+
+    if len(session_times) < 2:
+        raise ValueError("the .asc file does not have enough messages of the session to align the clocks")
+    return np.polyfit(np.asarray(session_times, dtype=float), np.asarray(tracker_times, dtype=float), 1)
+
+
+def percepts(events):
+    """
+    The percepts in the rivalry blocks: every key press starts a percept that lasts until the next key press
+    or the end of the block.
+
+    Returns
+    -------
+    pandas.DataFrame
+        block_ID, percept (nr in the block), key, start and stop (session time, s) of every percept
+    """
+    events = events.sort_values('onset', kind='mergesort', ignore_index=True)
+    events['block_ID'] = label_blocks(events)
+    # the block ends with the onset of the first event after it
+    rivalry = events['block_type'] == 'rivalry'
+    ends = events['onset'].shift(-1).where(rivalry & (events['block_type'].shift(-1) != 'rivalry'))
+    events['block_end'] = ends.groupby(events['block_ID']).transform('max')
+
+    presses = events[rivalry & events['response'].notna()].copy()
+    presses['stop'] = presses.groupby('block_ID')['onset'].shift(-1).fillna(presses['block_end'])
+    presses['percept'] = presses.groupby('block_ID').cumcount()
+    return presses.rename(columns={'onset': 'start', 'response': 'key'})[['block_ID', 'percept', 'key', 'start', 'stop']] \
+        .dropna(subset=['stop']).reset_index(drop=True)
+
+
+def assign_samples(sample_times, starts, stops):
+    """
+    As-of join of the samples to intervals: index of the interval each sample falls into (-1 if none).
+    starts have to be sorted, the intervals must not overlap.
+    """
+    idx = np.searchsorted(starts, sample_times, side='right') - 1
+    inside = (idx >= 0) & (sample_times < stops[np.maximum(idx, 0)])
+    return np.where(inside, idx, -1)
+
+
+def gaze_per_percept(asc_path, events, chunk_size=500000):
+    """
+    Summarizes the gaze during every percept of the rivalry blocks: mean and standard deviation
+    of the position (fixation stability), mean pupil size, share of missing samples and the mean (signed
+    and absolute) horizontal velocity (slow phases of an optokinetic nystagmus show up in the signed velocity).
+
+    Parameters
+    ----------
+    asc_path : str
+        Path of the .asc file
+    events : pandas.DataFrame
+        Events of the session (see columnar.read_events_tsv)
+    chunk_size : int
+        Number of lines of the .asc file that are read at once
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per percept
+    """
+    table = percepts(events)
+    slope, intercept = clock_sync(read_messages(asc_path), events)
+    starts = ((slope * table['start'] + intercept) * 1000).to_numpy()
+    stops = ((slope * table['stop'] + intercept) * 1000).to_numpy()
+
+    sums = {name: np.zeros(len(table)) for name in SUMS}
+    previous = None
+    for samples in read_samples(asc_path, chunk_size):
+        # the last sample of the previous chunk is needed for the velocity of the first one
+        if previous is not None:
+            samples = pd.concat([previous, samples], ignore_index=True)
+        time = samples['time'].to_numpy(dtype=float)
+        x, y, pupil = (samples[column].to_numpy(dtype=float) for column in ('x', 'y', 'pupil'))
+        percept = assign_samples(time, starts, stops)
+        new = np.ones(len(samples), dtype=bool)
+        if previous is not None:
+            new[0] = False
+
+        valid = new & (percept >= 0)
+        present = valid & ~np.isnan(x) & ~np.isnan(y)
+        idx = percept[valid]
+        sums['nr_samples'] += np.bincount(idx, minlength=len(table))
+        sums['nr_missing'] += np.bincount(percept[valid & ~present], minlength=len(table))
+        for name, values in [('x', x), ('y', y), ('x2', x**2), ('y2', y**2), ('pupil', pupil)]:
+            sums[name] += np.bincount(percept[present], weights=values[present], minlength=len(table))
+
+        velocity = np.diff(x) / (np.diff(time) / 1000)
+        has_velocity = present[1:] & ~np.isnan(velocity) & (percept[1:] == percept[:-1])
+        idx = percept[1:][has_velocity]
+        sums['velocity_x'] += np.bincount(idx, weights=velocity[has_velocity], minlength=len(table))
+        sums['abs_velocity_x'] += np.bincount(idx, weights=np.abs(velocity[has_velocity]), minlength=len(table))
+        sums['nr_velocity'] += np.bincount(idx, minlength=len(table))
+        previous = samples.iloc[[-1]]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        nr_present = sums['nr_samples'] - sums['nr_missing']
+        table['nr_samples'] = sums['nr_samples'].astype(int)
+        table['missing'] = sums['nr_missing'] / sums['nr_samples']
+        table['x_mean'] = sums['x'] / nr_present
+        table['y_mean'] = sums['y'] / nr_present
+        table['x_std'] = np.sqrt(sums['x2'] / nr_present - table['x_mean']**2)
+        table['y_std'] = np.sqrt(sums['y2'] / nr_present - table['y_mean']**2)
+        table['pupil_mean'] = sums['pupil'] / nr_present
+        table['velocity_x'] = sums['velocity_x'] / sums['nr_velocity']
+        table['abs_velocity_x'] = sums['abs_velocity_x'] / sums['nr_velocity']
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize the gaze during every percept of the rivalry blocks.')
+    parser.add_argument('asc', help='gaze samples of the session (.edf converted with edf2asc)')
+    parser.add_argument('events', help='<output_str>_events.tsv of the session')
+    parser.add_argument('--output', help='default: <output_str>_gaze_percepts.tsv next to the events.tsv')
+    parser.add_argument('--chunk-size', type=int, default=500000, help='lines of the .asc file that are read at once')
+    args = parser.parse_args()
+
+    table = gaze_per_percept(args.asc, read_events_tsv(args.events), args.chunk_size)
+    output = args.output or args.events[:-len('_events.tsv')] + '_gaze_percepts.tsv'
+    table.to_csv(output, sep='\t', index=False)
+    print(f"wrote the gaze of {len(table)} percepts to {output}")
+
+
+if __name__ == '__main__':
+    main()
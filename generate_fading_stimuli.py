@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+'''
+@time    :   2022/03/14 11:02:41
+@author  :   rosagross
+@contact :   grossmann.rc@gmail.com
+
+
+Generates the transition images (stimuli/fading/<transition>_<pair>_<i>.bmp) and their frame stacks
+(stimuli/fading/<transition>_<pair>.npy) between the unambiguous stimuli. The transition is either
+'fading' (contrast fading) or 'wave' (a wave travelling over the stimulus that replaces the pixels).
+All steps of one pair are computed in one go and written in parallel. A pair is skipped
+if its base images and the transition parameters did not change since the last run.
+
+Usage: python generate_fading_stimuli.py [--settings ./settings.yml] [--transition fading/wave] [--workers 4] [--force]
+'''
+
+import argparse
+import hashlib
+import numpy as np
+import os
+import yaml
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+from stim import alpha_ramp
+from stim_cache import find_image
+
+opj = os.path.join
+
+# source (fades in) and destination (fades out) image of every fading pair
+FADING_PAIRS = {'hb2fr': ('face_red.bmp', 'house_blue.bmp'),
+                'hr2fb': ('house_red.bmp', 'face_blue.bmp')}
+TRANSITIONS = ['fading', 'wave']
+WAVE_DIRECTIONS = ['down', 'up', 'right', 'left']
+WAVE_PATTERNS = ['regular', 'random']
+
+
+def load_rgba(path):
+    """ Loads an image as (height, width, 4) uint8 array. """
+    return np.asarray(Image.open(path).convert('RGBA'))
+
+
+def alpha_values(nr_fading_stimuli):
+    """ Alpha values (1-255) of the source and destination image for every fading step. """
+    src_alpha, dst_alpha = alpha_ramp(nr_fading_stimuli)
+    return np.rint(src_alpha*255).astype(np.uint8), np.rint(dst_alpha*255).astype(np.uint8)
+
+
+def alpha_composite_transitions(src, dst, src_alpha, dst_alpha):
+    """
+    Alpha composite of src over dst for several fading steps at once
+    (same computation as alpha_composite_transitions in generate_fading_stimuli.ipynb).
+
+    Parameters
+    ----------
+    src, dst : numpy.ndarray
+        (height, width, 4) uint8 RGBA images
+    src_alpha, dst_alpha : numpy.ndarray
+        (N,) alpha values (0-255) of src and dst for every fading step
+
+    Returns
+    -------
+    numpy.ndarray
+        (N, height, width, 4) uint8 array with one composite per fading step
+    """
+    src_a = (np.asarray(src_alpha, dtype=np.uint8)/255.0)[:, None, None, None]
+    dst_a = (np.asarray(dst_alpha, dtype=np.uint8)/255.0)[:, None, None, None]
+    out_a = src_a + dst_a*(1-src_a)
+
+    out = np.empty((len(src_a),) + src.shape, dtype=np.uint8)
+    with np.errstate(invalid='ignore'):
+        out[..., :3] = (src[:, :, :3]*src_a + dst[:, :, :3]*dst_a*(1-src_a))/out_a
+    out[..., 3:] = np.broadcast_to(out_a*255, out[..., 3:].shape)
+    return out
+
+
+def stimulus_span(src, dst):
+    """ Returns the (start, stop) rows and columns of the region where src and dst differ. """
+    rows, cols = np.nonzero(np.any(src != dst, axis=-1))
+    return (rows.min(), rows.max()+1), (cols.min(), cols.max()+1)
+
+
+def van_der_corput(n):
+    """ Base-2 van der Corput sequence (0-1) for 0..n-1, used to spread replaced pixels evenly. """
+    values = np.zeros(n)
+    index = np.arange(n)
+    denominator = 1
+    while np.any(index):
+        denominator *= 2
+        values += (index % 2) / denominator
+        index //= 2
+    return values
+
+
+def wave_transitions(src, dst, steps, nr_steps, wave_width=20, direction='down', pattern='regular', span=None, seed=0):
+    """
+    Travelling wave from dst to src: a wave of width wave_width moves over the stimulus span and replaces
+    the dst pixels by src pixels. Inside the wave the fraction of replaced pixels rises linearly
+    from 0 (wave front) to 1 (wave back). Step 0 shows (almost only) dst, step nr_steps-1 only src.
+
+    Parameters
+    ----------
+    src, dst : numpy.ndarray
+        (height, width, channels) uint8 images
+    steps : numpy.ndarray
+        Indices (0..nr_steps-1) of the steps to compute
+    nr_steps : int
+        Number of steps of the whole transition
+    wave_width : int
+        Width of the wave in pixels
+    direction : str
+        Direction the wave travels in ('down', 'up', 'right' or 'left')
+    pattern : str
+        'regular' replaces evenly spaced pixels inside the wave, 'random' randomly chosen ones
+    span : tuple
+        ((row start, row stop), (column start, column stop)) of the stimulus,
+        by default the region where src and dst differ
+    seed : int
+        Seed of the random pattern (every step of a transition has to use the same seed)
+
+    Returns
+    -------
+    numpy.ndarray
+        (len(steps), height, width, channels) uint8 array with one image per step
+    """
+    (row_start, row_stop), (col_start, col_stop) = stimulus_span(src, dst) if span is None else span
+    src_span = src[row_start:row_stop, col_start:col_stop]
+    dst_span = dst[row_start:row_stop, col_start:col_stop]
+    # along: axis the wave travels along, across: axis of the wave front
+    along, across = src_span.shape[:2] if direction in ('down', 'up') else src_span.shape[1::-1]
+
+    # position of the wave front for every step and the fraction of replaced pixels behind it
+    steps = np.asarray(steps)
+    front = -wave_width/2 + (along + wave_width) * (steps + 1) / nr_steps
+    density = np.clip((front[:, None] - np.arange(along)) / wave_width + 0.5, 0, 1)
+
+    # a pixel is replaced as soon as the density reaches its threshold, so replaced pixels stay replaced
+    if pattern == 'random':
+        threshold = np.random.default_rng(seed).random((along, across))
+    else:
+        threshold = np.broadcast_to(van_der_corput(across), (along, across))
+    mask = threshold < density[:, :, None]
+
+    if direction in ('up', 'left'):
+        mask = mask[:, ::-1]
+    if direction in ('right', 'left'):
+        mask = mask.transpose(0, 2, 1)
+
+    # outside the stimulus span the images are the same, like in the notebook src is used there
+    out = np.empty((len(steps),) + src.shape, dtype=np.uint8)
+    out[:] = src
+    out[:, row_start:row_stop, col_start:col_stop] = np.where(mask[..., None], src_span, dst_span)
+    return out
+
+
+def compute_transition(src, dst, start, stop, nr_steps, transition='fading', wave_params=None):
+    """ Computes the steps start..stop-1 of a fading or wave transition from dst to src. """
+    if transition == 'wave':
+        return wave_transitions(src, dst, np.arange(start, stop), nr_steps, **(wave_params or {}))
+    src_alpha, dst_alpha = alpha_values(nr_steps)
+    return alpha_composite_transitions(src, dst, src_alpha[start:stop], dst_alpha[start:stop])
+
+
+def inputs_hash(src_path, dst_path, nr_fading_stimuli, transition='fading', wave_params=None):
+    """ Content hash of everything a fading pair depends on. """
+    sha = hashlib.sha256()
+    for path in (src_path, dst_path):
+        with open(path, 'rb') as f:
+            sha.update(f.read())
+    sha.update(str(nr_fading_stimuli).encode())
+    if transition == 'wave':
+        sha.update(f'wave {sorted((wave_params or {}).items())}'.encode())
+    return sha.hexdigest()
+
+
+def write_fading_chunk(src_path, dst_path, fading_dir, stack_path, pair, nr_fading_stimuli, start, stop, transition='fading', wave_params=None):
+    """ Computes the steps start..stop-1 of one pair and writes them as .bmp and into the stack at stack_path. """
+    src = load_rgba(src_path)
+    dst = load_rgba(dst_path)
+    frames = compute_transition(src, dst, start, stop, nr_fading_stimuli, transition, wave_params)
+
+    for i, frame in enumerate(frames, start):
+        Image.fromarray(frame, 'RGBA').save(opj(fading_dir, f'{transition}_{pair}_{i}.bmp'))
+    # the .bmp files are read back without their alpha channel, so the stack only holds RGB
+    stack = np.load(stack_path, mmap_mode='r+')
+    stack[start:stop] = frames[..., :3]
+    stack.flush()
+    return stop - start
+
+
+def generate_fading_stimuli(path_to_stim, nr_fading_stimuli, fading_dir=None, pairs=None, workers=None, chunk_size=8, force=False,
+                            transition='fading', wave_params=None):
+    """
+    Generates the transition images of all pairs, unless they are already up to date.
+
+    Parameters
+    ----------
+    path_to_stim : str
+        Directory with the base images (house_red.bmp, face_blue.bmp, ...)
+    nr_fading_stimuli : int
+        Number of fading steps per pair
+    fading_dir : str
+        Output directory (default: <path_to_stim>/fading)
+    pairs : list
+        Fading pairs to generate (default: all pairs in FADING_PAIRS)
+    workers : int
+        Number of processes (default: number of CPUs)
+    chunk_size : int
+        Number of fading steps computed at once by one process
+    force : bool
+        Regenerate even if the inputs did not change
+    transition : str
+        'fading' (contrast fading) or 'wave' (travelling wave)
+    wave_params : dict
+        Keyword arguments of wave_transitions (wave_width, direction, pattern, span, seed)
+
+    Returns
+    -------
+    list
+        Names of the pairs that were (re)generated
+    """
+    fading_dir = opj(path_to_stim, 'fading') if fading_dir is None else fading_dir
+    pairs = list(FADING_PAIRS) if pairs is None else pairs
+    os.makedirs(fading_dir, exist_ok=True)
+
+    jobs = []
+    generated = []
+    for pair in pairs:
+        src_path, dst_path = [find_image(opj(path_to_stim, name)) for name in FADING_PAIRS[pair]]
+        hash_path = opj(fading_dir, f'{transition}_{pair}.sha256')
+        stack_path = opj(fading_dir, f'{transition}_{pair}.npy')
+        current_hash = inputs_hash(src_path, dst_path, nr_fading_stimuli, transition, wave_params)
+
+        up_to_date = (os.path.exists(hash_path) and os.path.exists(stack_path)
+                      and all(os.path.exists(opj(fading_dir, f'{transition}_{pair}_{i}.bmp')) for i in range(nr_fading_stimuli)))
+        if up_to_date:
+            with open(hash_path) as f:
+                up_to_date = f.read().strip() == current_hash
+        if up_to_date and not force:
+            print(f"{transition} {pair}: up to date, skipped")
+            continue
+
+        # the pair is only marked as up to date again when all of its images are written
+        if os.path.exists(hash_path):
+            os.remove(hash_path)
+        # the stack is created in a temporary file here, the processes only fill in their part of it
+        tmp_path = stack_path[:-len('.npy')] + f'.{os.getpid()}.tmp.npy'
+        shape = (nr_fading_stimuli,) + load_rgba(src_path).shape[:2] + (3,)
+        np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8, shape=shape).flush()
+        for start in range(0, nr_fading_stimuli, chunk_size):
+            jobs.append((src_path, dst_path, fading_dir, tmp_path, pair, nr_fading_stimuli, start, min(start+chunk_size, nr_fading_stimuli),
+                         transition, wave_params))
+        generated.append((pair, stack_path, tmp_path, hash_path, current_hash))
+
+    if jobs:
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(write_fading_chunk, *job) for job in jobs]
+                nr_written = sum(future.result() for future in futures)
+        except BaseException:
+            # a failed run leaves the previous stacks (and no hash), so the next run generates the pairs again
+            for _, _, tmp_path, _, _ in generated:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            raise
+        print(f"wrote {nr_written} {transition} images to {fading_dir}")
+
+    # only replace the stack and mark a pair as done once all of its images are written, the stack is touched last,
+    # so FadingStack doesn't take it for older than the images (the processes write them in any order)
+    for pair, stack_path, tmp_path, hash_path, current_hash in generated:
+        os.replace(tmp_path, stack_path)
+        os.utime(stack_path)
+        with open(hash_path, 'w') as f:
+            f.write(current_hash)
+
+    return [pair for pair, _, _, _, _ in generated]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate the fading images for the unambiguous blocks.')
+    parser.add_argument('--settings', default='./settings.yml', help='settings file with the stimulus path and nr of fading stimuli')
+    parser.add_argument('--nr-fading-stimuli', type=int, help='overrides "Nr fading stimuli" from the settings')
+    parser.add_argument('--pairs', nargs='+', choices=list(FADING_PAIRS), help='only generate these pairs')
+    parser.add_argument('--workers', type=int, help='number of processes (default: nr of CPUs)')
+    parser.add_argument('--chunk-size', type=int, default=8, help='fading steps per process task')
+    parser.add_argument('--force', action='store_true', help='regenerate even if the inputs did not change')
+    parser.add_argument('--transition', choices=TRANSITIONS, help='overrides "Transition type" from the settings')
+    parser.add_argument('--wave-width', type=int, default=20, help='width of the wave in pixels')
+    parser.add_argument('--direction', choices=WAVE_DIRECTIONS, default='down', help='direction the wave travels in')
+    parser.add_argument('--pattern', choices=WAVE_PATTERNS, default='regular', help='pixels replaced inside the wave')
+    parser.add_argument('--span', type=int, nargs=4, metavar=('ROW_START', 'ROW_STOP', 'COL_START', 'COL_STOP'),
+                        help='stimulus region the wave travels over (default: where the two images differ)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random wave pattern')
+    args = parser.parse_args()
+
+    with open(args.settings) as f:
+        task_settings = yaml.safe_load(f)['Task settings']
+    nr_fading_stimuli = task_settings['Nr fading stimuli'] if args.nr_fading_stimuli is None else args.nr_fading_stimuli
+    transition = task_settings['Transition type'] if args.transition is None else args.transition
+    wave_params = None
+    if transition == 'wave':
+        span = None if args.span is None else (tuple(args.span[:2]), tuple(args.span[2:]))
+        wave_params = {'wave_width': args.wave_width, 'direction': args.direction, 'pattern': args.pattern,
+                       'span': span, 'seed': args.seed}
+
+    generate_fading_stimuli(task_settings['Stimulus path'], nr_fading_stimuli, pairs=args.pairs,
+                            workers=args.workers, chunk_size=args.chunk_size, force=args.force,
+                            transition=transition, wave_params=wave_params)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+'''
+@time    :   2022/04/11 13:26:04
+@author  :   rosagross
+@contact :   grossmann.rc@gmail.com
+
+
+Group analysis of all sessions in output_data/. Every session directory (with an *_events.tsv) is parsed
+in a process pool into its switch times, responses and per block summaries, and the results are
+combined into tables indexed by subject, session and block:
+
+    python group_analysis.py --output-dir group_results
+
+The parsed sessions are cached (output_data/.group_analysis_cache), so a rerun only parses new or changed sessions.
+'''
+
+import argparse
+import glob
+import hashlib
+import json
+import numpy as np
+import os
+import pandas as pd
+import yaml
+from concurrent.futures import ProcessPoolExecutor
+from analysis import calc_switch_times
+from columnar import load_events
+from file_utils import files_hash, files_mtime
+
+opj = os.path.join
+
+DEFAULT_RESPONSE_INTERVAL = [0.1, 1.5]
+
+
+def find_sessions(data_dir='./output_data'):
+    """ Returns the events.tsv of every session directory in data_dir (sorted). """
+    return sorted(glob.glob(opj(data_dir, '*', '*_events.tsv')))
+
+
+def session_files(events_path):
+    """ The files a session is parsed from: the events.tsv and (if it exists) the expsettings.yml. """
+    settings_path = events_path[:-len('_events.tsv')] + '_expsettings.yml'
+    return [events_path, settings_path] if os.path.exists(settings_path) else [events_path]
+
+
+def label_blocks(global_log):
+    """
+    Numbers the blocks of every block type in the order they appear (like the block_ID of the session,
+    breaks are block 0). The log does not have a block column, a new block starts whenever the block type changes.
+    """
+    block_type = global_log['block_type']
+    new_block = block_type.ne(block_type.shift())
+    block_ID = new_block.astype(int).groupby(block_type).cumsum()
+    return block_ID.where(block_type != 'break', 0)
+
+
+def response_delays(global_log):
+    """
+    Time between every event and the one before it, that is the response delay the session uses
+    to decide if a response was correct.
+    """
+    return global_log['onset'].diff()
+
+
+def parse_session(events_path, response_interval=None):
+    """
+    Parses one session into its tables.
+
+    Parameters
+    ----------
+    events_path : str
+        Path of the session's *_events.tsv
+    response_interval : list
+        Interval (s) in which a response to an unambiguous switch counts as correct,
+        default: the 'Response interval' of the session's expsettings.yml
+
+    Returns
+    -------
+    dict
+        'switch_times', 'responses' and 'blocks' (DataFrames) and 'info' (dict) of the session
+    """
+    output_str = os.path.basename(events_path)[:-len('_events.tsv')]
+    subject, session = output_str.split('_', 1)
+    settings = {}
+    paths = session_files(events_path)
+    if len(paths) > 1:
+        with open(paths[1]) as f:
+            settings = (yaml.safe_load(f) or {}).get('Task settings', {})
+    if response_interval is None:
+        response_interval = settings.get('Response interval', DEFAULT_RESPONSE_INTERVAL)
+
+    # the columnar events (see columnar.py) are used if the session has them, only the needed columns are read
+    columns = ['trial_nr', 'onset', 'response', 'block_type']
+    if os.path.exists(opj(events_path[:-len('.tsv')], 'schema.json')):
+        global_log = load_events(events_path[:-len('.tsv')], columns)
+    else:
+        global_log = pd.read_csv(events_path, sep='\t', usecols=columns, dtype={'response': str})
+    global_log = global_log.sort_values('onset', kind='mergesort', ignore_index=True)
+    global_log['block_ID'] = label_blocks(global_log)
+    global_log['delay'] = response_delays(global_log)
+    is_response = global_log['response'].notna() & (global_log['block_type'] != 'break')
+
+    # switch times of the rivalry blocks, numbered within every block
+    switch_times = []
+    rivalry = global_log[global_log['block_type'] == 'rivalry']
+    for block_ID, block in rivalry.groupby('block_ID', sort=True):
+        times = calc_switch_times(block)
+        switch_times.append(pd.DataFrame({'block_ID': block_ID, 'switch': np.arange(len(times)), 'switch_time': times}))
+    switch_times = pd.concat(switch_times, ignore_index=True) if switch_times else \
+        pd.DataFrame({'block_ID': pd.Series(dtype=int), 'switch': pd.Series(dtype=int), 'switch_time': pd.Series(dtype=float)})
+
+    responses = global_log.loc[is_response, ['block_type', 'block_ID', 'trial_nr', 'onset', 'response', 'delay']].reset_index(drop=True)
+    # only responses to the physical switches in unambiguous (and replay) blocks can be correct
+    responses['correct'] = responses['delay'].between(*response_interval).where(responses['block_type'].isin(['unambiguous', 'replay']))
+
+    phases = global_log[global_log['response'].isna() & (global_log['block_type'] != 'break')]
+    blocks = phases.groupby(['block_type', 'block_ID']).agg(start=('onset', 'min'), nr_trials=('trial_nr', 'nunique'))
+    blocks['nr_responses'] = responses.groupby(['block_type', 'block_ID']).size()
+    blocks['nr_correct'] = responses.groupby(['block_type', 'block_ID'])['correct'].sum(min_count=1)
+    blocks['accuracy'] = responses.groupby(['block_type', 'block_ID'])['correct'].mean()
+    switch_stats = switch_times.groupby('block_ID')['switch_time'].agg(['mean', 'median', 'std', 'count'])
+    switch_stats.columns = ['switch_time_mean', 'switch_time_median', 'switch_time_std', 'nr_switch_times']
+    blocks = blocks.join(pd.concat({'rivalry': switch_stats}, names=['block_type']), how='left')
+    blocks['nr_responses'] = blocks['nr_responses'].fillna(0).astype(int)
+
+    info = {'subject': subject, 'session': session, 'output_str': output_str,
+            'response_interval_min': response_interval[0], 'response_interval_max': response_interval[1]}
+    return {'info': info, 'switch_times': switch_times, 'responses': responses, 'blocks': blocks.reset_index()}
+
+
+def _parse_to_cache(events_path, cache_path, response_interval):
+    # runs in the worker processes, the parsed session is passed back through the cache file
+    pd.to_pickle(parse_session(events_path, response_interval), cache_path)
+    return cache_path
+
+
+def combine_sessions(parsed):
+    """ Combines the tables of all sessions into tables indexed by subject, session and block. """
+    tables = {}
+    for name, index in [('switch_times', ['block_ID', 'switch']), ('responses', ['block_type', 'block_ID']),
+                        ('blocks', ['block_type', 'block_ID'])]:
+        frames = []
+        for session in parsed:
+            table = session[name].copy()
+            for column, value in session['info'].items():
+                table[column] = value
+            frames.append(table)
+        if not frames:
+            tables[name] = pd.DataFrame()
+            continue
+        table = pd.concat(frames, ignore_index=True)
+        tables[name] = table.set_index(['subject', 'session'] + index).sort_index()
+    return tables
+
+
+def run_group_analysis(data_dir='./output_data', output_dir=None, cache_dir=None, workers=None, response_interval=None):
+    """
+    Parses all sessions in data_dir (only new or changed ones, the others are read from the cache)
+    and writes the combined tables (group_switch_times.tsv, group_responses.tsv, group_blocks.tsv) to output_dir.
+
+    Parameters
+    ----------
+    data_dir : str
+        Directory with the session directories
+    output_dir : str
+        Directory of the combined tables (default: data_dir)
+    cache_dir : str
+        Directory of the parsed sessions (default: data_dir/.group_analysis_cache)
+    workers : int
+        Number of processes (default: number of CPUs)
+    response_interval : list
+        Scores all sessions with this response interval instead of their own
+
+    Returns
+    -------
+    dict
+        Combined tables (DataFrames)
+    """
+    output_dir = data_dir if output_dir is None else output_dir
+    cache_dir = opj(data_dir, '.group_analysis_cache') if cache_dir is None else cache_dir
+    os.makedirs(cache_dir, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
+    index_path = opj(cache_dir, 'index.json')
+    index = {}
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+
+    sessions = find_sessions(data_dir)
+    to_parse = []
+    for events_path in sessions:
+        paths = session_files(events_path)
+        key = os.path.relpath(events_path, data_dir)
+        cache_path = opj(cache_dir, hashlib.sha1(key.encode()).hexdigest() + '.pkl')
+        entry = index.get(key)
+        mtime = files_mtime(paths)
+        up_to_date = (entry is not None) and os.path.exists(cache_path) and (entry['response_interval'] == response_interval)
+        if up_to_date and (entry['mtime'] != mtime):
+            # the files were touched, only parse them again if their content changed
+            up_to_date = entry['hash'] == files_hash(paths)
+        if up_to_date:
+            entry['mtime'] = mtime
+        else:
+            index[key] = {'mtime': mtime, 'hash': files_hash(paths), 'response_interval': response_interval}
+            to_parse.append((events_path, cache_path))
+        index[key]['cache'] = cache_path
+
+    print(f"{len(sessions)} sessions, {len(to_parse)} new or changed")
+    if to_parse:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(_parse_to_cache, *zip(*to_parse), [response_interval]*len(to_parse)))
+
+    # sessions that were removed from data_dir are removed from the cache as well
+    for key in set(index) - {os.path.relpath(events_path, data_dir) for events_path in sessions}:
+        if os.path.exists(index[key]['cache']):
+            os.remove(index[key]['cache'])
+        del index[key]
+    with open(index_path, 'w') as f:
+        json.dump(index, f, indent=4)
+
+    parsed = [pd.read_pickle(index[os.path.relpath(events_path, data_dir)]['cache']) for events_path in sessions]
+    tables = combine_sessions(parsed)
+    for name, table in tables.items():
+        table.to_csv(opj(output_dir, f'group_{name}.tsv'), sep='\t')
+    print(f"wrote group_switch_times.tsv, group_responses.tsv and group_blocks.tsv to {output_dir}")
+    return tables
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Combine the results of all sessions into group tables.')
+    parser.add_argument('--data-dir', default='./output_data', help='directory with the session directories')
+    parser.add_argument('--output-dir', help='directory of the group tables (default: data dir)')
+    parser.add_argument('--cache-dir', help='directory of the parsed sessions (default: <data dir>/.group_analysis_cache)')
+    parser.add_argument('--workers', type=int, help='number of processes (default: number of CPUs)')
+    parser.add_argument('--response-interval', type=float, nargs=2, metavar=('MIN', 'MAX'),
+                        help="scores all sessions with this interval instead of their 'Response interval'")
+    args = parser.parse_args()
+    run_group_analysis(args.data_dir, args.output_dir, args.cache_dir, args.workers, args.response_interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -15,6 +15,8 @@ import os
 import re
 from datetime import datetime
 from session import BinocularRivalrySession
+from preflight import preflight
+from schedule import draw_seed
 datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
 
@@ -28,6 +30,17 @@ def main():
     settings_file = './settings.yml'
     eyetracker_on = True if sys.argv[3] == "True" else False
 
+    # the settings and stimulus files are checked before the window opens (see preflight.py),
+    # the timeline is compiled with the schedule the session will draw
+    schedule_seed = draw_seed()
+    problems, nr_files = preflight(settings_file, [subject_ID], schedule_seed=schedule_seed)
+    if problems:
+        print("The session can't start:")
+        for problem in problems:
+            print(f"    {problem}")
+        sys.exit(1)
+    print(f"preflight: {nr_files} files checked")
+
     if not os.path.exists('./output_data'):
         os.mkdir('./output_data')
 
@@ -36,7 +49,7 @@ def main():
         output_dir = output_dir + datetime.now().strftime('%Y%m%d%H%M%S')
     
     # instantiate and run the session 
-    experiment_session = BinocularRivalrySession(output_str, output_dir, settings_file, subject_ID, eyetracker_on)
+    experiment_session = BinocularRivalrySession(output_str, output_dir, settings_file, subject_ID, eyetracker_on, schedule_seed)
     experiment_session.run()
 
 
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+'''
+@time    :   2022/04/29 09:41:18
+@author  :   rosagross
+@contact :   grossmann.rc@gmail.com
+
+
+Live monitor of a running session for the experimenter. The session sends a small UDP packet to a local port
+at every phase onset and response, and a status packet a few times per second (current block, trial and phase,
+responses and their accuracy, running percept duration stats and dropped frames). Nothing waits for the packets:
+if no monitor listens, they are dropped. The monitor is started in another terminal:
+
+    python monitor.py --port 9870
+'''
+
+import argparse
+import socket
+import struct
+import sys
+from timeline import BLOCK_TYPES
+
+KINDS = ['status', 'phase', 'response']
+KIND_IDS = {kind: i for i, kind in enumerate(KINDS)}
+
+# kind, session time, block_ID, block type, trial_nr, phase, frames, dropped frames, responses, correct responses,
+# nr of percepts, percept duration mean and std, key and whether the response was correct (-1: not scored)
+PACKET = struct.Struct('<BdiBiiIIIIIdd8sb')
+FIELDS = ['kind', 'time', 'block_ID', 'block_type', 'trial_nr', 'phase', 'nr_frames', 'dropped_frames',
+          'responses', 'correct_responses', 'nr_percepts', 'percept_mean', 'percept_std', 'key', 'correct']
+
+
+class MonitorPublisher:
+    """
+    Sends the state of the session to the live monitor. The socket never blocks, a packet that can't be sent
+    (e.g. no monitor listens) is counted and dropped. Packing and sending a packet takes a few microseconds.
+    """
+
+    def __init__(self, port, frame_duration, host='127.0.0.1', status_interval=0.25):
+        """
+        Parameters
+        ----------
+        port : int
+            UDP port the monitor listens on
+        frame_duration : float
+            Expected duration of one frame in s, a frame counts as dropped if it started more than
+            1.5 frame durations after the previous one (like in profiling.FrameProfiler)
+        host : str
+            Address of the monitor
+        status_interval : float
+            Time (s) between two status packets
+        """
+        self.address = (host, port)
+        self.frame_duration = frame_duration
+        self.status_interval = status_interval
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+        self.dropped_frames = 0
+        self.nr_sent = 0
+        self.nr_failed = 0
+        self._last_frame = None
+        self._last_status = -float('inf')
+
+    def frame(self, start, trial):
+        """ Counts the frame that started at start (perf_counter) and sends a status packet if it is due. """
+        if (self._last_frame is not None) and (start - self._last_frame > 1.5 * self.frame_duration):
+            self.dropped_frames += 1
+        self._last_frame = start
+        if start - self._last_status >= self.status_interval:
+            self._last_status = start
+            self.publish('status', trial)
+
+    def publish(self, kind, trial, key='', correct=None, phase=None):
+        """
+        Sends a packet with the current state of the session.
+
+        Parameters
+        ----------
+        kind : str
+            'status', 'phase' (phase onset) or 'response'
+        trial : BRTrial
+            Current trial
+        key, correct
+            Key of a response and whether it was within the response interval (None in rivalry blocks)
+        phase : int
+            Phase of the packet (default: the current phase of the trial), a phase onset is logged on the flip
+            after the phase started, when the trial may already be in the next phase
+        """
+        session = trial.session
+        stats = session.running_stats
+        packet = PACKET.pack(KIND_IDS[kind], session.clock.getTime(), trial.block_ID, trial.block_type_ID, trial.trial_nr,
+                             trial.phase if phase is None else phase, session.nr_frames, self.dropped_frames,
+                             session.unambiguous_responses + session.replay_responses,
+                             session.correct_responses + session.correct_replay_responses,
+                             stats.n, stats.mean, stats.std, key.encode()[:8], -1 if correct is None else int(correct))
+        try:
+            self.socket.sendto(packet, self.address)
+            self.nr_sent += 1
+        except OSError:
+            # nobody listens (ECONNREFUSED from an earlier packet) or the send buffer is full
+            self.nr_failed += 1
+
+    def close(self):
+        self.socket.close()
+
+
+def unpack(packet):
+    """ Returns the fields of a packet as dict (kind and block type as names). """
+    values = dict(zip(FIELDS, PACKET.unpack(packet)))
+    values['kind'] = KINDS[values['kind']]
+    values['block_type'] = BLOCK_TYPES[values['block_type']]
+    values['key'] = values['key'].rstrip(b'\0').decode()
+    values['correct'] = None if values['correct'] < 0 else bool(values['correct'])
+    return values
+
+
+class MonitorListener:
+    """ Receives the packets of a session, e.g. for the monitor below or to check what a (simulated) session sends. """
+
+    def __init__(self, port, host='127.0.0.1'):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, port))
+
+    def receive(self, timeout=None):
+        """ Returns the next packet as dict (see unpack), None if there was none within timeout (s). """
+        self.socket.settimeout(timeout)
+        try:
+            packet, _ = self.socket.recvfrom(PACKET.size)
+        except socket.timeout:
+            return None
+        return unpack(packet)
+
+    def close(self):
+        self.socket.close()
+
+
+def status_line(packet):
+    """ One line summary of the state of the session. """
+    accuracy = f"{packet['correct_responses']/packet['responses']:.0%}" if packet['responses'] else '-'
+    return (f"{packet['time']:8.1f}s  block {packet['block_ID']} {packet['block_type']:<11} trial {packet['trial_nr']:<4} "
+            f"phase {packet['phase']:<3} responses {packet['correct_responses']}/{packet['responses']} ({accuracy})  "
+            f"percepts {packet['nr_percepts']} ({packet['percept_mean']:.2f}s +- {packet['percept_std']:.2f}s)  "
+            f"dropped frames {packet['dropped_frames']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Show the state of a running session.')
+    parser.add_argument('--port', type=int, default=9870, help="'Live monitor port' of the settings")
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    args = parser.parse_args()
+
+    listener = MonitorListener(args.port, args.host)
+    print(f"listening on {args.host}:{args.port}")
+    try:
+        while True:
+            packet = listener.receive()
+            if packet['kind'] == 'status':
+                sys.stdout.write('\r' + status_line(packet))
+            elif packet['kind'] == 'phase':
+                if packet['phase'] == 0:
+                    sys.stdout.write(f"\n{packet['time']:8.1f}s  block {packet['block_ID']} {packet['block_type']} trial {packet['trial_nr']}\n")
+                sys.stdout.write('\r' + status_line(packet))
+            else:
+                correct = '' if packet['correct'] is None else (' correct' if packet['correct'] else ' wrong')
+                sys.stdout.write(f"\n{packet['time']:8.1f}s  key {packet['key']}{correct}\n" + status_line(packet))
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        print()
+    finally:
+        listener.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+'''
+@time    :   2022/05/03 14:52:09
+@author  :   rosagross
+@contact :   grossmann.rc@gmail.com
+
+
+Checks the settings and the stimulus files before a session, so a bad setup is found before the window opens
+instead of in create_stimulus or in the middle of a block. From the settings it derives every frame count
+(block, break and transition durations, fading steps) and every file the session will load (base images,
+fading images or stacks, replay images, schedule), compiles the timeline like create_blocks does and reads the
+headers of all images in parallel (without decoding them) to check that they exist, are complete and have
+matching sizes. main.py runs it before the session starts, it can also be run on its own:
+
+    python preflight.py --settings settings.yml --subject-ID 1
+'''
+
+import argparse
+import numpy as np
+import os
+import yaml
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from PIL import Image
+from schedule import schedule_blocks, session_schedule
+from stim import select_fading_steps
+from stim_cache import find_image
+from timeline import compile_timeline, seconds_to_frames, transition_counts
+
+opj = os.path.join
+
+# images create_stimulus draws at the stimulus size, they have to be the same size as the fading images
+STIMULUS_IMAGES = ['house_red', 'house_blue', 'face_red', 'face_blue', 'rivalry_redface', 'rivalry_redhouse', 'fixation_screen']
+OTHER_IMAGES = ['test']
+REPLAY_IMAGES = ['replay_face', 'replay_house']
+FADING_PAIRS = ['hb2fr', 'hr2fb']
+
+
+def frame_counts(task_settings):
+    """
+    Derives the frame counts the session uses from the task settings (like setup_task and create_blocks do).
+
+    Returns
+    -------
+    tuple
+        dict of the frame counts and list of problems (e.g. durations that are not a whole number of frames)
+    """
+    problems = []
+    refresh_rate = task_settings['Monitor framerate']
+    counts = {}
+    for name in ['Stimulus duration rivalry', 'Break duration', 'Get ready duration', 'Minimum percept duration']:
+        try:
+            counts[name] = seconds_to_frames(task_settings[name], refresh_rate, name)
+        except ValueError as error:
+            problems.append(str(error))
+
+    try:
+        transitions = transition_counts(task_settings)
+    except ValueError as error:
+        problems.append(str(error))
+        return counts, problems
+    counts.update(transitions)
+
+    if (task_settings['Fading mode'] == 'procedural') and (task_settings['Transition type'] != 'fading'):
+        problems.append(f"Transition type '{task_settings['Transition type']}' needs pre-rendered images, it can't be used with the procedural fading mode")
+    if task_settings['Response capture'] not in ('release', 'press'):
+        problems.append(f"Response capture has to be 'release' or 'press', not '{task_settings['Response capture']}'")
+    return counts, problems
+
+
+def fading_indices(nr_fading_stimuli, transition_steps, fading_phases):
+    """ Indices of the fading images the transitions draw (forwards and backwards through the fading images). """
+    steps = np.arange(nr_fading_stimuli)
+    return np.union1d(select_fading_steps(steps, transition_steps, fading_phases),
+                      select_fading_steps(steps, transition_steps, fading_phases, reverse=True))
+
+
+def check_blocks(subject_ID, task_settings, counts, schedule_seed=None):
+    """
+    Compiles the timeline of a subject like create_blocks does (with the schedule the session will use,
+    schedule_seed has to be the seed the session gets), returns the problems it raises.
+    """
+    try:
+        schedule = session_schedule(subject_ID, task_settings, schedule_seed)
+        durations = iter(schedule_blocks(schedule))
+        compile_timeline(task_settings['Blocks'], 0 if subject_ID % 2 == 0 else 1, counts['Stimulus duration rivalry'],
+                         counts['Break duration'], counts['Get ready duration'], counts['transition_phases'], lambda: next(durations).tolist(),
+                         schedule['colors_rivalry'], schedule['colors_unambiguous'], task_settings['Replay blocks'])
+    except (ValueError, FileNotFoundError) as error:
+        return [f"sub-{subject_ID:03d}: {error}"]
+    return []
+
+
+def image_header(path):
+    """
+    Reads the header of an image (without decoding it).
+
+    Returns
+    -------
+    tuple
+        path, (width, height) and a problem (None if the image is fine)
+    """
+    if not os.path.exists(path):
+        return path, None, 'missing'
+    try:
+        with Image.open(path) as image:
+            size = image.size
+            tile = image.tile
+    except Exception as error:
+        return path, None, f"{path} can't be read: {error}"
+    # uncompressed images (like the .bmp stimuli) have to hold all rows after the header
+    if (len(tile) == 1) and (tile[0][0] == 'raw') and tile[0][3][1]:
+        expected = tile[0][2] + tile[0][3][1]*size[1]
+        if os.path.getsize(path) < expected:
+            return path, size, f"{path} is truncated ({os.path.getsize(path)} of {expected} bytes)"
+    return path, size, None
+
+
+def stack_header(path):
+    """ Reads the shape of a .npy frame stack from its header. """
+    try:
+        with open(path, 'rb') as f:
+            version = np.lib.format.read_magic(f)
+            read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+            shape, _, _ = read_header(f)
+    except Exception as error:
+        return None, f"{path} can't be read: {error}"
+    return shape, None
+
+
+def missing_files(paths):
+    """ Problems of the missing files, many missing files in one directory (e.g. the fading images) are summarized. """
+    directories = {}
+    for path in paths:
+        directories.setdefault(os.path.dirname(path), []).append(path)
+    problems = []
+    for directory, missing in directories.items():
+        if len(missing) > 3:
+            problem = f"{len(missing)} files in {directory} do not exist ({os.path.basename(missing[0])}, ..., {os.path.basename(missing[-1])})"
+            if os.path.basename(os.path.normpath(directory)) == 'fading':
+                problem += ", they are made with generate_fading_stimuli.py"
+            problems.append(problem)
+        else:
+            problems += [f"{path} does not exist" for path in missing]
+    return problems
+
+
+def stimulus_files(task_settings, counts):
+    """
+    The files create_stimulus will load.
+
+    Returns
+    -------
+    tuple
+        Image paths that have to match the stimulus size, other image paths, and the fading stacks
+        (path and number of frames they have to hold) that are used instead of their images
+    """
+    stim_path = task_settings['Stimulus path']
+    stimulus = [find_image(opj(stim_path, name+'.bmp')) for name in STIMULUS_IMAGES]
+    other = [find_image(opj(stim_path, name+'.bmp')) for name in OTHER_IMAGES]
+    if task_settings['Replay blocks']:
+        other += [find_image(opj(stim_path, name+'.bmp')) for name in REPLAY_IMAGES]
+
+    stacks = []
+    nr_fading_stimuli = task_settings['Nr fading stimuli']
+    if (nr_fading_stimuli != 0) and (task_settings['Fading mode'] == 'stack'):
+        fading_dir = opj(stim_path, 'fading')
+        transition = task_settings['Transition type']
+        for pair in FADING_PAIRS:
+            stack_path = opj(fading_dir, f'{transition}_{pair}.npy')
+            if os.path.exists(stack_path):
+                # the images are only read to pack the stack again, the transitions draw the frames from the stack
+                stacks.append((stack_path, nr_fading_stimuli))
+                indices = fading_indices(nr_fading_stimuli, counts['transition_steps'], counts['fading_phases'])
+            else:
+                # the stack is packed from all images the first time the session starts
+                indices = range(nr_fading_stimuli)
+            stimulus += [opj(fading_dir, f'{transition}_{pair}_{i}.bmp') for i in indices]
+    return stimulus, other, stacks
+
+
+def preflight(settings_file, subject_IDs=(1, 2), workers=16, schedule_seed=None):
+    """
+    Checks the settings and stimulus files of a session.
+
+    Parameters
+    ----------
+    settings_file : str
+        Path of the settings file
+    subject_IDs : list
+        Subjects the timeline is compiled for (the block order depends on the subject ID)
+    workers : int
+        Number of threads that read the image headers
+    schedule_seed : int
+        Seed the session draws its schedule with, if there is no 'Schedule dir' (default: a random seed)
+
+    Returns
+    -------
+    tuple
+        List of problems (empty if the session can start) and the number of files that were checked
+    """
+    with open(settings_file) as f:
+        settings = yaml.safe_load(f)
+    task_settings = settings['Task settings']
+    counts, problems = frame_counts(task_settings)
+    if problems:
+        # the blocks can't be compiled without the frame counts
+        return problems, 0
+    for subject_ID in subject_IDs:
+        problems += check_blocks(subject_ID, task_settings, counts, schedule_seed)
+
+    stimulus, other, stacks = stimulus_files(task_settings, counts)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        headers = list(pool.map(image_header, stimulus + other))
+    problems += [problem for _, _, problem in headers if problem not in (None, 'missing')]
+    problems += missing_files([path for path, _, problem in headers if problem == 'missing'])
+
+    sizes = {}
+    for path, size, _ in headers[:len(stimulus)]:
+        if size is not None:
+            sizes.setdefault(size, []).append(path)
+    if len(sizes) > 1:
+        # the size most images have is the expected one, the others are listed
+        expected = max(sizes, key=lambda size: len(sizes[size]))
+        for size, paths in sizes.items():
+            if size != expected:
+                shown = ', '.join(paths[:3]) + (f' and {len(paths)-3} more' if len(paths) > 3 else '')
+                problems.append(f"{shown}: {size[0]}x{size[1]} pixels instead of {expected[0]}x{expected[1]}")
+
+    for path, nr_frames in stacks:
+        shape, problem = stack_header(path)
+        if problem is not None:
+            problems.append(problem)
+        elif shape[0] < nr_frames:
+            problems.append(f"{path} holds {shape[0]} frames, but {nr_frames} fading stimuli are requested")
+        elif sizes and (shape[2], shape[1]) not in sizes:
+            problems.append(f"{path} has frames of {shape[2]}x{shape[1]} pixels, the stimuli have {', '.join(f'{w}x{h}' for w, h in sizes)}")
+    return problems, len(headers) + len(stacks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the settings and stimulus files before a session.')
+    parser.add_argument('--settings', default='./settings.yml', help='settings file')
+    parser.add_argument('--subject-ID', type=int, nargs='+', default=[1, 2], help='subjects the timeline is compiled for (default: 1 2)')
+    parser.add_argument('--seed', type=int, help="seed of the schedule if there is no 'Schedule dir' (default: a random seed)")
+    args = parser.parse_args()
+
+    start = perf_counter()
+    problems, nr_files = preflight(args.settings, args.subject_ID, schedule_seed=args.seed)
+    print(f"preflight: {nr_files} files checked in {(perf_counter() - start)*1000:.0f}ms, {len(problems)} problems")
+    for problem in problems:
+        print(f"    {problem}")
+    if problems:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+'''
+@time    :   2022/04/04 14:22:50
+@author  :   rosagross
+@contact :   grossmann.rc@gmail.com
+'''
+
+import numpy as np
+from time import perf_counter
+from timeline import BLOCK_TYPES
+
+# code paths that are timed in every frame, every hook only counts its own (exclusive) time:
+# the logging and tracker messages of responses are not part of get_events
+HOOKS = ['draw', 'get_events', 'logging', 'tracker']
+HOOK_IDS = {hook: i for i, hook in enumerate(HOOKS)}
+
+
+class FrameProfiler:
+    """
+    Records the start time of every frame and the time spent in each hook into preallocated ring buffers.
+    Recording a frame only writes a few array entries, so it can stay on during real sessions.
+    A frame counts as dropped if it started more than 1.5 frame durations after the previous one.
+    """
+
+    def __init__(self, frame_duration, capacity=2**17):
+        """
+        Parameters
+        ----------
+        frame_duration : float
+            Expected duration of one frame (screen refresh) in s
+        capacity : int
+            Number of frames that are kept (older frames are overwritten)
+        """
+        self.frame_duration = frame_duration
+        self.capacity = capacity
+        self.frame_start = np.zeros(capacity)
+        self.hook_time = np.zeros((capacity, len(HOOKS)))
+        self.block_ID = np.zeros(capacity, dtype=np.int32)
+        self.block_type = np.zeros(capacity, dtype=np.int8)
+        self.transition = np.zeros(capacity, dtype=bool)
+        self.nr_frames = 0
+        self._idx = -1
+
+    def start_frame(self, start, block_ID, block_type, transition):
+        """ Starts a new frame at time start (perf_counter) in the given block. """
+        self._idx = self.nr_frames % self.capacity
+        self.frame_start[self._idx] = start
+        self.hook_time[self._idx] = 0
+        self.block_ID[self._idx] = block_ID
+        self.block_type[self._idx] = block_type
+        self.transition[self._idx] = transition
+        self.nr_frames += 1
+
+    def record(self, hook, duration):
+        """ Adds the time (s) spent in a hook (index into HOOKS) to the current frame. """
+        if self._idx >= 0:
+            self.hook_time[self._idx, hook] += duration
+
+    def since(self, hook, start):
+        """ Adds the time since start (perf_counter) to the hook and returns it. """
+        duration = perf_counter() - start
+        self.record(hook, duration)
+        return duration
+
+    def _frames(self):
+        # the recorded frames in chronological order (the ring buffer may have wrapped around)
+        nr_kept = min(self.nr_frames, self.capacity)
+        order = np.arange(self.nr_frames - nr_kept, self.nr_frames) % self.capacity
+        return (self.frame_start[order], self.hook_time[order], self.block_ID[order],
+                self.block_type[order], self.transition[order])
+
+    def report(self):
+        """ Returns the frame timing report as text (dropped frames, latency percentiles, hook at missed deadlines). """
+        frame_start, hook_time, block_ID, block_type, transition = self._frames()
+        if len(frame_start) < 2:
+            return "frame report: not enough frames recorded\n"
+
+        # interval i is the time between frame i and i+1, it belongs to (and is caused by) frame i
+        intervals = np.diff(frame_start)
+        dropped = intervals > 1.5 * self.frame_duration
+        percentiles = [50, 95, 99, 100]
+
+        lines = [f"frame report ({len(frame_start)} frames, expected frame duration {self.frame_duration*1000:.2f}ms)",
+                 f"dropped frames: {dropped.sum()}",
+                 "frame interval (ms) " + '  '.join(f"p{p}: {v*1000:.2f}" for p, v in zip(percentiles, np.percentile(intervals, percentiles)))]
+
+        lines.append("time per hook (ms)")
+        for hook, times in zip(HOOKS, hook_time.T):
+            times = times[times > 0]
+            if len(times):
+                lines.append(f"    {hook:<11}" + '  '.join(f"p{p}: {v*1000:.3f}" for p, v in zip(percentiles, np.percentile(times, percentiles))))
+
+        lines.append("dropped frames per block")
+        keys = np.stack([block_type[:-1], block_ID[:-1], transition[:-1]], axis=1)
+        for key in np.unique(keys, axis=0):
+            in_block = np.all(keys == key, axis=1)
+            lines.append(f"    {BLOCK_TYPES[key[0]]:<11} block {key[1]} {'transitions' if key[2] else 'stimulus':<11}: "
+                         f"{dropped[in_block].sum()} of {in_block.sum()} frames")
+
+        if dropped.any():
+            lines.append("longest hook in frames before a missed deadline")
+            slowest_hook = np.argmax(hook_time[:-1][dropped], axis=1)
+            for hook, count in zip(*np.unique(slowest_hook, return_counts=True)):
+                lines.append(f"    {HOOKS[hook]:<11}: {count}")
+        return '\n'.join(lines) + '\n'
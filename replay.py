@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+'''
+@time    :   2022/04/25 11:17:49
+@author  :   rosagross
+@contact :   grossmann.rc@gmail.com
+
+
+Replay blocks show the percepts the participant reported in the rivalry block before them, as unambiguous
+stimuli (stimuli/replay_face.bmp and replay_house.bmp) with the same switch times.
+The reports are recorded while the rivalry block runs, so the replay block is compiled in the break after it
+without going through the log.
+'''
+
+import numpy as np
+from session_log import logger
+
+PERCEPTS = ['house', 'face']
+
+
+class ReplayRecorder:
+    """
+    Records the percepts reported in a rivalry block: every key press that reports another percept than
+    the one before is stored with its time since the block onset in preallocated arrays.
+    """
+
+    def __init__(self, percept_keys, capacity=256):
+        """
+        Parameters
+        ----------
+        percept_keys : dict
+            Percept ('house' or 'face') every response key reports, other keys are not recorded
+        capacity : int
+            Number of reports that are allocated in the beginning (the arrays double their size when they are full)
+        """
+        self.percept_keys = {key: PERCEPTS.index(percept) for key, percept in percept_keys.items()}
+        self.times = np.empty(capacity)
+        self.percepts = np.empty(capacity, dtype=np.int8)
+        self.nr_reports = 0
+        self.onset = None
+
+    def start(self, onset):
+        """ Starts recording a rivalry block (onset in s on the session clock), the reports of the last block are dropped. """
+        self.onset = onset
+        self.nr_reports = 0
+
+    def add(self, t, key):
+        """ Records a key press (t in s on the session clock). """
+        percept = self.percept_keys.get(key)
+        if (percept is None) or (self.onset is None):
+            return
+        # pressing the same button again does not switch the percept
+        if (self.nr_reports > 0) and (self.percepts[self.nr_reports-1] == percept):
+            return
+        if self.nr_reports == len(self.times):
+            self.times = np.concatenate([self.times, np.empty(len(self.times))])
+            self.percepts = np.concatenate([self.percepts, np.empty(len(self.percepts), dtype=np.int8)])
+        self.times[self.nr_reports] = t - self.onset
+        self.percepts[self.nr_reports] = percept
+        self.nr_reports += 1
+
+    def compile(self, block_frames, refresh_rate, min_frames):
+        """
+        Converts the recorded reports into the percepts of a replay block. The first reported percept is shown from
+        the block onset, every other one from the frame it was reported in until the next report or the end of the block.
+        Percepts shorter than min_frames (e.g. too short for a transition) are left out, the percept before them lasts longer.
+
+        Parameters
+        ----------
+        block_frames : int
+            Duration of the block in frames
+        refresh_rate : float
+            Frames per s
+        min_frames : int
+            Minimal duration of a percept in frames
+
+        Returns
+        -------
+        tuple
+            Trial types ('house' or 'face') and durations (frames) of the percepts, they add up to block_frames
+        """
+        if self.nr_reports == 0:
+            logger.warning("no percepts were reported in the rivalry block, the replay block shows the house")
+            return ['house'], [block_frames]
+
+        starts = np.clip(np.rint(self.times[:self.nr_reports] * refresh_rate).astype(np.int64), 0, block_frames)
+        starts[0] = 0
+        durations = np.diff(np.append(starts, block_frames))
+
+        percepts, percept_durations = [], []
+        for percept, duration in zip(self.percepts[:self.nr_reports], durations):
+            if percepts and ((percept == percepts[-1]) or (duration < min_frames)):
+                percept_durations[-1] += int(duration)
+            else:
+                percepts.append(percept)
+                percept_durations.append(int(duration))
+        # the first percept is only shorter than min_frames if the second one was reported right after the onset
+        if (len(percepts) > 1) and (percept_durations[0] < min_frames):
+            percept_durations[1] += percept_durations.pop(0)
+            percepts.pop(0)
+        return [PERCEPTS[percept] for percept in percepts], percept_durations
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+'''
+@time    :   2022/04/21 14:08:33
+@author  :   rosagross
+@contact :   grossmann.rc@gmail.com
+
+
+The schedule of a session: the color combinations of the blocks, the percept durations of the unambiguous blocks
+and which response button is used for the house and the face.
+It is drawn from a seed, so it can be reproduced, and it can be made beforehand for a whole cohort:
+
+    python schedule.py 1 2 3 4 5 6 --seed 1234 --output-dir ./schedules
+
+With 'Schedule dir' set in the settings, the session loads <dir>/sub-<ID>_schedule.npz instead of drawing a new one.
+Every session saves the schedule it used next to its events (<output_str>_schedule.npz).
+'''
+
+import argparse
+import numpy as np
+import os
+import yaml
+from timeline import block_colors, nr_rivalry_blocks, seconds_to_frames, transition_counts
+
+opj = os.path.join
+
+# the house or the face is reported with the upper button
+RESPONSE_BUTTONS = ['upper_house', 'upper_face']
+
+def schedule_path(schedule_dir, subject_ID):
+    return opj(schedule_dir, f'sub-{subject_ID:03d}_schedule.npz')
+
+
+def transition_frames(task_settings):
+    """ Number of frames of a transition between two unambiguous trials (0 without fading). """
+    return sum(transition_counts(task_settings)['transition_phases'])
+
+
+def schedule_params(subject_ID, task_settings):
+    """
+    The parameters (in frames) of the schedule of a subject with the given task settings,
+    a loaded schedule has to match the parameters of the session.
+    """
+    refresh_rate = task_settings['Monitor framerate']
+    predefined = isinstance(task_settings['Previous percept duration'], list)
+    return {'subject_ID': subject_ID,
+            'n_blocks': task_settings['Blocks'],
+            'block_frames': seconds_to_frames(task_settings['Stimulus duration rivalry'], refresh_rate, 'Stimulus duration rivalry'),
+            # predefined durations are not drawn
+            'mean_frames': 0 if predefined else int(task_settings['Previous percept duration']*refresh_rate),
+            'jitter_frames': 0 if predefined else int(task_settings['Percept duration jitter']*refresh_rate),
+            'min_frames': seconds_to_frames(task_settings['Minimum percept duration'], refresh_rate, 'Minimum percept duration'),
+            'transition_frames': transition_frames(task_settings),
+            # the percept durations every unambiguous block is shuffled from (empty if they are drawn)
+            'predefined_frames': np.array([elem*2 for elem in task_settings['Previous percept duration']] if predefined else [], dtype=np.int64)}
+
+
+def draw_percept_durations(rng, nr_blocks, block_frames, mean_frames, jitter_frames, min_frames, transition_frames=0):
+    """
+    Draws the percept durations of all unambiguous blocks at once. Every duration is the mean percept duration
+    plus a uniform jitter (between -jitter_frames and jitter_frames) and at least min_frames long (and longer than
+    a transition). Percepts are added until the next one would not fit into the block anymore, the rest of the block
+    is a percept of its own or, if it is too short for that, added to the last percept.
+
+    Parameters
+    ----------
+    rng : numpy.random.Generator
+    nr_blocks : int
+        Number of unambiguous blocks
+    block_frames : int
+        Duration of every block in frames, the durations of a block add up to it
+    mean_frames, jitter_frames, min_frames, transition_frames : int
+        See above (in frames)
+
+    Returns
+    -------
+    list
+        Percept durations (frames) of every block
+    """
+    min_frames = max(min_frames, transition_frames + 1)
+    # enough percepts that even the shortest ones fill the block
+    nr_percepts = block_frames // max(mean_frames - jitter_frames, min_frames) + 1
+    if jitter_frames > 0:
+        jitter = rng.integers(-jitter_frames, jitter_frames, size=(nr_blocks, nr_percepts))
+    else:
+        jitter = np.zeros((nr_blocks, nr_percepts), dtype=np.int64)
+    durations = np.maximum(mean_frames + jitter, min_frames)
+    ends = np.cumsum(durations, axis=1)
+    nr_fitting = (ends <= block_frames).sum(axis=1)
+
+    blocks = []
+    for block_durations, block_ends, n in zip(durations, ends, nr_fitting):
+        block = block_durations[:n].copy()
+        rest = block_frames - (block_ends[n-1] if n else 0)
+        if n and (rest < min_frames):
+            block[-1] += rest
+        elif rest > 0:
+            block = np.append(block, rest)
+        blocks.append(block)
+    return blocks
+
+
+def draw_seed():
+    """ A random seed for a schedule. """
+    return int(np.random.default_rng().integers(2**63 - 1))
+
+
+def make_schedule(subject_ID, task_settings, seed=None):
+    """
+    Draws the schedule of a subject.
+
+    Parameters
+    ----------
+    subject_ID : int
+        Decides which block type the session starts with
+    task_settings : dict
+        'Task settings' of the settings file
+    seed : int
+        Seed of the schedule, the random number generator is seeded with the seed and the subject_ID
+        (default: a random seed, which is stored in the schedule)
+
+    Returns
+    -------
+    dict
+        Parameters (see schedule_params), seed, color combinations of the rivalry and unambiguous blocks,
+        the percept durations of the unambiguous blocks (all blocks in one array and the nr. of percepts per block)
+        and the response button
+    """
+    if seed is None:
+        seed = draw_seed()
+    rng = np.random.default_rng([seed, subject_ID])
+    params = schedule_params(subject_ID, task_settings)
+    start_condition = 0 if subject_ID % 2 == 0 else 1
+    nr_rivalry = nr_rivalry_blocks(params['n_blocks'], start_condition)
+    nr_unambiguous = params['n_blocks'] - nr_rivalry
+    colors_rivalry = block_colors(nr_rivalry, rng)
+    colors_unambiguous = block_colors(nr_unambiguous, rng)
+
+    if isinstance(task_settings['Previous percept duration'], list):
+        # the predefined durations have to be as long as the drawn ones
+        min_frames = max(params['min_frames'], params['transition_frames'] + 1)
+        too_short = params['predefined_frames'][params['predefined_frames'] < min_frames]
+        if len(too_short):
+            raise ValueError(f"the predefined percept durations {too_short.tolist()} (frames) are shorter than "
+                             f"{min_frames} frames (the minimum percept duration and longer than a transition)")
+        blocks = [rng.permutation(params['predefined_frames']) for _ in range(nr_unambiguous)]
+    else:
+        blocks = draw_percept_durations(rng, nr_unambiguous, params['block_frames'], params['mean_frames'],
+                                        params['jitter_frames'], params['min_frames'], params['transition_frames'])
+    # drawn last, so the blocks are the same as in schedules that were made without it
+    response_button = RESPONSE_BUTTONS[rng.integers(len(RESPONSE_BUTTONS))]
+
+    return {**params, 'seed': seed, 'colors_rivalry': colors_rivalry, 'colors_unambiguous': colors_unambiguous,
+            'durations': np.concatenate(blocks + [np.zeros(0, dtype=np.int64)]).astype(np.int64),
+            'block_sizes': np.array([len(block) for block in blocks], dtype=np.int64), 'response_button': response_button}
+
+
+def schedule_blocks(schedule):
+    """ Percept durations (frames) of every unambiguous block of a schedule. """
+    return np.split(schedule['durations'], np.cumsum(schedule['block_sizes'])[:-1])
+
+
+def save_schedule(schedule, path):
+    np.savez(path, **schedule)
+
+
+def load_schedule(path):
+    """ Loads a schedule that was saved with save_schedule (the parameters as int). """
+    with np.load(path) as f:
+        return {key: f[key].item() if f[key].ndim == 0 else f[key] for key in f.files}
+
+
+def check_schedule(schedule, subject_ID, task_settings):
+    """ Raises a ValueError if a schedule was made for another subject or other settings. """
+    params = schedule_params(subject_ID, task_settings)
+    mismatches = [f"{name} {schedule.get(name)} (settings: {value})" for name, value in params.items()
+                  if not np.array_equal(schedule.get(name), value)]
+    if schedule.get('response_button') not in RESPONSE_BUTTONS:
+        mismatches.append(f"response_button {schedule.get('response_button')} (has to be one of {', '.join(RESPONSE_BUTTONS)})")
+    if mismatches:
+        raise ValueError(f"the schedule was made for other settings: {', '.join(mismatches)}")
+
+
+def session_schedule(subject_ID, task_settings, seed=None):
+    """
+    The schedule a session uses: <Schedule dir>/sub-<ID>_schedule.npz (checked against the settings)
+    or, without 'Schedule dir', the schedule drawn with the seed (see make_schedule).
+    Raises a FileNotFoundError if the schedule file does not exist and a ValueError if it doesn't match the settings.
+    """
+    schedule_dir = task_settings['Schedule dir']
+    if schedule_dir is None:
+        return make_schedule(subject_ID, task_settings, seed)
+    path = schedule_path(schedule_dir, subject_ID)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"schedule {path} does not exist")
+    schedule = load_schedule(path)
+    check_schedule(schedule, subject_ID, task_settings)
+    return schedule
+
+
+def make_cohort(subject_IDs, task_settings, seed, schedule_dir):
+    """ Makes and saves the schedules of all subjects (with the same seed), returns their paths. """
+    os.makedirs(schedule_dir, exist_ok=True)
+    paths = []
+    for subject_ID in subject_IDs:
+        schedule = make_schedule(subject_ID, task_settings, seed)
+        paths.append(schedule_path(schedule_dir, subject_ID))
+        save_schedule(schedule, paths[-1])
+        print(f"sub-{subject_ID:03d}: {len(schedule['block_sizes'])} unambiguous blocks with "
+              f"{schedule['block_sizes'].tolist()} percepts, shortest {schedule['durations'].min() if len(schedule['durations']) else 0} frames")
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Make the schedules of a cohort of subjects.')
+    parser.add_argument('subject_IDs', type=int, nargs='+', help='e.g. 1 2 3')
+    parser.add_argument('--settings', default='./settings.yml', help='settings file')
+    parser.add_argument('--seed', type=int, required=True, help='seed of the cohort')
+    parser.add_argument('--output-dir', default='./schedules', help='directory of the schedules')
+    args = parser.parse_args()
+
+    with open(args.settings) as f:
+        task_settings = yaml.safe_load(f)['Task settings']
+    make_cohort(args.subject_IDs, task_settings, args.seed, args.output_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,18 +8,31 @@
 
 import numpy as np
 import os
+from time import perf_counter
 from psychopy.visual import ImageStim, TextStim
 from psychopy.hardware import keyboard
 from exptools2.core import PylinkEyetrackerSession
 from trial import BRTrial
-import random
+from profiling import FrameProfiler
+from analysis import RunningStats, calc_switch_times, percept_duration_stats, response_summary
+from events import EventBuffer, EventJournal, merge_logs
+from tracker import TrackerQueue
+from columnar import events_tsv_to_columns, summary_path, write_summary
+from timeline import BLOCK_TYPES, STIMULI, STIMULUS_IDS, compile_timeline, seconds_to_frames, splice_block, trial_rows, transition_counts, unambiguous_trials
+from replay import ReplayRecorder
+from stim_cache import StimulusCache
+from session_log import logger, start_logging, stop_logging
+from monitor import MonitorPublisher
+from schedule import save_schedule, schedule_blocks, schedule_path, session_schedule
+from stim import StaticStim, PhaseStim, FadingStack, FadingStim, CrossFadeStim, alpha_ramp, select_fading_steps
+from PIL import Image
 
 opj = os.path.join
 
 
 class BinocularRivalrySession(PylinkEyetrackerSession):
 
-    def __init__(self, output_str, output_dir, settings_file, subject_ID, eyetracker_on):
+    def __init__(self, output_str, output_dir, settings_file, subject_ID, eyetracker_on, schedule_seed=None):
         """ Initializes BinocularRival object. 
       
         Parameters
@@ -35,9 +48,26 @@ class BinocularRivalrySession(PylinkEyetrackerSession):
             ID of the current participant
         eyetracker_on : bool 
             Determines if the cablibration process is getting started.
+        schedule_seed : int
+            Seed of the schedule that is drawn if there is no 'Schedule dir' (default: a random seed)
         """
             
         super().__init__(output_str, output_dir, settings_file, eyetracker_on=eyetracker_on)  # initialize using parent class constructor!
+        # initialize the keyboard for the button presses
+        self.kb = keyboard.Keyboard()
+        self.schedule_seed = schedule_seed
+        self.setup_task(subject_ID)
+
+
+    def setup_task(self, subject_ID):
+        """
+        Reads the task settings, compiles the timeline and creates the stimuli.
+        Only needs the settings, window, keyboard and output paths of the session, so it can be used
+        with other backends than exptools2 as well (see simulation.py).
+        """
+        # the output is written to the console and the log file from a background thread (see session_log.py)
+        os.makedirs(self.output_dir, exist_ok=True)
+        start_logging(opj(self.output_dir, self.output_str+'_log.txt'), self.settings['Task settings']['Log level'])
         self.subject_ID = subject_ID
         self.n_blocks = self.settings['Task settings']['Blocks'] #  for now this can be set in the setting file! 
         self.stim_duration_rivalry = self.settings['Task settings']['Stimulus duration rivalry']
@@ -49,12 +79,25 @@ class BinocularRivalrySession(PylinkEyetrackerSession):
         self.getready_duration = self.settings['Task settings']['Get ready duration']
         self.nr_fading_stimuli = self.settings['Task settings']['Nr fading stimuli']
         self.transition_length = self.settings['Task settings']['Transition length']
+        self.fading_mode = self.settings['Task settings']['Fading mode']
+        self.transition_type = self.settings['Task settings']['Transition type']
+        if (self.fading_mode == 'procedural') and (self.transition_type != 'fading'):
+            raise ValueError(f"Transition type '{self.transition_type}' needs pre-rendered images, it can't be used with the procedural fading mode")
         self.draw_test_stimuli = self.settings['Task settings']['Test stimuli']
         self.exit_key = self.settings['Task settings']['Exit key']
         self.break_buttons = self.settings['Task settings']['Break buttons']
         self.response_interval = self.settings['Task settings']['Response interval']
+        self.response_capture = self.settings['Task settings']['Response capture']
+        if self.response_capture not in ('release', 'press'):
+            raise ValueError(f"Response capture has to be 'release' or 'press', not '{self.response_capture}'")
         self.monitor_refreshrate = self.settings['Task settings']['Monitor framerate']
         self.screentick_conversion = self.settings['Task settings']['Screentick conversion']
+        self.columnar_output = self.settings['Task settings']['Columnar output']
+        self.replay = self.settings['Task settings']['Replay blocks']
+        self.response_keys = self.settings['Task settings']['Response keys']
+        # the images are decoded once and memory-mapped from the cache at every start (see stim_cache.py)
+        stimulus_cache = self.settings['Task settings']['Stimulus cache']
+        self.stimulus_cache = None if stimulus_cache is None else StimulusCache(stimulus_cache)
     
         
         # count the subjects responses for each condition
@@ -62,154 +105,138 @@ class BinocularRivalrySession(PylinkEyetrackerSession):
         self.rivalry_responses = 0 
         self.total_responses = 0
         self.correct_responses = 0 
+        self.replay_responses = 0
+        self.correct_replay_responses = 0
         self.switch_times_mean = 0
         self.switch_times_std = 0 
+        # updated with every button press in the rivalry blocks, so the statistics can be followed during the session
+        self.running_stats = RunningStats()
         self.nr_unambiguous_trials = 0
 
         # randomly choose if the participant responds with the right or the left hand
         self.response_hand = 'preferred' # 'left' if random.uniform(1,100) < 50 else 'right'
 
-        # randomly choose if the participant responds with the right BUTTON to house or face
-        self.response_button = 'upper_house' if random.uniform(1,100) < 50 else 'upper_face'
-
-        # to be sure that we don't loose the phase, we make it more then 1 screentick   
-        self.refresh_stimulus_speed = int(self.monitor_refreshrate/self.screentick_conversion)
+        # to be sure that we don't loose the phase, we make it more then 1 screentick
+        # (raises a ValueError if the settings would shorten the transitions)
+        counts = transition_counts(self.settings['Task settings'])
+        self.refresh_stimulus_speed = counts['refresh_stimulus_speed']
         # we don't have to take every single fading picture, only if we would like to have it very smooth
-        self.transition_steps = int((self.nr_fading_stimuli/self.transition_length)*self.refresh_stimulus_speed)
+        self.transition_steps = counts['transition_steps']
+        self.nr_fading_phases = counts['fading_phases']
         # compute the phase duration array for the contrast fading transitions
-        self.transition_phases = [self.refresh_stimulus_speed]*int(self.transition_length/self.refresh_stimulus_speed)
+        self.transition_phases = counts['transition_phases']
 
-        # initialize the keyboard for the button presses
-        self.kb = keyboard.Keyboard()
+        # the eyetracker messages are sent from a background thread, so they don't block the frame loop
+        if self.eyetracker_on:
+            self.tracker = self.create_tracker_queue()
+
+        # optionally time every frame and the code that runs in it (see profiling.py)
+        self.profiler = FrameProfiler(1/self.monitor_refreshrate) if self.settings['Task settings']['Profile frames'] else None
+
+        # the state of the session is sent to the live monitor (see monitor.py), nothing waits if no monitor listens
+        monitor_port = self.settings['Task settings']['Live monitor port']
+        self.monitor = None if monitor_port is None else MonitorPublisher(monitor_port, 1/self.monitor_refreshrate)
+
+        # responses are collected in a preallocated buffer during the frame loop
+        self.response_log = EventBuffer({'event_type': object, 'trial_nr': int, 'onset': float, 'key_duration': float,
+                                         'phase': int, 'response': object, 'response_button': object, 'nr_frames': int,
+                                         'log_position': int})
+        # keys that were logged at key-down and are still held (key press and row in the response log)
+        self.held_keys = []
 
 
         if self.settings['Task settings']['Screenshot']==True:
-            self.screen_dir=output_dir+'/'+output_str+'_Screenshots'
+            self.screen_dir=self.output_dir+'/'+self.output_str+'_Screenshots'
             if not os.path.exists(self.screen_dir):
                 os.mkdir(self.screen_dir)
         
+        # every phase onset and response is journaled right away, so a crashed session can be recovered
+        self.journal = EventJournal(opj(self.output_dir, self.output_str+'_journal.jsonl'))
+
+        self.create_schedule()
+        # randomly choose if the participant responds with the right BUTTON to house or face (drawn with the schedule)
+        self.response_button = self.schedule['response_button']
+
+        # the percepts reported in the rivalry blocks are recorded for the replay blocks
+        if self.replay:
+            upper, lower = ('house', 'face') if self.response_button == 'upper_house' else ('face', 'house')
+            self.replay_recorder = ReplayRecorder({self.response_keys[0]: upper, self.response_keys[1]: lower})
+        else:
+            self.replay_recorder = None
+
         self.create_blocks()
         self.create_stimulus()
+        if self.stimulus_cache is not None:
+            logger.info("stimulus cache: %d images decoded", self.stimulus_cache.nr_decoded)
 
+        self.journal.write('session', output_str=self.output_str, subject_ID=self.subject_ID, response_hand=self.response_hand,
+                           response_button=self.response_button, n_blocks=self.n_blocks,
+                           nr_unambiguous_trials=self.nr_unambiguous_trials, response_interval=self.response_interval,
+                           exclude_first_last=self.settings['Task settings']['Exclude first and last percept'])
+
+
+    def create_schedule(self):
+        """
+        Loads the schedule of the subject (color combinations and unambiguous percept durations, see schedule.py)
+        from the 'Schedule dir' or draws it, and saves it next to the output.
+        """
+        # the same function builds the schedule in preflight.check_blocks
+        self.schedule = session_schedule(self.subject_ID, self.settings['Task settings'], self.schedule_seed)
+        schedule_dir = self.settings['Task settings']['Schedule dir']
+        if schedule_dir is not None:
+            logger.info("schedule: %s (seed %d)", schedule_path(schedule_dir, self.subject_ID), self.schedule['seed'])
+        else:
+            logger.info("schedule: seed %d", self.schedule['seed'])
+        save_schedule(self.schedule, opj(self.output_dir, self.output_str+'_schedule.npz'))
 
-    def create_blocks(self):
-        """creates blocks with trials by determining the block order and the shifts in the unambiguous trials"""
-        self.trial_list=[]
 
+    def create_blocks(self):
+        """
+        Compiles the blocks (block order, color combinations and the shifts in the unambiguous trials)
+        into a frame-exact timeline. The trials themselves are only created when the session runs.
+        """
         # define which condition starts (equal subjects are 0, unequal 1)
         self.start_condition = 0 if self.subject_ID % 2 == 0 else 1
 
-        # for every block, the trials are created beforehand
-        # note that the rivalry block only has one trial, whereas the unambiguous block has several trials
-        trial_nr = 1
-        block_ID_rivalry = 0 
-        block_ID_unambig = 0 
-
-        # build an array with the possible color combinations 
-        # (has to be done BEFORE we construct the trials below)
-        color_combinations = ['redface', 'redhouse']
-        colors_list = []
-        # add the colorcombination alternatingly 
-        for i in range(int(self.n_blocks/2)):
-            # if there is an odd nr. of trials we should choose the last block randomly!
-            if ((self.n_blocks%2) != 0) and (i == self.n_blocks-1):
-                idx = 0 if random.uniform(1,100) < 50 else 1
-            else:
-                idx = 0 if (i%2)==0 else 1 
-                
-            colors_list.append(color_combinations[idx])
+        self.block_frames = seconds_to_frames(self.stim_duration_rivalry, self.monitor_refreshrate, 'Stimulus duration rivalry')
+        self.schedule_durations = iter(schedule_blocks(self.schedule))
+        transition_phases = self.transition_phases if self.nr_fading_stimuli != 0 else []
+        self.timeline = compile_timeline(self.n_blocks, self.start_condition, self.block_frames,
+                                         seconds_to_frames(self.break_duration, self.monitor_refreshrate, 'Break duration'),
+                                         seconds_to_frames(self.getready_duration, self.monitor_refreshrate, 'Get ready duration'),
+                                         transition_phases, self.create_duration_array,
+                                         self.schedule['colors_rivalry'], self.schedule['colors_unambiguous'], self.replay)
+        logger.info("timeline: %d blocks, %d trials, %d frames", self.n_blocks, self.timeline['trial'][-1]+1, self.timeline['duration'].sum())
 
-        colors_rivalry = np.array(colors_list)
-        colors_ambiguous = np.array(colors_list)
-        
-        for i in range(self.n_blocks):
-            # we start counting with 1 because the blocks with ID 0 are breaks!
-            block_ID = i + 1 
-            print("\ncurrent block is", block_ID)
-            print("start condition", self.start_condition)
-
-            # before every block we have an interstimulus interval where only the fixation is seen
-            self.trial_list.append(BRTrial(self, 0, 0, 'break', 'break', 'break', self.response_hand, [0, self.getready_duration*self.monitor_refreshrate], 'frames'))
-            # add a break if its not the first block
-            if not i == 0:
-                self.trial_list.append(BRTrial(self, 0, 0, 'break', 'break', 'break', self.response_hand, [self.break_duration*self.monitor_refreshrate, self.getready_duration*self.monitor_refreshrate] , 'frames'))
-
-
-            # equal subjects start with rivarly, unequal with unambiguous
-            if (block_ID + self.start_condition) % 2 == 0:
-                block_ID_rivalry += 1
-                block_type = 'rivalry'
-                # determine type and color combination
-                np.random.shuffle(colors_rivalry)
-                trial_type = 'house_face'
-                color_comb = 'rivalry_' + colors_rivalry[0] 
-                colors_rivalry = colors_rivalry[1:]
-
-                self.trial_list.append(BRTrial(self, trial_nr, block_ID_rivalry, block_type, trial_type, color_comb, self.response_hand,[self.stim_duration_rivalry*self.monitor_refreshrate], 'frames'))
-                print("appended trial nr", trial_nr)
-                trial_nr += 1 
 
-            else:
-                block_type = 'unambiguous'
-                block_ID_unambig += 1
-                # create the phase duration array (every image should be displayed for a different amount of time
-                # but it should add up to the same duration for every unambiguous block)
-                phase_durations_unambiguous = self.create_duration_array()
-                print("durations unambiguous:", phase_durations_unambiguous)
-
-                np.random.shuffle(colors_ambiguous)
-                color_comb = colors_ambiguous[0] 
-                colors_ambiguous = colors_ambiguous[1:]
-                for i, phase_duration in enumerate(phase_durations_unambiguous):
-                    # determine if next trial shows house or face
-                    trial_type = 'house' if trial_nr % 2 == 0 else 'face'
-                    
-
-                    print("appended trial nr", trial_nr)
-                    print("trial number in unabiguous:", i)
-                    print("phase duration", phase_duration)
-                    
-                    # we have to insert the transition period here (except for the last trial)
-                    # the trial nr, block ID and block and trial type stay the same as for the previous trial 
-                    # get the correct color combination
-                    if (trial_type=='house') & (color_comb=='redface'):
-                        fading_color = 'hb2fr'
-                    elif (trial_type=='face') & (color_comb=='redface'):
-                        fading_color = 'fr2hb'
-                    elif (trial_type=='house') & (color_comb=='redhouse'):
-                        fading_color = 'hr2fb'
-                    else:
-                        fading_color = 'fb2hr'
-
-                    if self.nr_fading_stimuli != 0:
-                        
-                        # cut out the beginning and end of trial because the transition takes time (but the e)
-                        if ((i == len(phase_durations_unambiguous)-1) or (i == 0)):
-                            print('last or first')
-                            phase_duration_fading = phase_duration - int(self.transition_length/2) # in the beginning/end only cut half 
-                            print('phase duration fading', phase_duration_fading)
-                            self.trial_list.append(BRTrial(self, trial_nr, block_ID_unambig, block_type, trial_type, color_comb, self.response_hand,[phase_duration_fading], 'frames'))
-                            if i == 0:
-                                print('first transition')
-                                print('transition phases', self.transition_phases)
-                                self.trial_list.append(BRTrial(self, trial_nr, block_ID_unambig, block_type, trial_type, fading_color, self.response_hand, self.transition_phases, 'frames'))
-                            
-                        else:
-                            print('phase duration before', phase_duration)
-                            phase_duration_fading = phase_duration - self.transition_length
-                            print('phase duration sub fading', phase_duration_fading)
-                            self.trial_list.append(BRTrial(self, trial_nr, block_ID_unambig, block_type, trial_type, color_comb, self.response_hand, [phase_duration_fading], 'frames'))
-                            self.trial_list.append(BRTrial(self, trial_nr, block_ID_unambig, block_type, trial_type, fading_color, self.response_hand, self.transition_phases, 'frames'))
-                            
-                    else:
-                        print('phase durations and type', phase_duration, self.transition_phases, trial_type, fading_color)
-                        self.trial_list.append(BRTrial(self, trial_nr, block_ID_unambig, block_type, trial_type, color_comb, self.response_hand,[phase_duration], 'frames'))
-                        #self.trial_list.append(BRTrial(self, trial_nr, block_ID_unambig, block_type, trial_type, fading_color, self.response_hand, self.transition_phases, 'frames'))
-                    trial_nr += 1 
-                
-
-        # have one break in the very end
-        self.trial_list.append(BRTrial(self, 0, 0, 'break', 'break', 'break', self.response_hand, [0, self.getready_duration*self.monitor_refreshrate], 'frames'))
+    def create_trials(self):
+        """
+        Creates the trials one after another from the timeline, only when they are about to run.
+        The replay block after a rivalry block is compiled as soon as the rivalry block is over (in the break before the replay).
+        """
+        trial = 0
+        while trial <= self.timeline['trial'][-1]:
+            rows = trial_rows(self.timeline, trial)
+            trial_type, color_comb = STIMULI[rows['stimulus'][0]]
+            block_type = BLOCK_TYPES[rows['block_type'][0]]
+            yield BRTrial(self, int(rows['trial_nr'][0]), int(rows['block_ID'][0]), block_type,
+                          trial_type, color_comb, self.response_hand, rows['duration'].tolist(), 'frames')
+            if self.replay and (block_type == 'rivalry'):
+                self.compile_replay(int(rows['block_ID'][0]))
+            trial += 1
+
+
+    def compile_replay(self, block_ID):
+        """ Replaces the placeholder of a replay block in the timeline with the percepts reported in the rivalry block. """
+        start = perf_counter()
+        transition_phases = self.transition_phases if self.nr_fading_stimuli != 0 else []
+        trial_types, durations = self.replay_recorder.compile(self.block_frames, self.monitor_refreshrate,
+                                                              int(np.sum(transition_phases)) + 1)
+        placeholder = self.timeline[(self.timeline['block_type'] == BLOCK_TYPES.index('replay')) & (self.timeline['block_ID'] == block_ID)]
+        trials = unambiguous_trials(durations, int(placeholder['trial_nr'][0]), 'replay', transition_phases, trial_types)
+        self.timeline = splice_block(self.timeline, 'replay', block_ID,
+                                     [(trial[0], block_ID, 'replay') + trial[1:] for trial in trials], self.block_frames)
+        logger.info("replay block %d: %d percepts, compiled in %.1fms", block_ID, len(durations), (perf_counter() - start)*1000)
 
 
     def create_stimulus(self):
@@ -219,83 +246,137 @@ class BinocularRivalrySession(PylinkEyetrackerSession):
         """
 
         # simple, unambiguous non-fading stimuli 
-        self.house_red = ImageStim(self.win, image=self.path_to_stim+'house_red.bmp', units='deg', size=self.stim_size)
-        self.house_blue = ImageStim(self.win, image=self.path_to_stim+'house_blue.bmp', units='deg', size=self.stim_size)
-        self.face_red = ImageStim(self.win, image=self.path_to_stim+'face_red.bmp', units='deg', size=self.stim_size)
-        self.face_blue = ImageStim(self.win, image=self.path_to_stim+'face_blue.bmp', units='deg', size=self.stim_size)
+        self.house_red = self.create_image(self.path_to_stim+'house_red.bmp', units='deg', size=self.stim_size)
+        self.house_blue = self.create_image(self.path_to_stim+'house_blue.bmp', units='deg', size=self.stim_size)
+        self.face_red = self.create_image(self.path_to_stim+'face_red.bmp', units='deg', size=self.stim_size)
+        self.face_blue = self.create_image(self.path_to_stim+'face_blue.bmp', units='deg', size=self.stim_size)
         # ambiguous stimuli
-        self.rivalry_redface = ImageStim(self.win, image=self.path_to_stim+'rivalry_redface.bmp', units='deg', size=self.stim_size)
-        self.rivalry_redhouse = ImageStim(self.win, image=self.path_to_stim+'rivalry_redhouse.bmp', units='deg', size=self.stim_size)
-        self.fixation_screen = ImageStim(self.win, image=self.path_to_stim+'fixation_screen.bmp', units='deg', size=self.stim_size)
+        self.rivalry_redface = self.create_image(self.path_to_stim+'rivalry_redface.bmp', units='deg', size=self.stim_size)
+        self.rivalry_redhouse = self.create_image(self.path_to_stim+'rivalry_redhouse.bmp', units='deg', size=self.stim_size)
+        self.fixation_screen = self.create_image(self.path_to_stim+'fixation_screen.bmp', units='deg', size=self.stim_size)
         
         # fading stimuli
-        self.fading_bluehouse_2_redface = []
-        self.fading_redhouse_2_blueface = []
-        self.fading_redface_2_bluehouse = []
-        self.fading_blueface_2_redhouse = []
-        
-        fading_step = 0
-        for i in range(int(self.nr_fading_stimuli/self.transition_steps)):
-            self.fading_bluehouse_2_redface.append(ImageStim(self.win, image=self.path_to_stim+f'fading/fading_hb2fr_{fading_step}.bmp', units='deg', size=self.stim_size))
-            self.fading_redhouse_2_blueface.append(ImageStim(self.win, image=self.path_to_stim+f'fading/fading_hr2fb_{self.nr_fading_stimuli-1-fading_step}.bmp', units='deg', size=self.stim_size))
-            self.fading_redface_2_bluehouse.append(ImageStim(self.win, image=self.path_to_stim+f'fading/fading_hb2fr_{self.nr_fading_stimuli-1-fading_step}.bmp', units='deg', size=self.stim_size))
-            self.fading_blueface_2_redhouse.append(ImageStim(self.win, image=self.path_to_stim+f'fading/fading_hr2fb_{fading_step}.bmp', units='deg', size=self.stim_size))
-            fading_step += self.transition_steps
+        if self.nr_fading_stimuli != 0:
+            nr_fading_phases = self.nr_fading_phases
+
+            if self.fading_mode == 'procedural':
+                # the base images are cross-faded at runtime with the alpha values of the fading images
+                src_alpha, dst_alpha = alpha_ramp(self.nr_fading_stimuli)
+                alpha_forwards = [select_fading_steps(alpha, self.transition_steps, nr_fading_phases) for alpha in (src_alpha, dst_alpha)]
+                alpha_backwards = [select_fading_steps(alpha, self.transition_steps, nr_fading_phases, reverse=True) for alpha in (src_alpha, dst_alpha)]
+                fade_face_red = self.create_image(self.path_to_stim+'face_red.bmp', units='deg', size=self.stim_size)
+                fade_house_blue = self.create_image(self.path_to_stim+'house_blue.bmp', units='deg', size=self.stim_size)
+                fade_house_red = self.create_image(self.path_to_stim+'house_red.bmp', units='deg', size=self.stim_size)
+                fade_face_blue = self.create_image(self.path_to_stim+'face_blue.bmp', units='deg', size=self.stim_size)
+
+                self.fading_bluehouse_2_redface = CrossFadeStim(fade_face_red, fade_house_blue, *alpha_forwards)
+                self.fading_redhouse_2_blueface = CrossFadeStim(fade_house_red, fade_face_blue, *alpha_backwards)
+                self.fading_redface_2_bluehouse = CrossFadeStim(fade_face_red, fade_house_blue, *alpha_backwards)
+                self.fading_blueface_2_redhouse = CrossFadeStim(fade_house_red, fade_face_blue, *alpha_forwards)
+            else:
+                # every transition is one memory-mapped frame stack, the fading sequences are views into it
+                fading_hb2fr = FadingStack(self.path_to_stim+'fading/', 'hb2fr', self.nr_fading_stimuli, self.transition_type)
+                fading_hr2fb = FadingStack(self.path_to_stim+'fading/', 'hr2fb', self.nr_fading_stimuli, self.transition_type)
+
+                self.fading_bluehouse_2_redface = self.create_fading_stim(fading_hb2fr.sequence(self.transition_steps, nr_fading_phases))
+                self.fading_redhouse_2_blueface = self.create_fading_stim(fading_hr2fb.sequence(self.transition_steps, nr_fading_phases, reverse=True))
+                self.fading_redface_2_bluehouse = self.create_fading_stim(fading_hb2fr.sequence(self.transition_steps, nr_fading_phases, reverse=True))
+                self.fading_blueface_2_redhouse = self.create_fading_stim(fading_hr2fb.sequence(self.transition_steps, nr_fading_phases))
 
         # test stimuli (used to check if colours are nicely displayed)
-        self.test_colours = ImageStim(self.win, image=self.path_to_stim+'test.bmp', units='pix', size=768)
-        self.test_house_red = ImageStim(self.win, image=self.path_to_stim+'house_red.bmp', units='deg', size=self.stim_size/2, pos=[-2,-2])
-        self.test_house_blue = ImageStim(self.win, image=self.path_to_stim+'house_blue.bmp', units='deg', size=self.stim_size/2, pos=[2,-2])
-        self.test_face_red = ImageStim(self.win, image=self.path_to_stim+'face_red.bmp', units='deg', size=self.stim_size/2, pos=[-2,2])
-        self.test_face_blue = ImageStim(self.win, image=self.path_to_stim+'face_blue.bmp', units='deg', size=self.stim_size/2, pos=[2,2])
+        self.test_colours = self.create_image(self.path_to_stim+'test.bmp', units='pix', size=768)
+        self.test_house_red = self.create_image(self.path_to_stim+'house_red.bmp', units='deg', size=self.stim_size/2, pos=[-2,-2])
+        self.test_house_blue = self.create_image(self.path_to_stim+'house_blue.bmp', units='deg', size=self.stim_size/2, pos=[2,-2])
+        self.test_face_red = self.create_image(self.path_to_stim+'face_red.bmp', units='deg', size=self.stim_size/2, pos=[-2,2])
+        self.test_face_blue = self.create_image(self.path_to_stim+'face_blue.bmp', units='deg', size=self.stim_size/2, pos=[2,2])
 
         # Stimulus text for the break
-        self.break_stim = TextStim(self.win, text="Break")
-
+        self.break_stim = self.create_text("Break")
+
+        # what to draw for every (trial_type, color_comb) in timeline.STIMULI, the trials look it up once
+        # in the break there is only the "break" text or fixation dot on a blank screen
+        stimulus_table = {('break', 'break'): PhaseStim([self.fixation_screen, self.break_stim], [self.fixation_screen]),
+                          ('house_face', 'rivalry_redface'): StaticStim(self.rivalry_redface),
+                          ('house_face', 'rivalry_redhouse'): StaticStim(self.rivalry_redhouse),
+                          ('face', 'redface'): StaticStim(self.face_red),
+                          ('face', 'redhouse'): StaticStim(self.face_blue),
+                          ('house', 'redface'): StaticStim(self.house_blue),
+                          ('house', 'redhouse'): StaticStim(self.house_red)}
+        if self.replay:
+            stimulus_table.update(self.create_replay_stimulus())
+        if self.nr_fading_stimuli != 0:
+            stimulus_table.update({('face', 'fr2hb'): self.fading_redface_2_bluehouse,
+                                   ('face', 'fb2hr'): self.fading_blueface_2_redhouse,
+                                   ('house', 'hb2fr'): self.fading_bluehouse_2_redface,
+                                   ('house', 'hr2fb'): self.fading_redhouse_2_blueface})
+        self.stimulus_table = [stimulus_table.get(stimulus) for stimulus in STIMULI]
+
+        # every stimulus of the timeline has to exist before the session starts
+        for stimulus_id in np.unique(self.timeline['stimulus']):
+            self.resolve_stimulus(*STIMULI[stimulus_id])
+
+    def create_replay_stimulus(self):
+        """
+        Creates the stimuli of the replay blocks: the replay images of the house and face and, with fading,
+        the procedural cross-fades between them (there are no fading images of them).
+        """
+        self.replay_face = self.create_image(self.path_to_stim+'replay_face.bmp', units='deg', size=self.stim_size)
+        self.replay_house = self.create_image(self.path_to_stim+'replay_house.bmp', units='deg', size=self.stim_size)
+        replay_stimuli = {('face', 'replay'): StaticStim(self.replay_face),
+                          ('house', 'replay'): StaticStim(self.replay_house)}
+        if self.nr_fading_stimuli != 0:
+            nr_fading_phases = self.nr_fading_phases
+            src_alpha, dst_alpha = alpha_ramp(self.nr_fading_stimuli)
+            alpha_forwards = [select_fading_steps(alpha, self.transition_steps, nr_fading_phases) for alpha in (src_alpha, dst_alpha)]
+            alpha_backwards = [select_fading_steps(alpha, self.transition_steps, nr_fading_phases, reverse=True) for alpha in (src_alpha, dst_alpha)]
+            fade_face = self.create_image(self.path_to_stim+'replay_face.bmp', units='deg', size=self.stim_size)
+            fade_house = self.create_image(self.path_to_stim+'replay_house.bmp', units='deg', size=self.stim_size)
+            replay_stimuli.update({('face', 'f2h'): CrossFadeStim(fade_face, fade_house, *alpha_backwards),
+                                   ('house', 'h2f'): CrossFadeStim(fade_face, fade_house, *alpha_forwards)})
+        return replay_stimuli
+
+    def create_image(self, image, **kwargs):
+        """ Creates an ImageStim in the session's window. """
+        return ImageStim(self.win, image=self.load_image(image, **kwargs), **kwargs)
+
+    def load_image(self, image, **kwargs):
+        """ Returns the decoded image from the stimulus cache for the path of an image (without cache the path itself). """
+        if isinstance(image, str) and (self.stimulus_cache is not None):
+            return self.stimulus_cache.load(image)
+        return image
+
+    def create_text(self, text, **kwargs):
+        """ Creates a TextStim in the session's window. """
+        return TextStim(self.win, text=text, **kwargs)
+
+    def create_tracker_queue(self):
+        """ Wraps the tracker into a queue that sends the messages from a background thread. """
+        return TrackerQueue(self.tracker)
+
+    def create_fading_stim(self, frames):
+        """
+        Creates one ImageStim per frame of a fading sequence (frames is a view into the memory-mapped stack),
+        this reads the selected frames from the stack and uploads their textures before the first trial.
+        """
+        return FadingStim([self.create_image(Image.fromarray(np.asarray(frame)), units='deg', size=self.stim_size) for frame in frames])
 
 
     def draw_stimulus(self, phase):
         """ This function will be executed from the Trial instance, when the trial runs. """
-        
-        # the fading index depends on which phase we're in and how many phases there are in total in this trial 
-        fading_index = self.current_trial.phase #* self.transition_steps
+        # the stimulus was looked up when the trial was created, fading stimuli use the phase as fading index
+        self.current_trial.stimulus.draw(phase)
 
-        # Ugly, but I don't know how to make it more beautiful atm..
-        if self.current_trial.trial_type == 'house_face':
-            if self.current_trial.color_comb == 'rivalry_redhouse':
-                self.rivalry_redhouse.draw()
-            else:
-                self.rivalry_redface.draw()
-        elif self.current_trial.trial_type == 'face':
-            if self.current_trial.color_comb == 'redface':
-                self.face_red.draw()
-            elif self.current_trial.color_comb == 'redhouse': 
-                self.face_blue.draw()
-            elif self.current_trial.color_comb == 'fr2hb':
-                self.fading_redface_2_bluehouse[fading_index].draw()
-            elif self.current_trial.color_comb == 'fb2hr':
-                self.fading_blueface_2_redhouse[fading_index].draw()
-            
-        elif self.current_trial.trial_type == 'house':
-            if self.current_trial.color_comb == 'redface':
-                self.house_blue.draw()
-            elif self.current_trial.color_comb == 'redhouse':
-                self.house_red.draw()
-            elif self.current_trial.color_comb == 'hr2fb':
-                self.fading_redhouse_2_blueface[fading_index].draw()
-            elif self.current_trial.color_comb == 'hb2fr':
-                self.fading_bluehouse_2_redface[fading_index].draw()
-        elif self.current_trial.trial_type == 'break':
-            # in the break phase there is only the "break" text or fixation dot on a blank screen
-            if phase == 0:
-                self.fixation_screen.draw()
-                self.break_stim.draw()
-            elif phase == 1:
-                self.fixation_screen.draw()
+
+    def resolve_stimulus(self, trial_type, color_comb):
+        """ Returns the drawable stimulus of a trial type and color combination (see timeline.STIMULI). """
+        stimulus_id = STIMULUS_IDS.get((trial_type, color_comb))
+        if (stimulus_id is None) or (self.stimulus_table[stimulus_id] is None):
+            raise ValueError(f"there is no stimulus for trial type '{trial_type}' with color combination '{color_comb}'")
+        return self.stimulus_table[stimulus_id]
 
 
     def run(self):
-        print("-------------RUN SESSION---------------")
+        logger.info("-------------RUN SESSION---------------")
         
         if self.eyetracker_on:
             self.calibrate_eyetracker()
@@ -319,8 +400,9 @@ class BinocularRivalrySession(PylinkEyetrackerSession):
         # this method actually starts the timer which keeps track of trial onsets
         self.start_experiment()
         self.kb.clock.reset()
+        self.journal.write('start', exp_start=self.exp_start)
         
-        for trial in self.trial_list:
+        for trial in self.create_trials():
             self.current_trial = trial 
             self.current_trial_start_time = self.clock.getTime()
             # the run function is implemented in the parent Trial class, so our Trial inherited it
@@ -330,95 +412,125 @@ class BinocularRivalrySession(PylinkEyetrackerSession):
         self.display_text('End. \n Well done!', keys='space')
         self.close()
 
+    def close(self):
+        """ Closes the session (which writes the events.tsv) and the journal. """
+        super().close()
+        self.stop_tracker_queue()
+        self.write_columnar_events()
+        self.close_journal()
+        self.close_monitor()
+        stop_logging()
+
+    def stop_tracker_queue(self):
+        """ Stops sending eyetracker messages and prints how long they took (and how many of them failed). """
+        if self.eyetracker_on:
+            self.tracker.stop()
+            if self.tracker.nr_failed:
+                logger.warning(self.tracker.report())
+            else:
+                logger.info(self.tracker.report())
+
+    def write_columnar_events(self):
+        """ Writes the events.tsv of the session in the columnar format as well (if 'Columnar output' is set). """
+        if self.columnar_output:
+            events_tsv_to_columns(opj(self.output_dir, self.output_str+'_events.tsv'))
+
+    def close_monitor(self):
+        if self.monitor is not None:
+            logger.info("live monitor: %d packets sent, %d not sent", self.monitor.nr_sent, self.monitor.nr_failed)
+            self.monitor.close()
+
+    def close_journal(self):
+        """ Writes the end of the session to the journal and closes it. """
+        self.journal.write('stop', exp_stop=self.exp_stop, nr_frames=self.nr_frames)
+        self.journal.close()
+
     def create_duration_array(self):
         """
-        Function that takes the duration entries from the setting file and constructs the 
-        phase duration (duration of trial and ISI) for all trials. 
-        The jitter is added to the mean percept duration from previous studies. If the jitter is
-        0.1s, a random nr between -0.1 and 0.1 is added. 
+        Returns the phase durations (frames) of the next unambiguous block of the schedule.
+        The durations are drawn in schedule.py: the jitter is added to the mean percept duration from previous
+        studies (if the jitter is 0.1s, a random nr between -0.1 and 0.1 is added) or the predefined durations are shuffled.
         """
-
         if isinstance(self.previous_percept_duration, list):
-            print('Use predefined phase durations')
-            phase_durations = [elem*2 for elem in self.previous_percept_duration]
-            np.random.shuffle(phase_durations)
-        else:
-            # while the number is not above the trial duration, generate more trial durations
-            max_duration = self.stim_duration_rivalry
-            nr_frames_total = max_duration*self.monitor_refreshrate
-            frames_percept_duration = self.previous_percept_duration*self.monitor_refreshrate
-            jitter_in_frames = int(self.percept_jitter*self.monitor_refreshrate)
-            current_duration = 0 
-            phase_durations = []
-            while True:
-                percept_duration= frames_percept_duration + random.randrange(-jitter_in_frames, jitter_in_frames)
-                current_duration = np.array(phase_durations).sum() + percept_duration
-                if current_duration > nr_frames_total:
-                    break
-                
-                phase_durations.append(int(percept_duration))
-                
-            current_duration = np.array(phase_durations).sum()
-            duration_difference = int(nr_frames_total - current_duration)
-            # append whats missing to the last trial
-            phase_durations.append(duration_difference)
-
-        print("duration unambiguous block:", np.array(phase_durations).sum(), "and length:", len(phase_durations))
+            logger.debug('Use predefined phase durations')
+        phase_durations = next(self.schedule_durations).tolist()
+
+        logger.debug("duration unambiguous block: %d and length: %d", np.sum(phase_durations), len(phase_durations))
         self.nr_unambiguous_trials = self.nr_unambiguous_trials + len(phase_durations)
-        print(phase_durations)
+        logger.debug("%s", phase_durations)
         return phase_durations
 
 
     def calc_percept_durations(self):
         """
         Calculates the average percept duration of in the rivalry block.
-        We leave out the first and last percept duration since they are determined by 
-        the trial timing.
+        If 'Exclude first and last percept' is set, we leave out the first and last percept duration
+        since they are determined by the trial timing.
         """
-        data_rivalry = self.global_log.loc[self.global_log['block_type'] == 'rivalry']
-        # compute the average duration 
-        unique_rivalry_block = data_rivalry['trial_nr'].unique()
-        switch_times = [] 
-
-        for rivalry_block in unique_rivalry_block:
-            block = data_rivalry.loc[data_rivalry['trial_nr'] == rivalry_block]
-            for i in range(len(block['onset'])-1):
-                # start with the second onset (which is the first button press/first switch)
-                current_onset = block['onset'].iloc[i+1]
-                previous_onset = block['onset'].iloc[i]
-                
-                # take the previous onset and compare it to the current to get the time between perception switch 
-                switch_times.append(current_onset - previous_onset)
-                
-        # Calculate mean and stdv 
-        self.switch_times_mean = np.array(switch_times).mean()
-        self.switch_times_std = np.array(switch_times).std()
+        exclude = self.settings['Task settings']['Exclude first and last percept']
+        switch_times = calc_switch_times(self.global_log, exclude_first=exclude, exclude_last=exclude)
+
+        # Calculate mean and stdv (and median and gamma fit)
+        self.percept_stats = percept_duration_stats(switch_times)
+        self.switch_times_mean = self.percept_stats['mean']
+        self.switch_times_std = self.percept_stats['std']
         
 
+    def last_onset(self):
+        """ Onset of the last logged event (phase onset or response). """
+        # the last response is the last event if no phase started after it was logged
+        if self.response_log.last('log_position') == len(self.global_log):
+            return self.response_log.last('onset')
+        return self.global_log['onset'].iloc[-1]
+
+    def release_keys(self):
+        """
+        Fills in the key_duration of the responses that were logged at key-down (Response capture: 'press')
+        once their keys are released. Called in every frame, it only looks at the keys that are held.
+        """
+        held_keys = []
+        for key, idx in self.held_keys:
+            if key.duration is None:
+                held_keys.append((key, idx))
+                continue
+            self.response_log.set(idx, 'key_duration', key.duration)
+            self.journal.write('release', onset=key.rt, response=key.name, key_duration=key.duration)
+            if self.eyetracker_on:
+                self.tracker.sendMessage(f'release_key-{key.name}_time-{key.rt}_duration-{key.duration}')
+        self.held_keys = held_keys
+
+    def merge_response_log(self):
+        """ Merges the buffered responses into the global log (which is written to the events.tsv). """
+        # keys that are still held keep an empty key_duration
+        self.release_keys()
+        self.held_keys = []
+        self.global_log = merge_logs(self.global_log, self.response_log)
+        self.response_log.clear()
+
     def save_output(self):
         
+        self.merge_response_log()
         # calculate the mean duration of percepts in rivalry blocks
         self.calc_percept_durations()
         expected_responds = self.nr_unambiguous_trials - (self.n_blocks/2)
-        print('MEAN duration between switches:', self.switch_times_mean)
-        print('STD of duration between switches:', self.switch_times_std)
-        print(f"Correct responses (within {self.settings['Task settings']['Response interval']}s of physical stimulus change): {self.correct_responses}")
-        print("Expected responses:", expected_responds)
-        np.save(opj(self.output_dir, self.output_str+'_summary_response_data.npz'), {"Reponse hand" : self.response_hand,
-                                                                                     "Response button" : self.response_button,
-                                                                                     "Expected number of responses (unambiguous)": expected_responds,
-        														                     "Subject responses (unambiguous)": self.unambiguous_responses,
-                                                                                     "Subject responses (rivalry)" : self.rivalry_responses,
-        														                     f"Correct responses (within {self.settings['Task settings']['Response interval']}s of physical stimulus change)":self.correct_responses,
-                                                                                     "Average percept duration across all rivalry blocks" : self.switch_times_mean,
-                                                                                     "Standard deviation percept duration across all rivalry blocks" : self.switch_times_std})
-        
-        np.save(opj(self.output_dir, self.output_str+'_summary_response_data.npy'), {"Reponse hand" : self.response_hand,
-                                                                                     "Response button" : self.response_button,
-                                                                                     "Expected number of responses (unambiguous)": expected_responds,
-        														                     "Subject responses (unambiguous)": self.unambiguous_responses,
-                                                                                     "Subject responses (rivalry)" : self.rivalry_responses,
-        														                     f"Correct responses (within {self.settings['Task settings']['Response interval']}s of physical stimulus change)":self.correct_responses,
-                                                                                     "Average percept duration across all rivalry blocks" : self.switch_times_mean,
-                                                                                     "Standard deviation percept duration across all rivalry blocks" : self.switch_times_std})
-    
\ No newline at end of file
+        logger.info('MEAN duration between switches: %s', self.switch_times_mean)
+        logger.info('STD of duration between switches: %s', self.switch_times_std)
+        logger.info('MEDIAN duration between switches: %s', self.percept_stats['median'])
+        logger.info("gamma fit: shape %.3f, scale %.3f", self.percept_stats['gamma_shape'], self.percept_stats['gamma_scale'])
+        logger.info("Correct responses (within %ss of physical stimulus change): %d", self.settings['Task settings']['Response interval'], self.correct_responses)
+        logger.info("Expected responses: %s", expected_responds)
+        summary = response_summary(self.response_hand, self.response_button, expected_responds, self.unambiguous_responses,
+                                   self.rivalry_responses, self.correct_responses, self.settings['Task settings']['Response interval'],
+                                   self.switch_times_mean, self.switch_times_std)
+        np.save(opj(self.output_dir, self.output_str+'_summary_response_data.npy'), summary)
+        if self.columnar_output:
+            write_summary(summary, summary_path(self.output_dir, self.output_str))
+        if self.replay:
+            logger.info("Replay responses: %d, correct: %d", self.replay_responses, self.correct_replay_responses)
+
+        if self.profiler is not None:
+            frame_report = self.profiler.report()
+            logger.info(frame_report)
+            with open(opj(self.output_dir, self.output_str+'_frame_report.txt'), 'w') as f:
+                f.write(frame_report)
+    
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+'''
+@time    :   2022/04/28 10:12:36
+@author  :   rosagross
+@contact :   grossmann.rc@gmail.com
+
+
+Console and log file output of the session. The session and its trials only put their log records into a queue,
+a background thread formats them and writes them to the console and to <output_str>_log.txt,
+so printing never blocks the frame loop. The 'Log level' setting decides what is written ('DEBUG' adds
+every key press with its timing, records below the level are dropped before they reach the queue).
+'''
+
+import logging
+import logging.handlers
+import queue
+import sys
+
+logger = logging.getLogger('binocular_rivalry')
+logger.propagate = False
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """ Puts the records into the queue as they are, the message is only formatted in the listener's thread. """
+
+    def prepare(self, record):
+        return record
+
+
+def start_logging(path, level='INFO'):
+    """
+    Starts writing the session's log records to the console and to a log file (from a background thread).
+    The output of an earlier session in the same process is stopped.
+
+    Parameters
+    ----------
+    path : str
+        Path of the log file
+    level : str
+        Lowest level that is written ('DEBUG', 'INFO', 'WARNING', ...)
+    """
+    stop_logging()
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(logging.Formatter('%(message)s'))
+    log_file = logging.FileHandler(path)
+    log_file.setFormatter(logging.Formatter('%(asctime)s.%(msecs)03d %(levelname)-7s %(message)s', datefmt='%H:%M:%S'))
+
+    records = queue.SimpleQueue()
+    handler = DeferredQueueHandler(records)
+    handler.listener = logging.handlers.QueueListener(records, console, log_file)
+    handler.listener.start()
+    logger.addHandler(handler)
+    logger.setLevel(level)
+
+
+def stop_logging():
+    """ Writes the records that are still in the queue and stops the background thread. """
+    for handler in list(logger.handlers):
+        if isinstance(handler, DeferredQueueHandler):
+            handler.listener.stop()
+            for listener_handler in handler.listener.handlers:
+                listener_handler.close()
+            logger.removeHandler(handler)
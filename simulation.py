@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+'''
+@time    :   2022/04/06 11:08:37
+@author  :   rosagross
+@contact :   grossmann.rc@gmail.com
+
+
+Runs a whole session without a screen, keyboard or eyetracker. The window only advances a simulated clock
+by one frame per flip and a synthetic observer presses the keys, so a session runs much faster than real time
+and writes the same events.tsv and response summary as a real session.
+'''
+
+import argparse
+import numpy as np
+import os
+import pandas as pd
+import random
+import re
+import time
+import yaml
+from events import write_events_tsv
+from session import BinocularRivalrySession
+from session_log import stop_logging
+from timeline import TRANSITIONS
+from tracker import FileTracker, TrackerQueue
+
+opj = os.path.join
+
+
+class HeadlessWindow:
+    """ Stand-in for the psychopy window, every flip advances the simulated time by one frame. """
+
+    def __init__(self, frame_duration):
+        self.frame_duration = frame_duration
+        self.time = 0.0
+        self.nr_flips = 0
+        self.nr_draws = 0
+        self.recordFrameIntervals = False
+        self._on_flip = []
+
+    def callOnFlip(self, function, *args, **kwargs):
+        self._on_flip.append((function, args, kwargs))
+
+    def flip(self):
+        self.time += self.frame_duration
+        self.nr_flips += 1
+        # like psychopy, the functions are called right after the flip
+        on_flip, self._on_flip = self._on_flip, []
+        for function, args, kwargs in on_flip:
+            function(*args, **kwargs)
+        return self.time
+
+    def saveMovieFrames(self, *args, **kwargs):
+        pass
+
+    def close(self):
+        pass
+
+
+class SimulatedClock:
+    """ Clock (and countdown timer) that runs on the simulated time of a HeadlessWindow. """
+
+    def __init__(self, win):
+        self.win = win
+        self._start = win.time
+
+    def getTime(self):
+        return self.win.time - self._start
+
+    def reset(self, newT=0.0):
+        self._start = self.win.time - newT
+
+    def addTime(self, t):
+        self._start -= t
+
+
+class HeadlessStim:
+    """ Stand-in for ImageStim and TextStim, keeps the attributes that are set and counts the draws. """
+
+    def __init__(self, win, image=None, text=None, opacity=1, **kwargs):
+        self.win = win
+        self.image = image
+        self.text = text
+        self.opacity = opacity
+
+    def draw(self):
+        self.win.nr_draws += 1
+
+
+class SimulatedKey:
+    """ Key press with the attributes of psychopy's KeyPress, the duration is None while the key is held. """
+
+    def __init__(self, name, tDown, rt, duration):
+        self.name = name
+        self.tDown = tDown
+        self.rt = rt
+        self.duration = duration
+
+    def __eq__(self, other):
+        # psychopy compares key presses with strings by their name
+        if isinstance(other, str):
+            return self.name == other
+        return self is other
+
+    __hash__ = object.__hash__
+
+
+class SyntheticObserver:
+    """
+    Stand-in for the keyboard that responds like a participant.
+    In rivalry blocks the percept switches after gamma distributed dominance durations, in unambiguous blocks
+    the observer reports every new percept after a gamma distributed reaction time. Breaks are ended with
+    the first break button after break_rest s. The upper response key is used for the house if the
+    session's response_button is 'upper_house', otherwise for the face.
+    """
+
+    def __init__(self, session, response_keys=None, dominance_shape=3.5, dominance_scale=0.7,
+                 reaction_shape=8, reaction_scale=0.06, key_duration=(0.08, 0.2), break_rest=2.0, seed=None):
+        """
+        Parameters
+        ----------
+        session : BinocularRivalrySession
+            Session that is observed (the observer looks at its current trial in every frame)
+        response_keys : tuple
+            Names of the upper and lower response button (default: the 'Response keys' of the session's settings)
+        dominance_shape, dominance_scale : float
+            Gamma distribution of the percept durations in rivalry blocks (s)
+        reaction_shape, reaction_scale : float
+            Gamma distribution of the reaction times (s)
+        key_duration : tuple
+            Range of the (uniform) time in s a key is held down
+        break_rest : float
+            Time in s until the observer ends a break
+        seed : int
+            Seed of the observer's random number generator
+        """
+        self.session = session
+        self.clock = SimulatedClock(session.win)
+        self.response_keys = tuple(session.settings['Task settings']['Response keys']) if response_keys is None else response_keys
+        self.dominance_shape = dominance_shape
+        self.dominance_scale = dominance_scale
+        self.reaction_shape = reaction_shape
+        self.reaction_scale = reaction_scale
+        self.key_duration = key_duration
+        self.break_rest = break_rest
+        self.rng = np.random.default_rng(seed)
+
+        self._trial = None
+        self._percept = None
+        self._next_switch = None
+        self._pressed = []
+        self._held = []
+
+    def _key(self, percept):
+        upper = 'house' if self.session.response_button == 'upper_house' else 'face'
+        return self.response_keys[0] if percept == upper else self.response_keys[1]
+
+    def _reaction_time(self):
+        return self.rng.gamma(self.reaction_shape, self.reaction_scale)
+
+    def _press(self, name, t):
+        # t is the time of the key press on the keyboard clock
+        duration = self.rng.uniform(*self.key_duration)
+        tDown = t + (self.session.win.time - self.clock.getTime())
+        self._pressed.append((SimulatedKey(name, tDown, t, None), duration))
+
+    def _start_trial(self, trial, now):
+        self._trial = trial
+        self._next_switch = None
+        if trial.block_type == 'break':
+            self._percept = None
+            if trial.phase_durations[0] > 0:
+                self._press(self.session.break_buttons[0], now + self.break_rest)
+        elif trial.block_type == 'rivalry':
+            # the first percept is reported after the reaction time, then it switches until the block ends
+            self._percept = ['house', 'face'][self.rng.integers(2)]
+            self._press(self._key(self._percept), now + self._reaction_time())
+            self._next_switch = now + self.rng.gamma(self.dominance_shape, self.dominance_scale)
+        elif trial.color_comb not in TRANSITIONS:
+            # the first percept of a block is not reported, only the switches
+            if (self._percept is not None) and (trial.trial_type != self._percept):
+                self._press(self._key(trial.trial_type), now + self._reaction_time())
+            self._percept = trial.trial_type
+
+    def getKeys(self, waitRelease=True, **kwargs):
+        """ Returns the keys that were released since the last call (or pressed, if waitRelease is False). """
+        now = self.clock.getTime()
+        trial = self.session.current_trial
+        if (trial is not None) and (trial is not self._trial):
+            self._start_trial(trial, now)
+
+        while (self._next_switch is not None) and (self._next_switch <= now):
+            self._percept = 'house' if self._percept == 'face' else 'face'
+            self._press(self._key(self._percept), self._next_switch + self._reaction_time())
+            self._next_switch += self.rng.gamma(self.dominance_shape, self.dominance_scale)
+
+        # keys that were returned at key-down get their duration when they are released
+        for key, duration in self._held:
+            if key.rt + duration <= now:
+                key.duration = duration
+        self._held = [(key, duration) for key, duration in self._held if key.duration is None]
+
+        keys = []
+        pressed = []
+        for key, duration in sorted(self._pressed, key=lambda pressed: pressed[0].rt):
+            if key.rt + duration <= now:
+                key.duration = duration
+                keys.append(key)
+            elif (not waitRelease) and (key.rt <= now):
+                keys.append(key)
+                self._held.append((key, duration))
+            else:
+                pressed.append((key, duration))
+        self._pressed = pressed
+        return keys
+
+
+class HeadlessSession(BinocularRivalrySession):
+    """
+    Binocular rivalry session without a window, keyboard and eyetracker (replaced by the classes above and a
+    tracker.FileTracker).
+    The exptools2 session is not initialized, only the attributes that the session and its trials use are set.
+    """
+
+    def __init__(self, output_str, output_dir, settings_file, subject_ID, eyetracker_on=False, seed=None,
+                 settings=None, observer=None):
+        """
+        Parameters
+        ----------
+        output_str, output_dir, settings_file, subject_ID, eyetracker_on
+            See BinocularRivalrySession
+        seed : int
+            Seed of the timeline, the response buttons and the observer (default: not seeded)
+        settings : dict
+            Task settings that replace the ones in the settings file
+        observer : dict
+            Parameters of the SyntheticObserver
+        """
+        if seed is not None:
+            random.seed(seed)
+            np.random.seed(seed)
+
+        self.settings_file = settings_file
+        self.output_str = output_str
+        self.output_dir = output_dir
+        with open(settings_file) as f:
+            self.settings = yaml.safe_load(f)
+        self.settings['Task settings'].update(settings or {})
+        os.makedirs(output_dir, exist_ok=True)
+        with open(opj(output_dir, output_str+'_expsettings.yml'), 'w') as f:
+            yaml.dump(self.settings, f)
+
+        self.win = HeadlessWindow(1/self.settings['Task settings']['Monitor framerate'])
+        self.frame_duration = self.win.frame_duration
+        self.clock = SimulatedClock(self.win)
+        self.timer = SimulatedClock(self.win)
+        self.exp_start = None
+        self.exp_stop = None
+        self.current_trial = None
+        self.global_log = pd.DataFrame(columns=['trial_nr', 'onset', 'event_type', 'phase', 'response', 'nr_frames'])
+        self.nr_frames = 0
+        self.first_trial = True
+        self.closed = False
+        self.eyetracker_on = eyetracker_on
+        # the messages are written to a file instead
+        self.tracker = FileTracker(opj(output_dir, output_str+'_tracker.asc'), self.clock.getTime) if eyetracker_on else None
+
+        self.kb = SyntheticObserver(self, seed=seed, **(observer or {}))
+        self.schedule_seed = seed
+        self.setup_task(subject_ID)
+
+    def create_image(self, image, **kwargs):
+        return HeadlessStim(self.win, image=image, **kwargs)
+
+    def create_text(self, text, **kwargs):
+        return HeadlessStim(self.win, text=text, **kwargs)
+
+    def display_text(self, text, keys=None, **kwargs):
+        # nobody reads the instructions
+        pass
+
+    def create_tracker_queue(self):
+        # the message offsets are measured on the simulated clock
+        return TrackerQueue(self.tracker, self.clock.getTime)
+
+    def calibrate_eyetracker(self):
+        self.tracker.doTrackerSetup()
+
+    def start_recording_eyetracker(self):
+        self.tracker.startRecording(1, 1, 1, 1)
+
+    def start_experiment(self, *args, **kwargs):
+        self.exp_start = self.clock.getTime()
+        self.clock.reset()
+        self.timer.reset()
+
+    def close(self):
+        """ Writes the events.tsv (like exptools2 does) and closes the journal. """
+        if self.closed:
+            return
+        self.win.flip()
+        self.exp_stop = self.clock.getTime()
+        if self.eyetracker_on:
+            self.tracker.stopRecording()
+        self.stop_tracker_queue()
+        write_events_tsv(self.global_log, opj(self.output_dir, self.output_str+'_events.tsv'),
+                         self.exp_start, self.exp_stop, self.nr_frames)
+        self.closed = True
+        self.write_columnar_events()
+        self.close_journal()
+        self.close_monitor()
+        stop_logging()
+
+
+def simulate_session(output_str, output_dir, settings_file='./settings.yml', subject_ID=1, **kwargs):
+    """
+    Runs a headless session and returns it (with its window, tracker and observer) after it is closed.
+    The keyword arguments are passed on to HeadlessSession.
+    """
+    session = HeadlessSession(output_str, output_dir, settings_file, subject_ID, **kwargs)
+    wall_start = time.perf_counter()
+    session.run()
+    wall_time = time.perf_counter() - wall_start
+    print(f"simulated {session.exp_stop:.1f}s ({session.win.nr_flips} frames) in {wall_time:.1f}s "
+          f"({session.exp_stop/wall_time:.1f}x real time)")
+    return session
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a session without screen, keyboard and eyetracker, with a synthetic observer.')
+    parser.add_argument('subject', help='e.g. sub-001')
+    parser.add_argument('session', help='e.g. ses-1')
+    parser.add_argument('--settings', default='./settings.yml', help='settings file')
+    parser.add_argument('--output-dir', help='default: ./output_data/<subject>_<session>_Logs_binocular_rivalry_simulated')
+    parser.add_argument('--seed', type=int, help='seed of the timeline and the observer')
+    parser.add_argument('--eyetracker', action='store_true', help='write the eyetracker messages to <output_str>_tracker.asc')
+    parser.add_argument('--fading-mode', choices=['stack', 'procedural'], help="replaces the 'Fading mode' setting")
+    parser.add_argument('--break-duration', type=float, help="replaces the 'Break duration' setting (s)")
+    parser.add_argument('--response-capture', choices=['release', 'press'], help="replaces the 'Response capture' setting")
+    args = parser.parse_args()
+
+    output_str = args.subject + '_' + args.session
+    output_dir = args.output_dir or './output_data/'+output_str+'_Logs_binocular_rivalry_simulated'
+    settings = {}
+    if args.fading_mode is not None:
+        settings['Fading mode'] = args.fading_mode
+    if args.break_duration is not None:
+        settings['Break duration'] = args.break_duration
+    if args.response_capture is not None:
+        settings['Response capture'] = args.response_capture
+    subject_ID = int(re.findall(r'(?<=-)\d+', args.subject)[0])
+    simulate_session(output_str, output_dir, args.settings, subject_ID, eyetracker_on=args.eyetracker,
+                     seed=args.seed, settings=settings)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,3 +6,184 @@
 @contact :   grossmann.rc@gmail.com
 '''
 
+import numpy as np
+import os
+from PIL import Image
+from session_log import logger
+
+opj = os.path.join
+
+
+def alpha_ramp(nr_fading_stimuli):
+    """
+    Returns the alpha values (0-1) of the source and destination image for every fading step,
+    the same values generate_fading_stimuli.ipynb uses (1..255 and 255..1 for 255 fading stimuli).
+    """
+    steps = np.arange(nr_fading_stimuli)
+    src_alpha = (steps + 1) / nr_fading_stimuli
+    dst_alpha = (nr_fading_stimuli - steps) / nr_fading_stimuli
+    return src_alpha, dst_alpha
+
+
+def select_fading_steps(steps, step, count, reverse=False):
+    """
+    Returns every step-th entry of a fading sequence (images or alpha values) as a view.
+    If reverse is True the sequence starts at the last entry and runs backwards.
+    """
+    if reverse:
+        return steps[len(steps)-1::-step][:count]
+    return steps[0:count*step:step]
+
+
+class StaticStim:
+    """ Draws the same stimuli in every phase of a trial. """
+
+    def __init__(self, *stims):
+        self.stims = stims
+
+    def draw(self, phase):
+        for stim in self.stims:
+            stim.draw()
+
+
+class PhaseStim:
+    """ Draws different stimuli in every phase of a trial (one list of stimuli per phase). """
+
+    def __init__(self, *phase_stims):
+        self.phase_stims = phase_stims
+
+    def draw(self, phase):
+        for stim in self.phase_stims[phase]:
+            stim.draw()
+
+
+class FadingStack:
+    """
+    All frames of one fading transition (e.g. 'hb2fr') stored as a single contiguous
+    (nr_frames, height, width, channels) uint8 array in <transition>_<pair>.npy.
+    The stack is memory-mapped on first use, so only the frames the transitions use are read from disk
+    (when the session creates their textures at startup, see FadingStim).
+    If the .npy file does not exist yet, or a fading image is newer than it, it is packed from the <transition>_<pair>_<i>.bmp files.
+    """
+
+    def __init__(self, fading_dir, pair, nr_frames, transition='fading'):
+        """
+        Parameters
+        ----------
+        fading_dir : str
+            Directory with the fading images (e.g. './stimuli/fading/')
+        pair : str
+            Name of the transition, either 'hb2fr' or 'hr2fb'
+        nr_frames : int
+            Number of fading images of this transition
+        transition : str
+            Type of the transition images, 'fading' (contrast fading) or 'wave' (travelling wave)
+        """
+        self.fading_dir = fading_dir
+        self.pair = pair
+        self.nr_frames = nr_frames
+        self.transition = transition
+        self.path = opj(fading_dir, f'{transition}_{pair}.npy')
+        self._frames = None
+
+    @property
+    def frames(self):
+        if self._frames is None:
+            if (not os.path.exists(self.path)) or self.outdated():
+                self.pack()
+            self._frames = np.load(self.path, mmap_mode='r')
+            if self._frames.shape[0] < self.nr_frames:
+                raise ValueError(f"{self.path} holds {self._frames.shape[0]} frames, but {self.nr_frames} fading stimuli are requested")
+        return self._frames
+
+    def image_path(self, i):
+        return opj(self.fading_dir, f'{self.transition}_{self.pair}_{i}.bmp')
+
+    def outdated(self):
+        """ True if a fading image was changed after the stack was packed (e.g. the images were generated again). """
+        stack_mtime = os.path.getmtime(self.path)
+        for i in range(self.nr_frames):
+            if os.path.exists(self.image_path(i)) and (os.path.getmtime(self.image_path(i)) > stack_mtime):
+                return True
+        return False
+
+    def pack(self):
+        """
+        Packs the single fading images into one .npy stack (only has to be done once).
+        The stack is written to a temporary file that replaces the .npy file when it is complete, so an interrupted
+        packing doesn't leave a partly filled stack that is newer than the images.
+        """
+        logger.info("packing %d %s images into %s", self.nr_frames, self.transition, self.path)
+        first_frame = np.asarray(Image.open(self.image_path(0)))
+        tmp_path = self.path[:-len('.npy')] + f'.{os.getpid()}.tmp.npy'
+        stack = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8, shape=(self.nr_frames,) + first_frame.shape)
+        try:
+            for i in range(self.nr_frames):
+                stack[i] = np.asarray(Image.open(self.image_path(i)))
+            stack.flush()
+        finally:
+            del stack
+        os.replace(tmp_path, self.path)
+
+    def sequence(self, step, count, reverse=False):
+        """ Returns every step-th frame as a view into the stack (no copy). """
+        return select_fading_steps(self.frames[:self.nr_frames], step, count, reverse)
+
+
+class FadingStim:
+    """
+    Draws a fading transition: one ImageStim per frame of the sequence, so every texture is uploaded once
+    when the session starts (like the single fading images before) and a phase change only draws another stim.
+    The textures are not created on the first draw, uploading one in the middle of a transition can take longer than a frame.
+    """
+
+    def __init__(self, image_stims):
+        """
+        Parameters
+        ----------
+        image_stims : list
+            psychopy.visual.ImageStim of every phase of the transition
+        """
+        self.image_stims = image_stims
+
+    def __len__(self):
+        return len(self.image_stims)
+
+    def __getitem__(self, index):
+        return self.image_stims[index]
+
+    def draw(self, index):
+        self.image_stims[index].draw()
+
+
+class CrossFadeStim:
+    """
+    Draws a fading transition without pre-rendered images: the destination image is drawn first
+    and the source image on top with the opacity of the current fading step.
+    This gives the same pixels as the (normalized) alpha composite in the fading images.
+    """
+
+    def __init__(self, src_stim, dst_stim, src_alpha, dst_alpha):
+        """
+        Parameters
+        ----------
+        src_stim, dst_stim : psychopy.visual.ImageStim
+            Base images (e.g. face_red and house_blue for 'hb2fr'), the transition in the other direction draws the same stims
+        src_alpha, dst_alpha : numpy.ndarray
+            Alpha values (0-1) of the source and destination image for every phase of the transition
+        """
+        self.src_stim = src_stim
+        self.dst_stim = dst_stim
+        # the fading images store (src*src_a + dst*dst_a*(1-src_a)) / out_a,
+        # which is src drawn over an opaque dst with an opacity of src_a/out_a
+        self.src_opacity = src_alpha / (src_alpha + dst_alpha*(1-src_alpha))
+
+    def __len__(self):
+        return len(self.src_opacity)
+
+    def draw(self, index):
+        # the opacity is compared with the stim's own value, another transition may have changed it since the last draw
+        if self.src_stim.opacity != self.src_opacity[index]:
+            self.src_stim.opacity = self.src_opacity[index]
+        self.dst_stim.draw()
+        self.src_stim.draw()
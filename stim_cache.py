@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+'''
+@time    :   2022/04/27 16:22:05
+@author  :   rosagross
+@contact :   grossmann.rc@gmail.com
+
+
+Disk cache of the decoded stimulus images, so a session does not decode every image again when it starts.
+Every image is decoded once into the values psychopy makes of it (same pixels, not resized, the screen scales
+the texture like it does for the image file) and saved as .npy file in the 'Stimulus cache' directory.
+The session memory-maps these files and creates the ImageStims from them.
+
+The cache can be filled before the session (e.g. after changing the stimuli):
+
+    python stim_cache.py --settings settings.yml
+'''
+
+import argparse
+import glob
+import json
+import numpy as np
+import os
+import yaml
+from PIL import Image
+from file_utils import files_hash, files_mtime
+from stim import FadingStack
+
+opj = os.path.join
+
+
+def find_image(path):
+    """ Returns the path of an image, the stimuli are saved with upper case extensions (.BMP) on windows. """
+    if not os.path.exists(path):
+        root, ext = os.path.splitext(path)
+        if os.path.exists(root + ext.upper()):
+            return root + ext.upper()
+    return path
+
+
+def decode_image(path):
+    """
+    Decodes an image into the values an ImageStim uses for a numpy array: float32 rgb values between -1 and 1,
+    with the first row at the bottom of the image (like psychopy flips an image file). The pixels are not resampled,
+    so the texture holds the same values as the one psychopy makes from the image file.
+    """
+    image = Image.open(path).convert('RGB')
+    return np.flipud(np.asarray(image, dtype=np.float32) / 127.5 - 1)
+
+
+class StimulusCache:
+    """
+    Cache of the decoded images, keyed by the content hash of the image file. An image that changed is decoded again.
+    The hash of a file is only computed again if its modification time or size changed.
+    """
+
+    def __init__(self, cache_dir):
+        """
+        Parameters
+        ----------
+        cache_dir : str
+            Directory of the decoded images
+        """
+        self.cache_dir = cache_dir
+        self.index_path = opj(cache_dir, 'index.json')
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+        self.nr_decoded = 0
+
+    def file_hash(self, path):
+        """ Content hash of an image file, it is only computed again if the file changed. """
+        entry = self.index.setdefault(path, {'mtime': None, 'hash': None})
+        mtime = files_mtime([path])
+        if entry['mtime'] != mtime:
+            old_hash = entry['hash']
+            entry['mtime'], entry['hash'] = mtime, files_hash([path])
+            if (old_hash is not None) and (old_hash != entry['hash']):
+                # the decoded old image is not used anymore
+                for old_path in glob.glob(opj(self.cache_dir, f'{self._name(path)}_{old_hash[:16]}.npy')):
+                    os.remove(old_path)
+            self.save_index()
+        return entry['hash']
+
+    def _name(self, path):
+        return os.path.splitext(os.path.basename(path))[0]
+
+    def load(self, path):
+        """ Returns the decoded image (memory-mapped) of the image at path, decodes it first if it is not in the cache. """
+        path = find_image(path)
+        cache_path = opj(self.cache_dir, f'{self._name(path)}_{self.file_hash(path)[:16]}.npy')
+        if not os.path.exists(cache_path):
+            # written to a temporary file first, so a session that is started at the same time never reads half a file
+            tmp_path = cache_path[:-len('.npy')] + f'.{os.getpid()}.tmp.npy'
+            np.save(tmp_path, decode_image(path))
+            os.replace(tmp_path, cache_path)
+            self.nr_decoded += 1
+        return np.load(cache_path, mmap_mode='r')
+
+    def save_index(self):
+        with open(self.index_path, 'w') as f:
+            json.dump(self.index, f, indent=4)
+
+    def warm(self, paths):
+        """ Decodes the images and every image in the index, if they are not in the cache yet or changed. """
+        for path in paths:
+            self.load(path)
+        for path in list(self.index):
+            if os.path.exists(path):
+                self.load(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Decode the stimulus images into the stimulus cache before a session.')
+    parser.add_argument('--settings', default='./settings.yml', help='settings file')
+    args = parser.parse_args()
+
+    with open(args.settings) as f:
+        settings = yaml.safe_load(f)
+    task_settings = settings['Task settings']
+    if task_settings['Stimulus cache'] is None:
+        raise SystemExit("'Stimulus cache' is not set in the settings")
+    cache = StimulusCache(task_settings['Stimulus cache'])
+    stim_path = task_settings['Stimulus path']
+    paths = sorted(path for path in glob.glob(opj(stim_path, '*')) if path.lower().endswith('.bmp'))
+    cache.warm(paths)
+    print(f"{len(cache.index)} images in {cache.cache_dir}, {cache.nr_decoded} decoded")
+
+    # the fading images are packed into their frame stacks as well
+    if (task_settings['Nr fading stimuli'] != 0) and (task_settings['Fading mode'] == 'stack'):
+        for pair in ('hb2fr', 'hr2fb'):
+            FadingStack(opj(stim_path, 'fading/'), pair, task_settings['Nr fading stimuli'], task_settings['Transition type']).frames
+
+
+if __name__ == '__main__':
+    main()
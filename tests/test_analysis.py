@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+from analysis import calc_switch_times
+
+
+def loop_switch_times(global_log, exclude_first=False, exclude_last=False):
+    # the loop of the old BinocularRivalrySession.calc_percept_durations (with the exclusions of the new one)
+    data_rivalry = global_log.loc[global_log['block_type'] == 'rivalry']
+    switch_times = []
+    for rivalry_block in data_rivalry['trial_nr'].unique():
+        block = data_rivalry.loc[data_rivalry['trial_nr'] == rivalry_block]
+        block_times = []
+        for i in range(len(block['onset'])-1):
+            block_times.append(block['onset'].iloc[i+1] - block['onset'].iloc[i])
+        switch_times += block_times[1 if exclude_first else 0:len(block_times) - (1 if exclude_last else 0)]
+    return np.array(switch_times)
+
+
+def random_log(seed):
+    """ A log of pairs of rivalry blocks with a random number of responses between unambiguous blocks and breaks. """
+    rng = np.random.default_rng(seed)
+    rows = []
+    onset = 0.0
+    for trial_nr in range(1, 13):
+        block_type = ['rivalry', 'rivalry', 'unambiguous', 'break'][trial_nr % 4]
+        for _ in range(rng.integers(1, 8)):
+            rows.append({'trial_nr': trial_nr, 'onset': onset, 'block_type': block_type})
+            onset += rng.uniform(0.2, 3.0)
+    global_log = pd.DataFrame(rows)
+    # responses collected at key release are logged after the next phase onset, here the last onset of every block
+    # is logged after the first onset of the next block
+    order = np.arange(len(global_log))
+    for i in np.flatnonzero(np.diff(global_log['trial_nr'])):
+        order[[i, i + 1]] = order[[i + 1, i]]
+    return global_log.iloc[order].reset_index(drop=True)
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('exclude_first, exclude_last', [(False, False), (True, False), (False, True), (True, True)])
+def test_switch_times_like_the_loop(seed, exclude_first, exclude_last):
+    global_log = random_log(seed)
+    assert np.allclose(calc_switch_times(global_log, exclude_first, exclude_last),
+                       loop_switch_times(global_log, exclude_first, exclude_last))
+
+
+def test_switch_times_without_rivalry():
+    global_log = pd.DataFrame({'trial_nr': [1, 1, 2], 'onset': [0.0, 1.0, 2.0], 'block_type': ['unambiguous']*2 + ['break']})
+    assert len(calc_switch_times(global_log)) == 0
+    # a block with a single onset has no switch times
+    global_log.loc[3] = {'trial_nr': 3, 'onset': 3.0, 'block_type': 'rivalry'}
+    assert len(calc_switch_times(global_log, exclude_first=True, exclude_last=True)) == 0
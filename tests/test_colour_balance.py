@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from conftest import ROOT
+from colour_balance import (BASE_IMAGES, RIVALRY_IMAGES, balance, balance_stimuli, channel_params, load_images,
+                            rivalry_image, stimulus_mask)
+
+STIM_PATH = f'{ROOT}/stimuli'
+
+
+@pytest.mark.parametrize('name', list(RIVALRY_IMAGES))
+def test_rivalry_image_like_the_shipped_images(name):
+    red, blue = RIVALRY_IMAGES[name]
+    shipped, red, blue = load_images(STIM_PATH, [name, red, blue])
+    assert np.array_equal(rivalry_image(red, blue), shipped)
+
+
+def test_balance_without_changes():
+    images = load_images(STIM_PATH, list(BASE_IMAGES))
+    gains, offsets = channel_params(list(BASE_IMAGES.values()))
+    assert np.array_equal(balance(images, stimulus_mask(images), gains, offsets), images)
+
+
+def test_balance_only_changes_the_stimulus_channels():
+    images = load_images(STIM_PATH, list(BASE_IMAGES))
+    mask = stimulus_mask(images)
+    gains, offsets = channel_params(list(BASE_IMAGES.values()), red_gain=1.5, blue_offset=10)
+    balanced = balance(images, mask, gains, offsets).astype(np.int16)
+    for i, colour in enumerate(BASE_IMAGES.values()):
+        changed = np.flatnonzero((balanced[i] != images[i]).any(axis=(0, 1)))
+        assert set(changed) <= ({0} if colour == 'red' else {1, 2})
+    # the background keeps its pixels
+    assert np.array_equal(balanced[~mask], images[~mask])
+
+
+def test_balanced_rivalry_images(tmp_path):
+    _, after, _ = balance_stimuli(STIM_PATH, str(tmp_path), blue_offset=5)
+    for name, (red, blue) in RIVALRY_IMAGES.items():
+        written, red, blue = load_images(str(tmp_path), [name, red, blue])
+        assert np.array_equal(written, rivalry_image(red, blue))
+    # the other stimuli are copied, so the output directory can be used as the stimulus path
+    assert np.array_equal(load_images(str(tmp_path), ['test']), load_images(STIM_PATH, ['test']))
+    assert set(after['image']) == set(BASE_IMAGES) | set(RIVALRY_IMAGES)
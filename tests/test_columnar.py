@@ -0,0 +1,32 @@
+import numpy as np
+from analysis import response_summary
+from columnar import SUMMARY_DTYPE, load_summary, summary_to_array, write_summary
+
+
+def test_summary_round_trip(tmp_path):
+    summary = response_summary('left', 'upper_face', 120.0, 107, 102, 105, [0.1, 1.5], 2.34, 1.18)
+    write_summary(summary, tmp_path / 'summary.npy')
+    assert load_summary(tmp_path / 'summary.npy') == {'response_hand': 'left', 'response_button': 'upper_face',
+                                                      'expected_responses': 120.0, 'unambiguous_responses': 107,
+                                                      'rivalry_responses': 102, 'correct_responses': 105,
+                                                      'response_interval_min': 0.1, 'response_interval_max': 1.5,
+                                                      'switch_times_mean': 2.34, 'switch_times_std': 1.18}
+
+
+def test_summary_of_older_sessions():
+    # older sessions have no response button and a typo in the key of the standard deviation
+    summary = {'Reponse hand': 'left', 'Expected number of responses (unambiguous)': 16.0,
+               'Subject responses (unambiguous)': 0, 'Subject responses (rivalry)': 3,
+               'Correct responses (within [0.1, 1.5]s of physical stimulus change)': 0,
+               'Average percept duration across all rivalry blocks': 0.75,
+               'Stadard deviation percept duration across all rivalry blocks': 0.5}
+    record = summary_to_array(summary)[0]
+    assert record['response_button'] == ''
+    assert record['switch_times_std'] == 0.5
+    assert (record['response_interval_min'], record['response_interval_max']) == (0.1, 1.5)
+
+
+def test_summary_missing_values():
+    record = summary_to_array({})[0]
+    assert record['response_hand'] == '' and record['correct_responses'] == -1
+    assert all(np.isnan(record[field]) for field in SUMMARY_DTYPE.names if SUMMARY_DTYPE[field].kind == 'f')
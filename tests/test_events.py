@@ -0,0 +1,138 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from events import EventBuffer, EventJournal, merge_logs, read_journal, recover_journal, write_events_tsv
+
+COLUMNS = ['trial_nr', 'onset', 'event_type', 'phase', 'response', 'nr_frames']
+# phase onsets and responses in the order they are logged, the response at 2.95s is only collected
+# (at key release) after the phase that started at 3.0s
+EVENTS = [('phase', {'trial_nr': 0, 'onset': 0.0, 'event_type': 'stim', 'phase': 0, 'nr_frames': 0}),
+          ('phase', {'trial_nr': 1, 'onset': 1.0, 'event_type': 'stim', 'phase': 0, 'nr_frames': 60}),
+          ('response', {'trial_nr': 1, 'onset': 1.5, 'event_type': 'house_face', 'phase': 0, 'response': '1', 'key_duration': 0.1}),
+          ('response', {'trial_nr': 1, 'onset': 2.2, 'event_type': 'house_face', 'phase': 0, 'response': '2', 'key_duration': 0.2}),
+          ('phase', {'trial_nr': 2, 'onset': 3.0, 'event_type': 'stim', 'phase': 0, 'nr_frames': 120}),
+          ('response', {'trial_nr': 2, 'onset': 2.95, 'event_type': 'house', 'phase': 0, 'response': '1', 'key_duration': 0.3}),
+          ('phase', {'trial_nr': 2, 'onset': 4.0, 'event_type': 'stim', 'phase': 1, 'nr_frames': 60}),
+          ('phase', {'trial_nr': 3, 'onset': 5.0, 'event_type': 'stim', 'phase': 0, 'nr_frames': 60}),
+          ('response', {'trial_nr': 3, 'onset': 5.5, 'event_type': 'face', 'phase': 0, 'response': '2', 'key_duration': 0.1})]
+
+
+def append_row(global_log, row):
+    # the way exptools2 and the old BRTrial.get_events appended a row to the global log
+    idx = global_log.shape[0]
+    for column, value in row.items():
+        global_log.loc[idx, column] = value
+
+
+def test_merge_logs_keeps_append_order():
+    old_log = pd.DataFrame(columns=COLUMNS)
+    for _, row in EVENTS:
+        append_row(old_log, row)
+
+    global_log = pd.DataFrame(columns=COLUMNS)
+    buffer = EventBuffer({'onset': float, 'log_position': int})
+    for kind, row in EVENTS:
+        if kind == 'phase':
+            append_row(global_log, row)
+        else:
+            idx = buffer.append(row)
+            buffer.set(idx, 'log_position', len(global_log))
+    merged = merge_logs(global_log, buffer)
+
+    assert merged['onset'].tolist() == [row['onset'] for _, row in EVENTS]
+    pd.testing.assert_frame_equal(merged[old_log.columns].astype(object), old_log.astype(object), check_index_type=False)
+
+
+def test_merge_logs_empty_buffer():
+    global_log = pd.DataFrame({'onset': [0.0, 1.0]})
+    assert merge_logs(global_log, EventBuffer({'onset': float, 'log_position': int})) is global_log
+
+
+SESSION = {'output_str': 'sub-001_ses-1', 'subject_ID': 1, 'response_hand': 'preferred', 'response_button': 'upper_face',
+           'n_blocks': 2, 'nr_unambiguous_trials': 3, 'response_interval': [0.1, 1.5]}
+BLOCK_TYPES = {0: 'break', 1: 'rivalry', 2: 'unambiguous', 3: 'unambiguous', 4: 'replay'}
+# responses within the response interval
+CORRECT_ONSETS = {5.5, 6.3, 6.8}
+# a replay block after the session of EVENTS, its responses are checked like the unambiguous ones
+REPLAY_EVENTS = [('phase', {'trial_nr': 4, 'onset': 6.0, 'event_type': 'stim', 'phase': 0, 'nr_frames': 60}),
+                 ('response', {'trial_nr': 4, 'onset': 6.3, 'event_type': 'face', 'phase': 0, 'response': '2', 'key_duration': 0.1}),
+                 ('response', {'trial_nr': 4, 'onset': 6.8, 'event_type': 'house', 'phase': 0, 'response': '1', 'key_duration': 0.1})]
+
+
+def journal_events(path, events=EVENTS, stop=True, **session):
+    """ Journals a session with the events (like the session does), returns the global log the session would save. """
+    journal = EventJournal(str(path))
+    journal.write('session', **{**SESSION, **session})
+    journal.write('start', exp_start=100.0)
+    global_log = pd.DataFrame(columns=COLUMNS)
+    for kind, row in events:
+        # the trial's parameters hold the block type, responses are logged with 0 frames
+        row = {**row, 'block_type': BLOCK_TYPES[row['trial_nr']], **({'nr_frames': 0} if kind == 'response' else {})}
+        append_row(global_log, row)
+        journal.write(kind, **row, **({'correct': row['onset'] in CORRECT_ONSETS} if kind == 'response' else {}))
+    if stop:
+        journal.write('stop', exp_stop=7.0, nr_frames=90)
+    journal.close()
+    return global_log
+
+
+def test_recover_journal_round_trip(tmp_path):
+    global_log = journal_events(tmp_path / 'sub-001_ses-1_journal.jsonl')
+    write_events_tsv(global_log, tmp_path / 'saved_events.tsv', 100.0, 7.0, 90)
+    events_path, summary_path = recover_journal(str(tmp_path / 'sub-001_ses-1_journal.jsonl'))
+
+    saved = pd.read_csv(tmp_path / 'saved_events.tsv', sep='\t')
+    recovered = pd.read_csv(events_path, sep='\t')
+    pd.testing.assert_frame_equal(recovered[saved.columns], saved)
+
+    summary = np.load(summary_path, allow_pickle=True).item()
+    assert summary['Response button'] == 'upper_face'
+    assert summary['Subject responses (rivalry)'] == 2
+    assert summary['Subject responses (unambiguous)'] == 2
+    assert summary['Correct responses (within [0.1, 1.5]s of physical stimulus change)'] == 1
+    # the percept durations of the rivalry block: from its onset to the first response and between the two responses
+    assert np.isclose(summary['Average percept duration across all rivalry blocks'], np.mean([0.5, 0.7]))
+
+
+def test_recover_journal_with_replay(tmp_path):
+    global_log = journal_events(tmp_path / 'sub-001_ses-1_journal.jsonl', EVENTS + REPLAY_EVENTS)
+    write_events_tsv(global_log, tmp_path / 'saved_events.tsv', 100.0, 7.0, 90)
+    events_path, summary_path = recover_journal(str(tmp_path / 'sub-001_ses-1_journal.jsonl'))
+    saved = pd.read_csv(tmp_path / 'saved_events.tsv', sep='\t')
+    pd.testing.assert_frame_equal(pd.read_csv(events_path, sep='\t')[saved.columns], saved)
+
+    # the correct replay responses are not counted as correct unambiguous responses
+    summary = np.load(summary_path, allow_pickle=True).item()
+    assert summary['Subject responses (unambiguous)'] == 2
+    assert summary['Correct responses (within [0.1, 1.5]s of physical stimulus change)'] == 1
+
+
+def test_recover_journal_excludes_first_and_last_percept(tmp_path):
+    third = ('response', {'trial_nr': 1, 'onset': 2.9, 'event_type': 'house_face', 'phase': 0, 'response': '1', 'key_duration': 0.1})
+    journal_events(tmp_path / 'sub-001_ses-1_journal.jsonl', EVENTS[:4] + [third] + EVENTS[4:], exclude_first_last=True)
+    _, summary_path = recover_journal(str(tmp_path / 'sub-001_ses-1_journal.jsonl'))
+    # the rivalry block has the percept durations 0.5, 0.7 and 0.7, the first and the last one are left out
+    summary = np.load(summary_path, allow_pickle=True).item()
+    assert np.isclose(summary['Average percept duration across all rivalry blocks'], 0.7)
+
+
+def test_recover_journal_into_new_directory(tmp_path):
+    journal_events(tmp_path / 'sub-001_ses-1_journal.jsonl')
+    events_path, summary_path = recover_journal(str(tmp_path / 'sub-001_ses-1_journal.jsonl'), str(tmp_path / 'recovered'))
+    assert os.path.dirname(events_path) == os.path.dirname(summary_path) == str(tmp_path / 'recovered')
+    assert os.path.exists(events_path) and os.path.exists(summary_path)
+
+def test_recover_crashed_journal(tmp_path):
+    path = tmp_path / 'sub-001_ses-1_journal.jsonl'
+    journal_events(path, EVENTS[:5], stop=False)
+    # the line the crash cut off is skipped
+    with open(path, 'a') as f:
+        f.write(json.dumps({'type': 'phase', 'trial_nr': 2, 'onset': 4.0})[:20])
+    assert [record['type'] for record in read_journal(path)] == ['session', 'start'] + [kind for kind, _ in EVENTS[:5]]
+
+    events_path, _ = recover_journal(str(path))
+    recovered = pd.read_csv(events_path, sep='\t')
+    assert recovered['onset'].tolist() == [row['onset'] for _, row in EVENTS[:5]]
+    # without a stop record the session ends with the last event
+    assert recovered['duration'].iloc[-1] == 0
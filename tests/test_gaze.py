@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+import pytest
+from gaze import clock_sync, gaze_per_percept, percepts, read_messages
+
+# the tracker clock runs 0.4% faster than the session clock and started 50s earlier: tracker ms = 50000 + 1004*session s,
+# so all events fall on even ms
+SLOPE, INTERCEPT = 1.004, 50.0
+# two rivalry blocks between breaks (all breaks are trial 0), the responses start the percepts
+EVENTS = pd.DataFrame([(0, 0.0, 'stim', 0, None, 'break'),
+                       (1, 1.0, 'stim', 0, None, 'rivalry'),
+                       (1, 1.5, 'house_face', 0, '1', 'rivalry'),
+                       (1, 2.5, 'house_face', 0, '2', 'rivalry'),
+                       (0, 3.0, 'stim', 0, None, 'break'),
+                       (2, 4.0, 'stim', 0, None, 'rivalry'),
+                       (2, 4.5, 'house_face', 0, '1', 'rivalry'),
+                       (0, 5.0, 'stim', 0, None, 'break')],
+                      columns=['trial_nr', 'onset', 'event_type', 'phase', 'response', 'block_type'])
+# start and stop of the percepts in tracker ms
+PERCEPTS = [(51506, 52510), (52510, 53012), (54518, 55020)]
+BLINK = (52001, 52101)
+# a sample every 2ms, between the ms the events fall on
+SAMPLE_TIMES = np.arange(50001, 56000, 2)
+
+
+def tracker_ms(session_time):
+    return int(round((INTERCEPT + SLOPE*session_time) * 1000))
+
+
+def write_asc(path):
+    """
+    Writes an .asc file with a message for every event and the samples.
+    In percept k the gaze is at y = 100*(k+1) and moves to the right with increasing speed, outside the percepts
+    it rests at (500, 0). The first key press message was sent 3ms late (with its offset).
+    """
+    lines = []
+    for _, event in EVENTS.iterrows():
+        text = f"start_type-{event['event_type']}_trial-{event['trial_nr']}_phase-{event['phase']}"
+        if pd.isna(event['response']):
+            lines.append((tracker_ms(event['onset']), f"MSG\t{tracker_ms(event['onset'])} {text}"))
+        elif event['onset'] == 1.5:
+            lines.append((tracker_ms(1.5) + 3, f"MSG\t{tracker_ms(1.5) + 3} 3 {text}_key-1_time-1.5_duration-0.1"))
+        else:
+            lines.append((tracker_ms(event['onset']), f"MSG\t{tracker_ms(event['onset'])} {text}_key-{event['response']}_time-{event['onset']}_duration-0.1"))
+    for t in SAMPLE_TIMES:
+        x, y, pupil = 500.0, 0.0, 900.0
+        for k, (start, stop) in enumerate(PERCEPTS):
+            if start <= t < stop:
+                x, y, pupil = 500 + ((t - start) / 100)**2, 100.0*(k + 1), 1000.0 + k
+        if BLINK[0] <= t < BLINK[1]:
+            lines.append((t, f'{t}\t   .\t   .\t    0.0\t...'))
+        else:
+            lines.append((t, f'{t}\t{x:8.1f}\t{y:8.1f}\t{pupil:8.1f}\t...'))
+    lines = ['** CONVERTED FROM sub-001_ses-1.edf', 'START\t49990 \tLEFT\tSAMPLES\tEVENTS'] + [line for _, line in sorted(lines)] + ['END\t56000 \tSAMPLES\tEVENTS']
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return path
+
+
+def test_read_messages(tmp_path):
+    messages = read_messages(write_asc(tmp_path / 'sub-001_ses-1.asc'))
+    assert len(messages) == len(EVENTS)
+    # the offset is subtracted from the time of the message that was sent late
+    late = messages['text'].str.contains('_key-1_time-1.5_')
+    assert messages.loc[late, 'time'].tolist() == [tracker_ms(1.5)]
+    assert messages['time'].tolist() == [tracker_ms(onset) for onset in EVENTS['onset']]
+
+
+def test_clock_sync(tmp_path):
+    messages = read_messages(write_asc(tmp_path / 'sub-001_ses-1.asc'))
+    assert np.allclose(clock_sync(messages, EVENTS), [SLOPE, INTERCEPT])
+    # the three breaks have the same trial and phase, they are paired with their onsets in order
+    phases = messages[~messages['text'].str.contains('_key-')]
+    assert np.allclose(clock_sync(phases, EVENTS), [SLOPE, INTERCEPT])
+    with pytest.raises(ValueError):
+        clock_sync(messages.iloc[:1], EVENTS)
+
+
+def test_percepts():
+    table = percepts(EVENTS)
+    assert table['key'].tolist() == ['1', '2', '1']
+    assert table['percept'].tolist() == [0, 1, 0]
+    assert table['block_ID'].tolist() == [1, 1, 2]
+    # a percept lasts until the next key press or the end of its block
+    assert table[['start', 'stop']].values.tolist() == [[1.5, 2.5], [2.5, 3.0], [4.5, 5.0]]
+
+
+def test_gaze_per_percept(tmp_path):
+    table = gaze_per_percept(str(write_asc(tmp_path / 'sub-001_ses-1.asc')), EVENTS)
+    # every sample is assigned to the percept it was recorded in
+    assert table['nr_samples'].tolist() == [np.sum((SAMPLE_TIMES >= start) & (SAMPLE_TIMES < stop)) for start, stop in PERCEPTS]
+    assert np.allclose(table['y_mean'], [100, 200, 300]) and np.allclose(table['y_std'], 0, atol=1e-6)
+    assert np.allclose(table['pupil_mean'], [1000, 1001, 1002])
+    assert np.allclose(table['missing'], [50 / table['nr_samples'][0], 0, 0])
+    # the gaze speeds up during every percept (x = 500 + (t/100ms)^2)
+    assert np.all(table['velocity_x'] > 0) and np.allclose(table['velocity_x'], table['abs_velocity_x'])
+
+
+@pytest.mark.parametrize('chunk_size', [7, 100, 1001])
+def test_gaze_per_percept_in_chunks(tmp_path, chunk_size):
+    asc_path = str(write_asc(tmp_path / 'sub-001_ses-1.asc'))
+    # the velocity of the first sample of a chunk is computed with the last sample of the previous chunk
+    pd.testing.assert_frame_equal(gaze_per_percept(asc_path, EVENTS, chunk_size), gaze_per_percept(asc_path, EVENTS))
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from generate_fading_stimuli import WAVE_DIRECTIONS, van_der_corput, wave_transitions
+
+NR_STEPS = 24
+# the wave replaces the dst pixels (0) by the src pixels (255), the first two columns are the same in both images,
+# so they are outside the stimulus span
+SRC = np.full((30, 40, 3), 255, dtype=np.uint8)
+DST = np.zeros((30, 40, 3), dtype=np.uint8)
+DST[:, :2] = 255
+
+
+def replaced(frames):
+    """ Which pixels of every frame show src (inside the region where src and dst differ). """
+    return frames[:, :, 2:, 0] == 255
+
+
+@pytest.mark.parametrize('pattern', ['regular', 'random'])
+@pytest.mark.parametrize('direction', WAVE_DIRECTIONS)
+def test_wave_replaces_dst_by_src(direction, pattern):
+    frames = wave_transitions(SRC, DST, np.arange(NR_STEPS), NR_STEPS, wave_width=8, direction=direction, pattern=pattern)
+    assert frames.shape == (NR_STEPS,) + SRC.shape
+    fraction = replaced(frames).mean(axis=(1, 2))
+    assert np.all(np.diff(fraction) > 0)
+    # replaced pixels stay replaced, the last frame is the source image
+    assert np.all(replaced(frames)[1:] >= replaced(frames)[:-1])
+    assert np.array_equal(frames[-1], SRC)
+    # outside the region where the images differ src is used
+    assert np.all(frames[:, :, :2] == 255)
+
+
+@pytest.mark.parametrize('direction, axis, reverse', [('down', 0, False), ('up', 0, True), ('right', 1, False), ('left', 1, True)])
+def test_wave_direction(direction, axis, reverse):
+    frames = wave_transitions(SRC, DST, np.arange(NR_STEPS), NR_STEPS, wave_width=8, direction=direction)
+    # fraction of replaced pixels of every row (down, up) or column (right, left) in the order the wave passes them
+    profiles = replaced(frames).mean(axis=2 - axis)
+    if reverse:
+        profiles = profiles[:, ::-1]
+    # the rows/columns the wave reaches first are replaced first
+    assert np.all(np.diff(profiles, axis=1) <= 0)
+    middle = profiles[NR_STEPS // 2]
+    assert (middle[0] == 1) and (middle[-1] == 0)
+
+
+@pytest.mark.parametrize('pattern', ['regular', 'random'])
+def test_wave_is_reproducible(pattern):
+    frames = wave_transitions(SRC, DST, np.arange(NR_STEPS), NR_STEPS, pattern=pattern, seed=3)
+    assert np.array_equal(frames, wave_transitions(SRC, DST, np.arange(NR_STEPS), NR_STEPS, pattern=pattern, seed=3))
+    # the processes compute the steps in chunks, they have to give the same images
+    chunks = [wave_transitions(SRC, DST, np.arange(start, min(start + 5, NR_STEPS)), NR_STEPS, pattern=pattern, seed=3)
+              for start in range(0, NR_STEPS, 5)]
+    assert np.array_equal(np.concatenate(chunks), frames)
+    # only the random pattern depends on the seed
+    other = wave_transitions(SRC, DST, np.arange(NR_STEPS), NR_STEPS, pattern=pattern, seed=4)
+    assert np.array_equal(other, frames) == (pattern == 'regular')
+
+
+def test_van_der_corput():
+    assert np.array_equal(van_der_corput(8), [0, 0.5, 0.25, 0.75, 0.125, 0.625, 0.375, 0.875])
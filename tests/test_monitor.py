@@ -0,0 +1,40 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip('psychopy')
+pytest.importorskip('exptools2')
+
+from conftest import ROOT
+from monitor import MonitorListener
+from simulation import simulate_session
+
+
+def test_simulated_session_packets(tmp_path, monkeypatch):
+    monkeypatch.chdir(ROOT)
+    listener = MonitorListener(0)
+    settings = {'Blocks': 2, 'Stimulus duration rivalry': 6, 'Break duration': 1, 'Get ready duration': 1,
+                'Fading mode': 'procedural', 'Replay blocks': False, 'Stimulus cache': None,
+                'Live monitor port': listener.socket.getsockname()[1]}
+    try:
+        session = simulate_session('sub-001_ses-1', str(tmp_path), subject_ID=1, seed=1, settings=settings)
+        packets = []
+        while (packet := listener.receive(timeout=0.5)) is not None:
+            packets.append(packet)
+    finally:
+        listener.close()
+
+    # a phase packet at every phase onset and a response packet at every response, in the order they were logged
+    events = pd.read_csv(tmp_path / 'sub-001_ses-1_events.tsv', sep='\t', dtype={'response': str})
+    sent = [packet for packet in packets if packet['kind'] != 'status']
+    assert [packet['kind'] for packet in sent] == ['phase' if pd.isna(response) else 'response' for response in events['response']]
+    for packet, (_, event) in zip(sent, events.iterrows()):
+        assert (packet['trial_nr'], packet['phase'], packet['block_type']) == (event['trial_nr'], event['phase'], event['block_type'])
+        if packet['kind'] == 'response':
+            assert packet['key'] == event['response']
+            # the responses are only scored in the unambiguous blocks
+            assert (packet['correct'] is None) == (event['block_type'] == 'rivalry')
+
+    # the last packets hold the totals of the session
+    assert sent[-1]['responses'] == session.unambiguous_responses
+    assert sent[-1]['correct_responses'] == session.correct_responses
+    assert session.monitor.nr_failed == 0
@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+import yaml
+from conftest import ROOT
+from schedule import (RESPONSE_BUTTONS, check_schedule, load_schedule, make_cohort, make_schedule, save_schedule,
+                      schedule_blocks, session_schedule)
+
+
+@pytest.fixture
+def task_settings():
+    with open(f'{ROOT}/settings.yml') as f:
+        return yaml.safe_load(f)['Task settings']
+
+
+def assert_same_schedule(schedule, other):
+    assert schedule.keys() == other.keys()
+    for key, value in schedule.items():
+        assert np.array_equal(value, other[key]), key
+
+
+def test_same_seed_same_schedule(task_settings):
+    assert_same_schedule(make_schedule(3, task_settings, seed=1234), make_schedule(3, task_settings, seed=1234))
+
+
+def test_seed_and_subject_change_the_schedule(task_settings):
+    schedule = make_schedule(3, task_settings, seed=1234)
+    for other in (make_schedule(3, task_settings, seed=1235), make_schedule(5, task_settings, seed=1234)):
+        assert not np.array_equal(schedule['durations'], other['durations'])
+
+
+def test_random_seed_is_stored(task_settings):
+    schedule = make_schedule(1, task_settings)
+    assert_same_schedule(schedule, make_schedule(1, task_settings, seed=schedule['seed']))
+
+
+def test_percept_durations(task_settings):
+    schedule = make_schedule(1, task_settings, seed=7)
+    blocks = schedule_blocks(schedule)
+    assert len(blocks) == len(schedule['colors_unambiguous']) == len(schedule['block_sizes'])
+    for block in blocks:
+        assert block.sum() == schedule['block_frames']
+        assert block.min() >= max(schedule['min_frames'], schedule['transition_frames'] + 1)
+    assert schedule['response_button'] in RESPONSE_BUTTONS
+
+
+def test_response_button_is_balanced(task_settings):
+    buttons = [make_schedule(subject_ID, task_settings, seed=1)['response_button'] for subject_ID in range(1, 201)]
+    assert 60 < buttons.count('upper_house') < 140
+
+
+def test_predefined_durations(task_settings):
+    task_settings['Previous percept duration'] = [300, 300, 600]
+    task_settings['Stimulus duration rivalry'] = 40
+    schedule = make_schedule(2, task_settings, seed=3)
+    for block in schedule_blocks(schedule):
+        assert sorted(block) == [600, 600, 1200]
+    # a schedule drawn with other predefined durations doesn't match the settings
+    check_schedule(schedule, 2, task_settings)
+    with pytest.raises(ValueError, match='predefined_frames'):
+        check_schedule(schedule, 2, {**task_settings, 'Previous percept duration': [300, 450, 450]})
+
+
+def test_predefined_durations_too_short(task_settings):
+    # 10 frames are shorter than a transition
+    task_settings['Previous percept duration'] = [5, 295, 300, 600]
+    task_settings['Stimulus duration rivalry'] = 40
+    with pytest.raises(ValueError, match=r'\[10\]'):
+        make_schedule(2, task_settings, seed=3)
+
+
+def test_save_and_load(task_settings, tmp_path):
+    schedule = make_schedule(4, task_settings, seed=99)
+    save_schedule(schedule, tmp_path / 'schedule.npz')
+    loaded = load_schedule(tmp_path / 'schedule.npz')
+    assert_same_schedule(loaded, schedule)
+    assert isinstance(loaded['seed'], int) and isinstance(loaded['response_button'], str)
+    check_schedule(loaded, 4, task_settings)
+
+
+def test_check_schedule(task_settings):
+    schedule = make_schedule(4, task_settings, seed=99)
+    with pytest.raises(ValueError, match='subject_ID'):
+        check_schedule(schedule, 5, task_settings)
+    with pytest.raises(ValueError, match='block_frames'):
+        check_schedule(schedule, 4, {**task_settings, 'Stimulus duration rivalry': 30})
+    with pytest.raises(ValueError, match='predefined_frames'):
+        check_schedule(schedule, 4, {**task_settings, 'Previous percept duration': [300, 300, 600]})
+    del schedule['response_button']
+    with pytest.raises(ValueError, match='response_button'):
+        check_schedule(schedule, 4, task_settings)
+
+
+def test_session_schedule(task_settings, tmp_path):
+    # without a schedule dir the schedule is drawn with the seed, with it the cohort's schedule file is loaded
+    assert_same_schedule(session_schedule(2, task_settings, 11), make_schedule(2, task_settings, 11))
+    make_cohort([1, 2], task_settings, 11, str(tmp_path))
+    task_settings['Schedule dir'] = str(tmp_path)
+    assert_same_schedule(session_schedule(2, task_settings, 12), make_schedule(2, task_settings, 11))
+    with pytest.raises(FileNotFoundError):
+        session_schedule(3, task_settings)
@@ -0,0 +1,110 @@
+import numpy as np
+import os
+import pytest
+
+pytest.importorskip('psychopy')
+pytest.importorskip('exptools2')
+
+from session import BinocularRivalrySession
+from stim import CrossFadeStim
+from timeline import STIMULI, TIMELINE_DTYPE, transition_counts
+
+# what the draw_stimulus chain of string comparisons drew for every (trial_type, color_comb):
+# the session attribute of the stimulus, or the attributes drawn in every phase of the break
+EXPECTED = {('break', 'break'): [['fixation_screen', 'break_stim'], ['fixation_screen']],
+            ('house_face', 'rivalry_redface'): 'rivalry_redface',
+            ('house_face', 'rivalry_redhouse'): 'rivalry_redhouse',
+            ('face', 'redface'): 'face_red',
+            ('face', 'redhouse'): 'face_blue',
+            ('house', 'redface'): 'house_blue',
+            ('house', 'redhouse'): 'house_red',
+            ('face', 'fr2hb'): 'fading_redface_2_bluehouse',
+            ('face', 'fb2hr'): 'fading_blueface_2_redhouse',
+            ('house', 'hb2fr'): 'fading_bluehouse_2_redface',
+            ('house', 'hr2fb'): 'fading_redhouse_2_blueface',
+            ('face', 'replay'): 'replay_face',
+            ('house', 'replay'): 'replay_house',
+            # the replay images are cross-faded from the first to the second image
+            ('face', 'f2h'): ('replay_face', 'replay_house'),
+            ('house', 'h2f'): ('replay_house', 'replay_face')}
+
+
+class RecordedStim:
+    """ Stands in for an ImageStim or TextStim and records when it is drawn. """
+
+    def __init__(self, name, drawn):
+        self.name = name
+        self.drawn = drawn
+        self.opacity = 1.0
+
+    def draw(self):
+        self.drawn.append(self)
+
+
+def stimulus_session(nr_fading_stimuli=255, replay=True):
+    """ A session that only creates its stimuli (procedural fading, no window). """
+    task_settings = {'Monitor framerate': 60, 'Screentick conversion': 30, 'Nr fading stimuli': nr_fading_stimuli,
+                     'Transition length': 40}
+    counts = transition_counts(task_settings)
+    session = BinocularRivalrySession.__new__(BinocularRivalrySession)
+    session.drawn = []
+    session.path_to_stim = './stimuli/'
+    session.stim_size = 10
+    session.nr_fading_stimuli = nr_fading_stimuli
+    session.fading_mode = 'procedural'
+    session.transition_steps = counts['transition_steps']
+    session.nr_fading_phases = counts['fading_phases']
+    session.replay = replay
+    session.timeline = np.zeros(0, dtype=TIMELINE_DTYPE)
+    session.create_image = lambda image, **kwargs: RecordedStim(os.path.splitext(os.path.basename(image))[0], session.drawn)
+    session.create_text = lambda text, **kwargs: RecordedStim(text, session.drawn)
+    session.create_stimulus()
+    return session
+
+
+def drawn_in_phase(session, stimulus, phase):
+    del session.drawn[:]
+    stimulus.draw(phase)
+    return list(session.drawn)
+
+
+def test_table_covers_every_stimulus():
+    assert set(EXPECTED) == set(STIMULI)
+
+
+@pytest.mark.parametrize('trial_type, color_comb', list(EXPECTED))
+def test_resolve_stimulus(trial_type, color_comb):
+    session = stimulus_session()
+    expected = EXPECTED[(trial_type, color_comb)]
+    stimulus = session.resolve_stimulus(trial_type, color_comb)
+
+    if isinstance(expected, list):
+        for phase, names in enumerate(expected):
+            assert drawn_in_phase(session, stimulus, phase) == [getattr(session, name) for name in names]
+    elif isinstance(expected, tuple):
+        start, _ = expected
+        assert isinstance(stimulus, CrossFadeStim)
+        # the visible share of the start image falls from (almost) 1 to (almost) 0 (the last fading steps are skipped)
+        visible = {stimulus.src_stim.name: stimulus.src_opacity, stimulus.dst_stim.name: 1 - stimulus.src_opacity}[start]
+        assert (visible[0] > 0.9) and (visible[-1] < 0.1) and np.all(np.diff(visible) < 0)
+    elif expected.startswith('fading_'):
+        assert stimulus is getattr(session, expected)
+        assert len(stimulus) == session.nr_fading_phases
+    else:
+        for phase in range(2):
+            assert drawn_in_phase(session, stimulus, phase) == [getattr(session, expected)]
+
+
+@pytest.mark.parametrize('trial_type, color_comb', [('face', 'rivalry_redface'), ('house_face', 'redface'), ('break', 'replay'), ('face', 'blue')])
+def test_resolve_unknown_stimulus(trial_type, color_comb):
+    with pytest.raises(ValueError):
+        stimulus_session().resolve_stimulus(trial_type, color_comb)
+
+
+@pytest.mark.parametrize('trial_type, color_comb', [('face', 'fr2hb'), ('face', 'fb2hr'), ('house', 'hb2fr'), ('house', 'hr2fb'),
+                                                    ('face', 'replay'), ('house', 'replay'), ('face', 'f2h'), ('house', 'h2f')])
+def test_resolve_missing_stimulus(trial_type, color_comb):
+    # without fading and replay blocks the session has no transitions and replay images
+    session = stimulus_session(nr_fading_stimuli=0, replay=False)
+    with pytest.raises(ValueError):
+        session.resolve_stimulus(trial_type, color_comb)
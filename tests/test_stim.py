@@ -0,0 +1,98 @@
+import numpy as np
+import os
+import pytest
+from conftest import ROOT
+from PIL import Image
+from generate_fading_stimuli import FADING_PAIRS, alpha_composite_transitions, alpha_values, generate_fading_stimuli, load_rgba
+from stim import CrossFadeStim, FadingStack, alpha_ramp, select_fading_steps
+from stim_cache import find_image
+
+STIM_PATH = f'{ROOT}/stimuli'
+
+
+@pytest.mark.parametrize('src_name, dst_name', [('face_red', 'house_blue'), ('house_red', 'face_blue')])
+def test_cross_fade_matches_fading_images(src_name, dst_name):
+    src = load_rgba(find_image(f'{STIM_PATH}/{src_name}.bmp'))
+    dst = load_rgba(find_image(f'{STIM_PATH}/{dst_name}.bmp'))
+    nr_fading_stimuli = 255
+    steps = np.array([0, 1, 17, 64, 127, 128, 200, 253, 254])
+
+    # pre-rendered fading images
+    src_alpha, dst_alpha = alpha_values(nr_fading_stimuli)
+    fading_images = alpha_composite_transitions(src, dst, src_alpha[steps], dst_alpha[steps])[..., :3] / 255
+
+    # the procedural cross-fade draws dst opaque and src on top with the opacity of the step (GL blending)
+    cross_fade = CrossFadeStim(None, None, *[alpha[steps] for alpha in alpha_ramp(nr_fading_stimuli)])
+    opacity = cross_fade.src_opacity[:, None, None, None]
+    drawn = src[..., :3] / 255 * opacity + dst[..., :3] / 255 * (1 - opacity)
+
+    # the fading images are stored as uint8 with uint8 alpha values, so they differ by at most one step
+    assert np.abs(drawn - fading_images).max() <= 1/255 + 1e-9
+
+
+def test_generated_stack_is_up_to_date(tmp_path):
+    generate_fading_stimuli(STIM_PATH, 12, fading_dir=str(tmp_path), workers=2, chunk_size=4)
+    for pair in FADING_PAIRS:
+        stack = FadingStack(str(tmp_path), pair, 12)
+        assert not stack.outdated()
+        # the frames are used as they were generated, they are not packed again
+        assert np.array_equal(stack.frames[5], np.asarray(Image.open(stack.image_path(5)))[..., :3])
+
+
+def test_interrupted_packing_keeps_the_stack(tmp_path):
+    frames = np.random.default_rng(0).integers(0, 256, (4, 6, 5, 3), dtype=np.uint8)
+    stack = FadingStack(str(tmp_path), 'hb2fr', len(frames))
+    for i, frame in enumerate(frames):
+        Image.fromarray(frame).save(stack.image_path(i))
+    stack.pack()
+    assert np.array_equal(np.load(stack.path), frames)
+
+    # an image that can't be read stops the packing, the packed stack is left as it was
+    with open(stack.image_path(2), 'wb') as f:
+        f.write(b'BM')
+    with pytest.raises(OSError):
+        stack.pack()
+    assert np.array_equal(np.load(stack.path), frames)
+
+
+def test_failed_generation_is_not_up_to_date(tmp_path):
+    generate_fading_stimuli(STIM_PATH, 12, fading_dir=str(tmp_path), pairs=['hb2fr'], workers=2, chunk_size=4)
+    stack = FadingStack(str(tmp_path), 'hb2fr', 12)
+    frames = np.load(stack.path)
+
+    # an image that can't be written makes the run fail
+    os.remove(stack.image_path(5))
+    os.mkdir(stack.image_path(5))
+    with pytest.raises(OSError):
+        generate_fading_stimuli(STIM_PATH, 12, fading_dir=str(tmp_path), pairs=['hb2fr'], workers=2, chunk_size=4, force=True)
+    # the stack is left as it was (without temporary files), but the pair is generated again by the next run
+    assert np.array_equal(np.load(stack.path), frames)
+    assert set(os.listdir(tmp_path)) == {f'fading_hb2fr_{i}.bmp' for i in range(12)} | {'fading_hb2fr.npy'}
+    os.rmdir(stack.image_path(5))
+    assert generate_fading_stimuli(STIM_PATH, 12, fading_dir=str(tmp_path), pairs=['hb2fr'], workers=2, chunk_size=4) == ['hb2fr']
+    assert not stack.outdated()
+
+
+class OpacityStim:
+    """ Stands in for an ImageStim and records the opacity it is drawn with. """
+
+    def __init__(self, drawn):
+        self.opacity = 1.0
+        self.drawn = drawn
+
+    def draw(self):
+        self.drawn.append(self.opacity)
+
+
+@pytest.mark.parametrize('nr_phases', [1, 3])
+def test_cross_fades_share_their_stims(nr_phases):
+    drawn = []
+    src, dst = OpacityStim(drawn), OpacityStim([])
+    # the two directions of a transition draw the same base images (like create_stimulus makes them)
+    forwards = CrossFadeStim(src, dst, *[select_fading_steps(alpha, 12, nr_phases) for alpha in alpha_ramp(255)])
+    backwards = CrossFadeStim(src, dst, *[select_fading_steps(alpha, 12, nr_phases, reverse=True) for alpha in alpha_ramp(255)])
+    for cross_fade in [forwards, backwards, forwards, backwards]:
+        del drawn[:]
+        for phase in range(nr_phases):
+            cross_fade.draw(phase)
+        assert np.array_equal(drawn, cross_fade.src_opacity)
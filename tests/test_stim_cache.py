@@ -0,0 +1,31 @@
+import glob
+import os
+import numpy as np
+from PIL import Image
+from conftest import ROOT
+from stim_cache import StimulusCache, find_image
+
+
+def test_cached_images_keep_their_pixels(tmp_path):
+    cache = StimulusCache(str(tmp_path))
+    for path in [find_image(f'{ROOT}/stimuli/{name}.bmp') for name in ['house_red', 'face_blue', 'rivalry_redface', 'test']]:
+        # psychopy flips an image file and uploads its 8 bit values, the cached values have to give the same texture
+        pixels = np.flipud(np.asarray(Image.open(path).convert('RGB')))
+        cached = cache.load(path)
+        assert cached.dtype == np.float32
+        assert cached.shape == pixels.shape
+        assert np.array_equal(np.rint((cached + 1) * 127.5).astype(np.uint8), pixels)
+
+
+def test_changed_image_is_decoded_again(tmp_path):
+    path = str(tmp_path / 'image.bmp')
+    Image.fromarray(np.zeros((4, 6, 3), dtype=np.uint8)).save(path)
+    cache = StimulusCache(str(tmp_path / 'cache'))
+    assert np.all(cache.load(path) == -1)
+    Image.fromarray(np.full((4, 6, 3), 255, dtype=np.uint8)).save(path)
+    # the file has the same size, its modification time has to differ even on a coarse file system clock
+    os.utime(path, ns=(0, 0))
+    assert np.all(cache.load(path) == 1)
+    assert cache.nr_decoded == 2
+    # the decoded old image is removed
+    assert len(glob.glob(str(tmp_path / 'cache' / '*.npy'))) == 1
@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+from timeline import BLOCK_TYPES, STIMULI, check_timeline, compile_timeline, seconds_to_frames, transition_counts
+
+BLOCK_FRAMES = 360
+TRANSITION_PHASES = [2]*20
+
+
+def percepts(*durations):
+    """ draw_durations of compile_timeline that returns the given blocks of percept durations one after the other. """
+    blocks = iter(durations)
+    return lambda: next(blocks)
+
+
+def block_types(timeline):
+    """ Block types of the blocks in the order they are shown (without breaks). """
+    rows = timeline[timeline['block_type'] != BLOCK_TYPES.index('break')]
+    keys = list(dict.fromkeys(zip(rows['block_type'], rows['block_ID'])))
+    return [BLOCK_TYPES[block_type] for block_type, _ in keys]
+
+
+@pytest.mark.parametrize('start_condition, expected', [(0, ['unambiguous', 'rivalry', 'unambiguous', 'rivalry']),
+                                                       (1, ['rivalry', 'unambiguous', 'rivalry', 'unambiguous'])])
+def test_block_order(start_condition, expected):
+    timeline = compile_timeline(4, start_condition, BLOCK_FRAMES, 120, 60, TRANSITION_PHASES,
+                                percepts([100, 140, 120], [200, 160]), ['redface', 'redhouse'], ['redhouse', 'redface'])
+    assert block_types(timeline) == expected
+    # the phases follow each other without gaps
+    assert timeline['start_frame'][0] == 0
+    assert np.array_equal(timeline['start_frame'][1:], np.cumsum(timeline['duration'])[:-1])
+
+
+def test_unambiguous_block_with_transitions():
+    timeline = compile_timeline(2, 1, BLOCK_FRAMES, 120, 60, TRANSITION_PHASES, percepts([100, 140, 120]),
+                                ['redface'], ['redface'])
+    block = timeline[timeline['block_type'] == BLOCK_TYPES.index('unambiguous')]
+    assert block['duration'].sum() == BLOCK_FRAMES
+    stimuli = [STIMULI[stimulus] for stimulus in block['stimulus']]
+
+    # the percepts alternate between house and face, every switch is a transition of 20 phases centered on it
+    percept_rows = block['trial_nr'] > 0
+    trials = [stimuli[i] for i in range(len(block)) if block['phase'][i] == 0]
+    assert trials == [('house', 'redface'), ('house', 'hb2fr'), ('face', 'redface'), ('face', 'fr2hb'), ('house', 'redface')]
+    transitions = np.isin(block['stimulus'], [block['stimulus'][1]] + [block['stimulus'][22]])
+    assert np.array_equal(block['duration'][transitions], [2]*40)
+    assert np.array_equal(block['duration'][~transitions & percept_rows], [100 - 20, 140 - 40, 120 - 20])
+
+
+def test_trial_numbers():
+    timeline = compile_timeline(4, 0, BLOCK_FRAMES, 120, 60, [], percepts([180, 180], [360]),
+                                ['redface', 'redhouse'], ['redhouse', 'redface'])
+    trial_nrs = timeline['trial_nr'][(timeline['trial_nr'] > 0) & (timeline['phase'] == 0)]
+    assert np.array_equal(trial_nrs, np.arange(1, len(trial_nrs) + 1))
+    # breaks have trial_nr 0
+    assert np.all(timeline['trial_nr'][timeline['block_type'] == BLOCK_TYPES.index('break')] == 0)
+
+
+def test_replay_blocks():
+    timeline = compile_timeline(2, 1, BLOCK_FRAMES, 120, 60, TRANSITION_PHASES, percepts([180, 180]),
+                                ['redface'], ['redhouse'], replay=True)
+    assert block_types(timeline) == ['rivalry', 'replay', 'unambiguous']
+
+
+def test_percepts_have_to_fill_the_block():
+    with pytest.raises(ValueError, match='lasts 350 frames'):
+        compile_timeline(2, 1, BLOCK_FRAMES, 120, 60, TRANSITION_PHASES, percepts([200, 150]), ['redface'], ['redface'])
+
+
+def test_percept_too_short_for_transition():
+    with pytest.raises(ValueError, match='too short'):
+        compile_timeline(2, 1, BLOCK_FRAMES, 120, 60, TRANSITION_PHASES, percepts([15, 330, 15]), ['redface'], ['redface'])
+
+
+def test_check_timeline():
+    timeline = compile_timeline(2, 0, BLOCK_FRAMES, 120, 60, [], percepts([180, 180]), ['redface'], ['redhouse'])
+    check_timeline(timeline, BLOCK_FRAMES)
+    with pytest.raises(ValueError, match='instead of 300'):
+        check_timeline(timeline, 300)
+    timeline['duration'][-1] = -1
+    with pytest.raises(ValueError, match='negative'):
+        check_timeline(timeline, BLOCK_FRAMES)
+
+
+def test_seconds_to_frames():
+    assert seconds_to_frames(6, 60) == 360
+    assert seconds_to_frames(0.05, 60) == 3
+    with pytest.raises(ValueError):
+        seconds_to_frames(0.01, 60)
+
+
+def test_transition_counts():
+    task_settings = {'Monitor framerate': 60, 'Screentick conversion': 30, 'Nr fading stimuli': 255, 'Transition length': 40}
+    assert transition_counts(task_settings) == {'refresh_stimulus_speed': 2, 'transition_phases': [2]*20,
+                                                'transition_steps': 12, 'fading_phases': 21}
+    assert transition_counts({**task_settings, 'Nr fading stimuli': 0})['transition_phases'] == []
+
+
+@pytest.mark.parametrize('changed', [{'Screentick conversion': 25}, {'Transition length': 41}, {'Screentick conversion': 120},
+                                     {'Nr fading stimuli': 10}])
+def test_transition_counts_raise(changed):
+    task_settings = {'Monitor framerate': 60, 'Screentick conversion': 30, 'Nr fading stimuli': 255, 'Transition length': 40}
+    with pytest.raises(ValueError):
+        transition_counts({**task_settings, **changed})
@@ -0,0 +1,34 @@
+import threading
+from tracker import FileTracker, TrackerQueue
+
+
+class FailingTracker(FileTracker):
+    """ Tracker whose link fails for every message that contains 'fail'. """
+
+    def sendMessage(self, msg):
+        if 'fail' in msg:
+            raise RuntimeError('link lost')
+        super().sendMessage(msg)
+
+
+def finishes(function, timeout=5):
+    """ Whether function returns within timeout (s). """
+    thread = threading.Thread(target=function, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return not thread.is_alive()
+
+
+def test_failing_messages_do_not_hang_close(tmp_path):
+    tracker = FailingTracker(str(tmp_path / 'messages.txt'))
+    queue = TrackerQueue(tracker)
+    for i in range(10):
+        queue.sendMessage(f'fail-{i}' if i % 3 == 0 else f'message-{i}')
+
+    # close is passed on to the tracker once the queue is empty
+    assert finishes(queue.close)
+    assert finishes(queue.stop)
+    assert queue.nr_failed == 4
+    assert isinstance(queue.last_error, RuntimeError)
+    assert [msg for _, msg in tracker.messages] == [f'message-{i}' for i in range(10) if i % 3 != 0]
+    assert '4 failed' in queue.report()
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+'''
+@time    :   2022/03/28 09:37:15
+@author  :   rosagross
+@contact :   grossmann.rc@gmail.com
+
+
+The timeline holds the whole session as one numpy array with one row per trial phase
+(start frame, duration, stimulus, block and trial IDs). It is compiled before the session starts,
+so timing errors show up before the participant sits down, and the trials are created from it while the session runs.
+'''
+
+import numpy as np
+import random
+
+BLOCK_TYPES = ['break', 'rivalry', 'unambiguous', 'replay']
+
+# every stimulus is a (trial_type, color_comb) combination
+STIMULI = [('break', 'break'),
+           ('house_face', 'rivalry_redface'),
+           ('house_face', 'rivalry_redhouse'),
+           ('face', 'redface'),
+           ('face', 'redhouse'),
+           ('house', 'redface'),
+           ('house', 'redhouse'),
+           ('face', 'fr2hb'),
+           ('face', 'fb2hr'),
+           ('house', 'hb2fr'),
+           ('house', 'hr2fb'),
+           ('face', 'replay'),
+           ('house', 'replay'),
+           ('face', 'f2h'),
+           ('house', 'h2f')]
+STIMULUS_IDS = {stimulus: i for i, stimulus in enumerate(STIMULI)}
+# color combinations of the transition trials between two unambiguous (or replay) trials
+TRANSITIONS = ['hb2fr', 'fr2hb', 'hr2fb', 'fb2hr', 'f2h', 'h2f']
+
+TIMELINE_DTYPE = np.dtype([('trial', np.int32),        # running index of the trial in the session
+                           ('trial_nr', np.int32),     # trial number as logged (0 for breaks)
+                           ('block_ID', np.int32),
+                           ('block_type', np.int8),    # index into BLOCK_TYPES
+                           ('stimulus', np.int8),      # index into STIMULI
+                           ('phase', np.int16),
+                           ('start_frame', np.int64),
+                           ('duration', np.int32)])    # in frames
+
+
+def seconds_to_frames(seconds, refresh_rate, name='duration'):
+    """ Converts a duration in s to frames, raises a ValueError if it is not a whole number of frames. """
+    frames = seconds * refresh_rate
+    if abs(frames - round(frames)) > 1e-6:
+        raise ValueError(f"{name} of {seconds}s is not a whole number of frames at {refresh_rate}Hz ({frames} frames)")
+    return int(round(frames))
+
+
+def transition_counts(task_settings):
+    """
+    Frame counts of the fading transitions between two unambiguous trials, derived from the task settings.
+    A transition has Transition length / refresh_stimulus_speed phases of refresh_stimulus_speed
+    (Monitor framerate / Screentick conversion) frames, and every transition_steps-th of the fading images
+    is drawn (fading_phases of them). Raises a ValueError if the settings would shorten the transitions.
+
+    Returns
+    -------
+    dict
+        refresh_stimulus_speed, transition_phases (phase durations, empty without fading),
+        transition_steps and fading_phases
+    """
+    refresh_rate = task_settings['Monitor framerate']
+    screentick = task_settings['Screentick conversion']
+    nr_fading_stimuli = task_settings['Nr fading stimuli']
+    transition_length = task_settings['Transition length']
+    speed = refresh_rate / screentick
+    if (abs(speed - round(speed)) > 1e-6) or (round(speed) < 1):
+        raise ValueError(f"Monitor framerate {refresh_rate} / Screentick conversion {screentick} is not a whole number of frames ({speed})")
+    refresh_stimulus_speed = int(round(speed))
+    if nr_fading_stimuli == 0:
+        return {'refresh_stimulus_speed': refresh_stimulus_speed, 'transition_phases': [], 'transition_steps': 0, 'fading_phases': 0}
+
+    if (transition_length % refresh_stimulus_speed != 0) or (transition_length < refresh_stimulus_speed):
+        raise ValueError(f"Transition length of {transition_length} frames is not a multiple of {refresh_stimulus_speed} frames "
+                         f"(Monitor framerate / Screentick conversion)")
+    nr_phases = transition_length // refresh_stimulus_speed
+    # the fading images are skipped evenly, every phase draws one of them
+    transition_steps = nr_fading_stimuli // nr_phases
+    if transition_steps < 1:
+        raise ValueError(f"{nr_fading_stimuli} fading stimuli are not enough for a transition of {nr_phases} phases")
+    return {'refresh_stimulus_speed': refresh_stimulus_speed, 'transition_phases': [refresh_stimulus_speed]*nr_phases,
+            'transition_steps': transition_steps, 'fading_phases': nr_fading_stimuli // transition_steps}
+
+
+def fading_color(trial_type, color_comb):
+    """ Returns the transition that follows a trial (e.g. from blue house to red face: 'hb2fr'). """
+    if color_comb == 'replay':
+        return 'f2h' if trial_type == 'face' else 'h2f'
+    if (trial_type == 'house') & (color_comb == 'redface'):
+        return 'hb2fr'
+    elif (trial_type == 'face') & (color_comb == 'redface'):
+        return 'fr2hb'
+    elif (trial_type == 'house') & (color_comb == 'redhouse'):
+        return 'hr2fb'
+    return 'fb2hr'
+
+
+def nr_rivalry_blocks(n_blocks, start_condition):
+    """ Number of rivalry blocks in a session (rivalry and unambiguous blocks alternate). """
+    return len([i for i in range(n_blocks) if (i + 1 + start_condition) % 2 == 0])
+
+
+def block_colors(nr_blocks, rng=None):
+    """
+    Color combinations of the blocks of one type. Both combinations alternate, so the participant has had
+    both of them at least once, if there is an odd nr. of blocks the last one is chosen randomly.
+    Returns them in random order (drawn with rng, a numpy Generator, if it is given).
+    """
+    color_combinations = ['redface', 'redhouse']
+    colors_list = []
+    for i in range(nr_blocks):
+        if ((nr_blocks % 2) != 0) and (i == nr_blocks-1):
+            idx = (0 if random.uniform(1, 100) < 50 else 1) if rng is None else int(rng.integers(2))
+        else:
+            idx = 0 if (i % 2) == 0 else 1
+        colors_list.append(color_combinations[idx])
+
+    colors = np.array(colors_list)
+    if rng is None:
+        np.random.shuffle(colors)
+    else:
+        colors = rng.permutation(colors)
+    return colors
+
+
+def unambiguous_trials(phase_durations, first_trial_nr, color_comb, transition_phases, trial_types=None):
+    """
+    Splits an unambiguous block into trials. Every percept is one trial; between two percepts there is a
+    transition trial (with one phase per fading step) that is centered on the switch, so the frames of the
+    transition are taken from the end of the previous and the start of the next percept.
+    The percepts alternate between house and face, unless their trial_types are given (replay blocks).
+
+    Returns
+    -------
+    list
+        (trial_nr, trial_type, color_comb, phase durations) of every trial
+    """
+    transition_frames = int(np.sum(transition_phases))
+    # frames taken from the percept before and after every switch
+    cut_before = transition_frames // 2
+    cut_after = transition_frames - cut_before
+    nr_percepts = len(phase_durations)
+
+    trials = []
+    for i, phase_duration in enumerate(phase_durations):
+        trial_nr = first_trial_nr + i
+        if trial_types is None:
+            trial_type = 'house' if trial_nr % 2 == 0 else 'face'
+        else:
+            trial_type = trial_types[i]
+        duration = phase_duration - (cut_after if i > 0 else 0) - (cut_before if i < nr_percepts-1 else 0)
+        if duration <= 0:
+            raise ValueError(f"percept {i} of the {'replay' if color_comb == 'replay' else 'unambiguous'} block ({phase_duration} frames) is too short for "
+                             f"a transition of {transition_frames} frames")
+        trials.append((trial_nr, trial_type, color_comb, [duration]))
+        if (transition_frames > 0) and (i < nr_percepts-1):
+            trials.append((trial_nr, trial_type, fading_color(trial_type, color_comb), list(transition_phases)))
+    return trials
+
+
+def compile_timeline(n_blocks, start_condition, block_frames, break_frames, getready_frames, transition_phases, draw_durations,
+                     colors_rivalry=None, colors_unambiguous=None, replay=False):
+    """
+    Compiles the block order of the session into a timeline.
+    A replay block is only a placeholder (one trial that lasts the whole block), it is compiled from the percepts
+    of the rivalry block before it while the session runs (see splice_block).
+
+    Parameters
+    ----------
+    n_blocks : int
+        Number of blocks (rivalry and unambiguous blocks alternate)
+    start_condition : int
+        0 if the session starts with an unambiguous block, 1 if it starts with a rivalry block
+    block_frames : int
+        Duration of every rivalry, unambiguous and replay block in frames
+    break_frames, getready_frames : int
+        Duration of the break and of the fixation before every block in frames
+    transition_phases : list
+        Phase durations (frames) of the transition between two unambiguous trials (empty for no fading)
+    draw_durations : callable
+        Returns the percept durations (frames) of the next unambiguous block
+    colors_rivalry, colors_unambiguous : list
+        Color combinations of the rivalry and unambiguous blocks (default: drawn with block_colors)
+    replay : bool
+        Adds a replay block after every rivalry block (with a break before it)
+
+    Returns
+    -------
+    numpy.ndarray
+        Timeline (TIMELINE_DTYPE) with one row per trial phase
+    """
+    nr_rivalry = nr_rivalry_blocks(n_blocks, start_condition)
+    if colors_rivalry is None:
+        colors_rivalry = block_colors(nr_rivalry)
+    if colors_unambiguous is None:
+        colors_unambiguous = block_colors(n_blocks - nr_rivalry)
+
+    # (trial_nr, block_ID, block_type, trial_type, color_comb, phase durations) of every trial
+    trials = []
+    trial_nr = 1
+    block_ID_rivalry = 0
+    block_ID_unambig = 0
+    for i in range(n_blocks):
+        # we start counting with 1 because the blocks with ID 0 are breaks!
+        block_ID = i + 1
+
+        # before every block we have an interstimulus interval where only the fixation is seen
+        trials.append((0, 0, 'break', 'break', 'break', [0, getready_frames]))
+        # add a break if its not the first block
+        if not i == 0:
+            trials.append((0, 0, 'break', 'break', 'break', [break_frames, getready_frames]))
+
+        # equal subjects start with unambiguous, unequal with rivalry blocks
+        if (block_ID + start_condition) % 2 == 0:
+            color_comb = 'rivalry_' + colors_rivalry[block_ID_rivalry]
+            block_ID_rivalry += 1
+            trials.append((trial_nr, block_ID_rivalry, 'rivalry', 'house_face', color_comb, [block_frames]))
+            trial_nr += 1
+            if replay:
+                # the replay block has the ID of the rivalry block it replays
+                trials.append((0, 0, 'break', 'break', 'break', [0, getready_frames]))
+                trials.append((0, 0, 'break', 'break', 'break', [break_frames, getready_frames]))
+                trials.append((trial_nr, block_ID_rivalry, 'replay', 'face', 'replay', [block_frames]))
+                trial_nr += 1
+        else:
+            color_comb = colors_unambiguous[block_ID_unambig]
+            block_ID_unambig += 1
+            phase_durations = [int(duration) for duration in draw_durations()]
+            if sum(phase_durations) != block_frames:
+                raise ValueError(f"unambiguous block {block_ID_unambig} lasts {sum(phase_durations)} frames, "
+                                 f"but the rivalry blocks last {block_frames} frames")
+            for unambiguous_trial in unambiguous_trials(phase_durations, trial_nr, color_comb, transition_phases):
+                trials.append((unambiguous_trial[0], block_ID_unambig, 'unambiguous') + unambiguous_trial[1:])
+            trial_nr += len(phase_durations)
+
+    # have one break in the very end
+    trials.append((0, 0, 'break', 'break', 'break', [0, getready_frames]))
+
+    timeline = trials_to_timeline(trials)
+    check_timeline(timeline, block_frames)
+    return timeline
+
+
+def trials_to_timeline(trials):
+    """
+    Converts a list of trials (trial_nr, block_ID, block_type, trial_type, color_comb, phase durations)
+    into a timeline with one row per phase.
+    """
+    nr_phases = sum(len(trial[-1]) for trial in trials)
+    timeline = np.zeros(nr_phases, dtype=TIMELINE_DTYPE)
+    row = 0
+    for trial, (trial_nr, block_ID, block_type, trial_type, color_comb, durations) in enumerate(trials):
+        rows = slice(row, row + len(durations))
+        timeline['trial'][rows] = trial
+        timeline['trial_nr'][rows] = trial_nr
+        timeline['block_ID'][rows] = block_ID
+        timeline['block_type'][rows] = BLOCK_TYPES.index(block_type)
+        timeline['stimulus'][rows] = STIMULUS_IDS[(trial_type, color_comb)]
+        timeline['phase'][rows] = np.arange(len(durations))
+        timeline['duration'][rows] = durations
+        row += len(durations)
+    timeline['start_frame'][1:] = np.cumsum(timeline['duration'])[:-1]
+    return timeline
+
+
+def splice_block(timeline, block_type, block_ID, trials, block_frames):
+    """
+    Replaces the rows of a block with the rows of the given trials (see trials_to_timeline) and returns the new timeline.
+    The trials after the block are renumbered and their start frames shifted, the trial_nr of the block's trials
+    have to start with the trial_nr of the block's first trial.
+    """
+    rows = np.flatnonzero((timeline['block_type'] == BLOCK_TYPES.index(block_type)) & (timeline['block_ID'] == block_ID))
+    first, stop = rows[0], rows[-1] + 1
+    block = trials_to_timeline(trials)
+    block['trial'] += timeline['trial'][first]
+    after = timeline[stop:].copy()
+    after['trial'] += block['trial'][-1] - timeline['trial'][stop-1]
+    nr_added_trial_nrs = len(np.unique(block['trial_nr'])) - len(np.unique(timeline['trial_nr'][first:stop]))
+    after['trial_nr'][after['trial_nr'] > 0] += nr_added_trial_nrs
+
+    spliced = np.concatenate([timeline[:first], block, after])
+    spliced['start_frame'][1:] = np.cumsum(spliced['duration'])[:-1]
+    check_timeline(spliced, block_frames)
+    return spliced
+
+
+def check_timeline(timeline, block_frames):
+    """ Checks that every rivalry, unambiguous and replay block lasts exactly block_frames and no phase is negative. """
+    if np.any(timeline['duration'] < 0):
+        raise ValueError("the timeline contains phases with a negative duration")
+    for block_type in ('rivalry', 'unambiguous', 'replay'):
+        rows = timeline[timeline['block_type'] == BLOCK_TYPES.index(block_type)]
+        block_IDs, block_index = np.unique(rows['block_ID'], return_inverse=True)
+        totals = np.bincount(block_index, weights=rows['duration'], minlength=len(block_IDs))
+        for block_ID, total in zip(block_IDs, totals):
+            if total != block_frames:
+                raise ValueError(f"{block_type} block {block_ID} lasts {int(total)} frames instead of {block_frames}")
+
+
+def trial_rows(timeline, trial):
+    """ Rows (phases) of a trial (the running index in the timeline, which is sorted by it). """
+    start, stop = np.searchsorted(timeline['trial'], [trial, trial + 1])
+    return timeline[start:stop]
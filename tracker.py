@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+'''
+@time    :   2022/04/13 15:47:20
+@author  :   rosagross
+@contact :   grossmann.rc@gmail.com
+'''
+
+import queue
+import threading
+import time
+from time import perf_counter
+from analysis import RunningStats
+
+
+class TrackerQueue:
+    """
+    Sends the messages and commands to the eyetracker from a background thread, so the link calls do not block
+    the frame loop. Every message is sent with the time it waited in the queue as offset (in ms, in front of the
+    message text), the EyeLink then stores the message with the time it was queued.
+    A message or command that raises is counted and dropped, the ones after it are still sent.
+    All other calls (calibration, recording, data file) are passed on to the tracker once the queue is empty.
+    """
+
+    def __init__(self, tracker, clock=perf_counter):
+        """
+        Parameters
+        ----------
+        tracker : pylink.EyeLink
+            Tracker (or a stand-in like FileTracker) the messages are sent to
+        clock : callable
+            Returns the current time in s, used for the offsets of the messages
+        """
+        self.tracker = tracker
+        self.clock = clock
+        self.latency = RunningStats()
+        self.max_latency = 0.0
+        self.max_depth = 0
+        self.nr_failed = 0
+        self.last_error = None
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._send, name='TrackerQueue', daemon=True)
+        self._thread.start()
+
+    def _put(self, kind, text):
+        self._queue.put((kind, self.clock(), perf_counter(), text))
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+
+    def sendMessage(self, msg):
+        """ Queues a message, this never blocks. """
+        self._put('message', msg)
+
+    def sendCommand(self, cmd):
+        """ Queues a command, it is sent in order with the messages. """
+        self._put('command', cmd)
+
+    def _send(self):
+        while True:
+            kind, queued, queued_counter, text = self._queue.get()
+            try:
+                if kind is None:
+                    return
+                if kind == 'message':
+                    offset = int((self.clock() - queued) * 1000)
+                    self.tracker.sendMessage(f'{offset} {text}' if offset > 0 else text)
+                else:
+                    self.tracker.sendCommand(text)
+                latency = perf_counter() - queued_counter
+                self.latency.update(latency)
+                self.max_latency = max(self.max_latency, latency)
+            except Exception as error:
+                # the thread has to keep running, otherwise flush and the calls passed on to the tracker wait forever
+                self.nr_failed += 1
+                self.last_error = error
+            finally:
+                self._queue.task_done()
+
+    @property
+    def depth(self):
+        """ Number of messages and commands that are waiting to be sent. """
+        return self._queue.qsize()
+
+    def flush(self):
+        """ Waits until everything in the queue is sent. """
+        self._queue.join()
+
+    def __getattr__(self, name):
+        # everything else is called on the tracker itself, after the queued messages are sent
+        attr = getattr(self.tracker, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            self.flush()
+            return attr(*args, **kwargs)
+        return call
+
+    def report(self):
+        """ Returns the number of sent and failed messages, the send latency and the maximum queue depth as text. """
+        report = (f"eyetracker messages: {self.latency.n} sent, latency mean {self.latency.mean*1000:.3f}ms, "
+                  f"max {self.max_latency*1000:.3f}ms, max queue depth {self.max_depth}")
+        if self.nr_failed:
+            report += f", {self.nr_failed} failed (last error: {self.last_error!r})"
+        return report
+
+    def stop(self):
+        """ Sends everything that is queued and stops the background thread (the tracker is not closed). """
+        if self._thread.is_alive():
+            self._queue.put((None, None, None, None))
+            self._thread.join()
+
+
+class FileTracker:
+    """
+    Stand-in for the pylink tracker that writes the messages and commands to a text file (like the MSG lines
+    of an EyeLink .asc file), so the messages of a session can be checked without the eyetracker.
+    A number in front of a message is taken as offset in ms like the EyeLink does.
+    """
+
+    def __init__(self, path, clock=time.perf_counter):
+        """
+        Parameters
+        ----------
+        path : str
+            Path of the message file
+        clock : callable
+            Returns the current time in s
+        """
+        self.path = path
+        self.clock = clock
+        self.messages = []
+        self._file = open(path, 'w', buffering=1)
+
+    def sendMessage(self, msg):
+        t = int(self.clock() * 1000)
+        offset, _, text = msg.partition(' ')
+        if offset.isdigit() and text:
+            t, msg = t - int(offset), text
+        self.messages.append((t, msg))
+        self._file.write(f'MSG\t{t} {msg}\n')
+
+    def sendCommand(self, cmd):
+        self._file.write(f'CMD\t{int(self.clock() * 1000)} {cmd}\n')
+
+    def doTrackerSetup(self):
+        pass
+
+    def startRecording(self, *args):
+        pass
+
+    def stopRecording(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
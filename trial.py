@@ -10,6 +10,10 @@ from psychopy import event
 import numpy as np
 from exptools2.core.trial import Trial
 from psychopy.hardware import keyboard
+from time import perf_counter
+from profiling import HOOK_IDS
+from timeline import BLOCK_TYPES, TRANSITIONS
+from session_log import logger
 import os
 opj = os.path.join
 
@@ -38,74 +42,149 @@ class BRTrial(Trial):
         self.block_type = block_type
         self.trial_type = trial_type # this can be either house_face, house or face
         self.color_comb = color_comb # either redface or redhouse, used to draw correct image
+        # look up the stimulus once, so drawing it every frame is a single call
+        self.stimulus = session.resolve_stimulus(trial_type, color_comb)
+        # used to assign the frames to blocks and transitions in the frame report
+        self.block_type_ID = BLOCK_TYPES.index(block_type)
+        self.is_transition = color_comb in TRANSITIONS
         
             
     def draw(self):
         ''' This tells what happens in the trial, and this is defined in the session itself. '''
+        profiler = self.session.profiler
+        start = perf_counter()
+        if profiler is not None:
+            profiler.start_frame(start, self.block_ID, self.block_type_ID, self.is_transition)
         self.session.draw_stimulus(self.phase)
+        if self.session.monitor is not None:
+            self.session.monitor.frame(start, self)
+        if profiler is not None:
+            profiler.since(HOOK_IDS['draw'], start)
+
+
+    def log_phase_info(self, phase=None):
+        """ Logs the phase onset (like exptools2 does) and writes it to the session's journal. """
+        start = perf_counter()
+        phase = self.phase if phase is None else phase
+        nr_frames = self.session.nr_frames
+        super().log_phase_info(phase=phase)
+        # the parameters hold the trial_nr as well, so the record is built like the logged row
+        record = {'trial_nr': self.trial_nr, 'onset': self.session.global_log['onset'].iat[-1],
+                  'event_type': self.phase_names[phase], 'phase': phase, 'nr_frames': nr_frames, **self.parameters}
+        self.session.journal.write('phase', **record)
+        if (self.session.replay_recorder is not None) and (self.block_type == 'rivalry') and (phase == 0):
+            self.session.replay_recorder.start(record['onset'])
+        if self.session.monitor is not None:
+            self.session.monitor.publish('phase', self, phase=phase)
+        if self.eyetracker_on and self.is_transition:
+            # marks every step of a fading transition in the eyetracking data
+            self.session.tracker.sendMessage(f'transition-{self.color_comb}_trial-{self.trial_nr}_step-{phase}')
+        if self.session.profiler is not None:
+            self.session.profiler.since(HOOK_IDS['logging'], start)
 
 
     def get_events(self):
         """ Logs responses/triggers """
 
-        keys = self.session.kb.getKeys(waitRelease=True)
+        profiler = self.session.profiler
+        start = perf_counter()
+        # time of the logging and tracker hooks, it is not counted again in get_events
+        nested = 0
+        if self.session.response_capture == 'press':
+            # the key presses are logged at key-down, the ones that are held get their duration when released
+            keys = self.session.kb.getKeys(waitRelease=False)
+            if self.session.held_keys:
+                self.session.release_keys()
+        else:
+            keys = self.session.kb.getKeys(waitRelease=True)
         for thisKey in keys:
             if thisKey=='q':  # it is equivalent to the string 'q'
-                print("End experiment!")
+                logger.info("End experiment!")
                 self.session.save_output()
 
                 if self.session.settings['Task settings']['Screenshot']==True:
-                    print('\nSCREENSHOT\n')
+                    logger.info('SCREENSHOT')
                     self.session.win.saveMovieFrames(opj(self.session.screen_dir, self.session.output_str+'_Screenshot.png'))
                 self.session.close()
                 self.session.quit()
             else: 
-                print(thisKey.name, thisKey.tDown, thisKey.rt)
+                logger.debug("key %s, tDown %s, rt %s", thisKey.name, thisKey.tDown, thisKey.rt)
                 t = thisKey.rt
-                idx = self.session.global_log.shape[0]     
-                if self.block_type == 'unambiguous':
-                    self.session.unambiguous_responses += 1
+                correct = None
+                if self.block_type in ('unambiguous', 'replay'):
+                    if self.block_type == 'unambiguous':
+                        self.session.unambiguous_responses += 1
+                    else:
+                        self.session.replay_responses += 1
                     self.session.total_responses += 1
                     # check if the button was pressed correctly for the shift
-                    response_delay = t - self.session.global_log.loc[idx-1, 'onset']
-                    print("\nresponse delay:", response_delay)
-                    print("previous timing:", self.session.global_log.loc[idx-1, 'onset'])
+                    previous_onset = self.session.last_onset()
+                    response_delay = t - previous_onset
+                    logger.debug("response delay: %s", response_delay)
+                    logger.debug("previous timing: %s", previous_onset)
                     if (response_delay >= self.session.response_interval[0]) and (response_delay <= self.session.response_interval[1]):
-                        print("delay (within reponse interval!):", response_delay)
-                        self.session.correct_responses += 1 
+                        logger.debug("delay (within reponse interval!): %s", response_delay)
+                        if self.block_type == 'unambiguous':
+                            self.session.correct_responses += 1 
+                        else:
+                            self.session.correct_replay_responses += 1
+                        correct = True
                     else:
-                        print("respone took too long or was too quick!")
+                        logger.debug("respone took too long or was too quick!")
+                        correct = False
                 
                 if self.block_type == 'rivalry':
                     self.session.rivalry_responses += 1
                     self.session.total_responses += 1
+                    # the switch time is the time since the previous button press (or the stimulus onset)
+                    running_stats = self.session.running_stats
+                    running_stats.update(t - self.session.last_onset())
+                    logger.debug("percept duration: mean %.3fs, std %.3fs (n=%d)", running_stats.mean, running_stats.std, running_stats.n)
+                    if self.session.replay_recorder is not None:
+                        self.session.replay_recorder.add(t, thisKey.name)
 
                 event_type = self.trial_type
-                print("sessions clock", self.session.clock.getTime())
-                       
-                self.session.global_log.loc[idx, 'event_type'] = event_type
-                self.session.global_log.loc[idx, 'trial_nr'] = self.trial_nr
-                self.session.global_log.loc[idx, 'onset'] = t
-                self.session.global_log.loc[idx, 'key_duration'] = thisKey.duration
-                self.session.global_log.loc[idx, 'phase'] = self.phase
-                self.session.global_log.loc[idx, 'response'] = thisKey.name
-                self.session.global_log.loc[idx, 'response_button'] = self.session.response_button
-                self.session.global_log.loc[idx, 'nr_frames'] = 0
-
-                for param, val in self.parameters.items():
-                    self.session.global_log.loc[idx, param] = val
+                logger.debug("sessions clock %s", self.session.clock.getTime())
+
+                # the response is buffered and only merged into the global log when the output is saved
+                log_start = perf_counter()
+                response = {'event_type': event_type,
+                            'trial_nr': self.trial_nr,
+                            'onset': t,
+                            'key_duration': thisKey.duration,
+                            'phase': self.phase,
+                            'response': thisKey.name,
+                            'response_button': self.session.response_button,
+                            'nr_frames': 0,
+                            **self.parameters}
+                idx = self.session.response_log.append(response)
+                # where the response is merged into the global log (see events.merge_logs)
+                self.session.response_log.set(idx, 'log_position', len(self.session.global_log))
+                if thisKey.duration is None:
+                    self.session.held_keys.append((thisKey, idx))
+                self.session.journal.write('response', correct=correct, **response)
+                if self.session.monitor is not None:
+                    self.session.monitor.publish('response', self, thisKey.name, correct)
+                if profiler is not None:
+                    nested += profiler.since(HOOK_IDS['logging'], log_start)
 
                 if self.eyetracker_on:  # send message to eyetracker
+                    tracker_start = perf_counter()
                     msg = f'start_type-{event_type}_trial-{self.trial_nr}_phase-{self.phase}_key-{thisKey.name}_time-{t}_duration-{thisKey.duration}'
                     self.session.tracker.sendMessage(msg)
+                    if profiler is not None:
+                        nested += profiler.since(HOOK_IDS['tracker'], tracker_start)
 
                 if thisKey.name == 'p':
                     input('PAUSE. Press enter to continue.')
 
                 if thisKey.name in self.session.break_buttons:
-                    print('NEXT PHASE')
+                    logger.info('NEXT PHASE')
                     self.exit_phase = True
 
+        if profiler is not None:
+            profiler.record(HOOK_IDS['get_events'], perf_counter() - start - nested)
+
         
                     
 